@@ -1,4 +1,7 @@
 
+import os
+import sys
+
 from cornice import Service
 from cornice.service import get_services
 from cornice_swagger.swagger import CorniceSwagger
@@ -6,10 +9,18 @@ from pyramid.config import Configurator
 from pyramid.httpexceptions import HTTPNotFound
 from pyramid.paster import get_appsettings
 from pyramid.response import Response
+from pyramid.settings import asbool
 from pyramid.view import view_config, notfound_view_config
 
 from prometheus_client import generate_latest
 
+import managers
+from managers.models.file import File
+from managers.xml.validation import SCHEMAS_DIR
+from persistence.changes_notifier import ChangesNotifier
+from persistence.changes_writer import ChangesWriter
+from persistence.databases import DBFailed
+from persistence.pool import DBManagerPool
 
 import logging
 
@@ -57,6 +68,129 @@ def hide(param_name, param_value, name='password'):
     return param_value if name not in param_name else '*'*2*len(param_value)
 
 
+def get_db_settings(ini_config):
+    return {
+        'database_uri': '{}:{}'.format(
+            ini_config.get('catalogmanager.db.host', ''),
+            ini_config.get('catalogmanager.db.port', '')
+        ),
+        'database_username': ini_config.get(
+            'catalogmanager.db.username',
+            ''
+        ),
+        'database_password': ini_config.get(
+            'catalogmanager.db.password',
+            ''
+        ),
+    }
+
+
+def get_db_timeout(ini_config):
+    """
+    Obtém o timeout, em segundos, das conexões HTTP com o CouchDB, ou None
+    caso não seja configurado.
+    """
+    db_timeout = ini_config.get('catalogmanager.db.timeout')
+    return float(db_timeout) if db_timeout else None
+
+
+def get_xml_settings(ini_config):
+    xml_settings = {
+        'xml_streaming_threshold': int(
+            ini_config.get('catalogmanager.xml.streaming_threshold', 10485760)
+        ),
+        'xml_schemas_dir': None,
+    }
+    if asbool(ini_config.get('catalogmanager.xml.validate', False)):
+        xml_settings['xml_schemas_dir'] = ini_config.get(
+            'catalogmanager.xml.schemas_dir') or SCHEMAS_DIR
+    return xml_settings
+
+
+def provision_databases(argv=sys.argv):
+    """
+    Provisiona as bases de dados e seus índices a partir das configurações do
+    arquivo .ini informado. Ex.: provision_databases production.ini
+    """
+    if len(argv) != 2:
+        print('usage: {} <config_uri>'.format(argv[0]))
+        sys.exit(1)
+    settings = get_appsettings(argv[1])
+    managers.create_databases(database_timeout=get_db_timeout(settings),
+                              **get_db_settings(settings))
+
+
+def read_package(package_dir):
+    """
+    Lê o pacote do Artigo do diretório informado, cujo nome é o ID do
+    Artigo: o único arquivo .xml do diretório e os demais arquivos, os
+    ativos digitais.
+
+    Retorno:
+    Tupla com ID do Artigo, File do XML e lista de File dos ativos digitais
+
+    Erro:
+    ValueError: diretório sem exatamente um arquivo .xml
+    """
+    files = []
+    for file_name in sorted(os.listdir(package_dir)):
+        file_path = os.path.join(package_dir, file_name)
+        if os.path.isfile(file_path):
+            with open(file_path, 'rb') as fp:
+                files.append(File(file_name=file_name, content=fp.read()))
+    xml_files = [file for file in files if file.name.endswith('.xml')]
+    if len(xml_files) != 1:
+        raise ValueError(
+            'package {} must have exactly one XML file'.format(package_dir))
+    assets_files = [file for file in files if file is not xml_files[0]]
+    article_id = os.path.basename(os.path.normpath(package_dir))
+    return article_id, xml_files[0], assets_files
+
+
+def ingest_packages(argv=sys.argv):
+    """
+    Registra em lote os pacotes de Artigos dos diretórios informados, a
+    partir das configurações do arquivo .ini informado. Cada diretório
+    contém um pacote (read_package). Ex.:
+    ingest_packages production.ini pacotes/*
+    """
+    if len(argv) < 3:
+        print('usage: {} <config_uri> <package_dir>...'.format(argv[0]))
+        sys.exit(1)
+    settings = get_appsettings(argv[1])
+    db_settings = get_db_settings(settings)
+    db_settings.update(get_xml_settings(settings))
+    failed = []
+
+    def read_packages(package_dirs):
+        for package_dir in package_dirs:
+            try:
+                yield read_package(package_dir)
+            except (OSError, ValueError) as e:
+                print('{}: {}'.format(package_dir, e), file=sys.stderr)
+                failed.append(package_dir)
+
+    max_workers = settings.get('catalogmanager.ingest.max_workers')
+    max_in_flight = settings.get('catalogmanager.ingest.max_in_flight')
+    results = managers.ingest_packages(
+        read_packages(argv[2:]),
+        max_workers=int(max_workers) if max_workers else None,
+        max_in_flight=int(max_in_flight) if max_in_flight else None,
+        **db_settings
+    )
+    for result in results:
+        if result.error is not None:
+            print('{}: {}'.format(result.id, result.error), file=sys.stderr)
+            failed.append(result.id)
+        else:
+            print('{}: {} files written, {} missing, {} unexpected'.format(
+                result.id, len(result.updated),
+                len(result.missing_files_list),
+                len(result.unexpected_files_list)))
+    if failed:
+        sys.exit(1)
+
+
 def main(global_config, **settings):
     config = Configurator(settings=settings)
 
@@ -74,22 +208,50 @@ def main(global_config, **settings):
     config.add_route('home', '/')
     config.add_route('metrics', '/metrics')
 
+    config.registry.db_pool = DBManagerPool(
+        max_size=int(settings.get('catalogmanager.db.pool_size', 10)),
+        idle_timeout=int(
+            settings.get('catalogmanager.db.pool_idle_timeout', 300)),
+        timeout=get_db_timeout(settings)
+    )
+
+    # provisionamento com instâncias próprias, e não as do pool: este código
+    # é executado no processo principal (preload), e as conexões abertas
+    # pelo pool seriam herdadas pelos processos de trabalho
+    try:
+        managers.create_databases(database_timeout=get_db_timeout(settings),
+                                  **get_db_settings(settings))
+    except DBFailed:
+        LOGGER.warning('CatalogManager databases could not be provisioned')
+
+    changes_db_settings = get_db_settings(settings)
+    changes_db_settings['database_name'] = 'changes'
+    config.registry.changes_notifier = ChangesNotifier(
+        config.registry.db_pool.get(**changes_db_settings),
+        max_waiters=int(
+            settings.get('catalogmanager.changes.max_waiters', 2))
+    )
+
+    config.registry.changes_writer = None
+    if asbool(settings.get('catalogmanager.changes.buffered', False)):
+        config.registry.changes_writer = ChangesWriter(
+            config.registry.db_pool.get(**changes_db_settings),
+            batch_size=int(
+                settings.get('catalogmanager.changes.batch_size', 100)),
+            flush_interval=float(
+                settings.get('catalogmanager.changes.flush_interval', 1.0)),
+            queue_size=int(
+                settings.get('catalogmanager.changes.queue_size', 1000)),
+            changes_notifier=config.registry.changes_notifier
+        )
+
     def couchdb_settings(request):
-        ini_config = request.registry.settings
-        return {
-            'database_uri': '{}:{}'.format(
-                ini_config.get('catalogmanager.db.host', ''),
-                ini_config.get('catalogmanager.db.port', '')
-            ),
-            'database_username': ini_config.get(
-                'catalogmanager.db.username',
-                ''
-            ),
-            'database_password': ini_config.get(
-                'catalogmanager.db.password',
-                ''
-            )
-        }
+        db_settings = get_db_settings(request.registry.settings)
+        db_settings['database_pool'] = request.registry.db_pool
+        db_settings['changes_writer'] = request.registry.changes_writer
+        db_settings['changes_notifier'] = request.registry.changes_notifier
+        db_settings.update(get_xml_settings(request.registry.settings))
+        return db_settings
 
     config.add_request_method(couchdb_settings, 'db_settings', reify=True)
 
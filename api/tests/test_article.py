@@ -6,7 +6,10 @@ from lxml import etree
 from pyramid.httpexceptions import (
     HTTPInternalServerError,
     HTTPNotFound,
+    HTTPNotModified,
     HTTPBadRequest,
+    HTTPConflict,
+    HTTPRequestRangeNotSatisfiable,
     HTTPServiceUnavailable,
 )
 from webob.multidict import MultiDict
@@ -17,6 +20,8 @@ from api.views.article import (
     ArticleXML,
     ArticleAsset,
     ArticleManifest,
+    MAX_BYTE_RANGES,
+    parse_byte_ranges,
 )
 from managers.models.article_model import ArticleDocument
 from persistence.databases import DBFailed
@@ -30,6 +35,20 @@ def _get_file_property(filename, content, size):
     }
 
 
+def _no_public_xml(article_id, **db_settings):
+    # Artigo registrado sem o XML com URLs públicas
+    return None
+
+
+def _version_without_public_xml(article_id, **db_settings):
+    return {
+        'document_rev': '2-abc',
+        'created_date': '1500000000.0',
+        'updated_date': None,
+        'attachments': {},
+    }
+
+
 class MockCGIFieldStorage(object):
 
     def __init__(self, name, file):
@@ -73,6 +92,8 @@ def test_http_get_article_succeeded(mocked_get_article_data, dummy_request):
     assert response.json == expected
 
 
+@patch.object(managers, 'open_article_public_xml', _no_public_xml)
+@patch.object(managers, 'get_article_version', _version_without_public_xml)
 @patch.object(managers, 'get_article_file')
 def test_http_get_xml_file_article_not_found(mocked_get_article_file,
                                              dummy_request):
@@ -90,6 +111,8 @@ def test_http_get_xml_file_article_not_found(mocked_get_article_file,
     assert excinfo.value.message == error_msg
 
 
+@patch.object(managers, 'open_article_public_xml', _no_public_xml)
+@patch.object(managers, 'get_article_version', _version_without_public_xml)
 @patch.object(managers, 'get_article_file')
 def test_http_get_xml_file_not_found(mocked_get_article_file, dummy_request):
     article_id = 'ID123456'
@@ -106,6 +129,8 @@ def test_http_get_xml_file_not_found(mocked_get_article_file, dummy_request):
     assert excinfo.value.message == error_msg
 
 
+@patch.object(managers, 'open_article_public_xml', _no_public_xml)
+@patch.object(managers, 'get_article_version', _version_without_public_xml)
 @patch.object(managers, 'get_article_file')
 @patch.object(managers, 'get_article_data')
 def test_http_get_xml_file_calls_get_article_data(mocked_get_article_data,
@@ -124,6 +149,8 @@ def test_http_get_xml_file_calls_get_article_data(mocked_get_article_data,
     )
 
 
+@patch.object(managers, 'open_article_public_xml', _no_public_xml)
+@patch.object(managers, 'get_article_version', _version_without_public_xml)
 @patch.object(managers, 'get_article_file')
 @patch.object(managers, 'get_article_data')
 @patch.object(managers, 'set_assets_public_url')
@@ -161,6 +188,8 @@ def test_http_get_xml_file_calls_set_assets_public_url_if_there_is_assets(
     )
 
 
+@patch.object(managers, 'open_article_public_xml', _no_public_xml)
+@patch.object(managers, 'get_article_version', _version_without_public_xml)
 @patch.object(managers, 'get_article_file')
 @patch.object(managers, 'get_article_data')
 @patch.object(managers, 'set_assets_public_url')
@@ -187,6 +216,8 @@ def test_http_get_xml_file_doesnt_calls_set_assets_public_url_if_no_assets(
     mocked_set_assets_public_url.assert_not_called()
 
 
+@patch.object(managers, 'open_article_public_xml', _no_public_xml)
+@patch.object(managers, 'get_article_version', _version_without_public_xml)
 @patch.object(managers, 'get_article_file')
 @patch.object(managers, 'get_article_data')
 def test_http_get_xml_file_succeeded(mocked_get_article_data,
@@ -253,6 +284,48 @@ def test_http_article_calls_put_article_service_error(mocked_put_article,
     assert excinfo.value.message == error_msg
 
 
+@patch.object(managers, 'put_article')
+def test_http_article_put_invalid_xml_is_bad_request(mocked_put_article,
+                                                    dummy_request,
+                                                    test_xml_file):
+    xml_file = MockCGIFieldStorage("test_xml_file.xml",
+                                   BytesIO(test_xml_file.encode('utf-8')))
+    error_msg = 'XML file test_xml_file.xml is not valid'
+    mocked_put_article.side_effect = \
+        managers.article_manager.ArticleManagerInvalidXMLException(
+            message=error_msg
+        )
+    dummy_request.POST = MultiDict(
+        [('id', xml_file.filename), ('xml_file', xml_file)]
+    )
+
+    article_api = ArticleAPI(dummy_request)
+    with pytest.raises(HTTPBadRequest) as excinfo:
+        article_api.put()
+    assert excinfo.value.message == error_msg
+
+
+@patch.object(managers, 'put_article')
+def test_http_article_put_conflict(mocked_put_article,
+                                   dummy_request,
+                                   test_xml_file):
+    xml_file = MockCGIFieldStorage("test_xml_file.xml",
+                                   BytesIO(test_xml_file.encode('utf-8')))
+    error_msg = 'Article test_xml_file.xml was changed by another request'
+    mocked_put_article.side_effect = \
+        managers.article_manager.ArticleManagerConflictException(
+            message=error_msg
+        )
+    dummy_request.POST = MultiDict(
+        [('id', xml_file.filename), ('xml_file', xml_file)]
+    )
+
+    article_api = ArticleAPI(dummy_request)
+    with pytest.raises(HTTPConflict) as excinfo:
+        article_api.put()
+    assert excinfo.value.message == error_msg
+
+
 @patch.object(managers, 'put_article')
 def test_http_article_put_article_succeeded(mocked_put_article,
                                             dummy_request,
@@ -305,12 +378,19 @@ def test_http_article_put_article_with_assets(mocked_put_article,
     assert response.json.get('url').endswith(xml_file.filename)
 
 
-@patch.object(managers, 'get_asset_file')
-def test_http_get_asset_file_calls_get_asset_file(mocked_get_asset_file,
-                                                  dummy_request):
+@patch.object(managers, 'get_article_version')
+@patch.object(managers, 'open_asset_file')
+def test_http_get_asset_file_calls_open_asset_file(mocked_get_asset_file,
+                                                   mocked_get_version,
+                                                   dummy_request):
     article_id = 'ID123456'
     asset_id = 'ID123456'
-    mocked_get_asset_file.return_value = '', b'123456Test'
+    mocked_get_version.return_value = _asset_version(
+        asset_id, {'content_type': '', 'content_size': 10})
+    mocked_get_asset_file.return_value = (
+        BytesIO(b'123456Test'),
+        {'content_type': '', 'content_size': 10}
+    )
     dummy_request.matchdict = {
         'id': article_id,
         'asset_id': asset_id
@@ -320,17 +400,18 @@ def test_http_get_asset_file_calls_get_asset_file(mocked_get_asset_file,
     mocked_get_asset_file.assert_called_once_with(
         article_id=article_id,
         asset_id=asset_id,
+        byte_range=None,
         **dummy_request.db_settings
     )
     assert response.status_code == 200
 
 
-@patch.object(managers, 'get_asset_file')
-def test_http_get_asset_file_not_found(mocked_get_asset_file, dummy_request):
+@patch.object(managers, 'get_article_version')
+def test_http_get_asset_file_not_found(mocked_get_version, dummy_request):
     article_id = 'ID123456'
     asset_id = 'a.jpg'
     error_msg = 'Asset {} (Article {}) not found'.format(asset_id, article_id)
-    mocked_get_asset_file.side_effect = \
+    mocked_get_version.side_effect = \
         managers.article_manager.ArticleManagerException(
             message=error_msg
         )
@@ -344,15 +425,20 @@ def test_http_get_asset_file_not_found(mocked_get_asset_file, dummy_request):
     assert excinfo.value.message == error_msg
 
 
-@patch.object(managers, 'get_asset_file')
+@patch.object(managers, 'get_article_version')
+@patch.object(managers, 'open_asset_file')
 def test_http_get_asset_file_succeeded(mocked_get_asset_file,
+                                       mocked_get_version,
                                        dummy_request,
                                        test_xml_file):
     #XXX este teste deveria usar fixture num setup prévio ao invés de patch.
     article_id = 'ID123456'
     asset_id = 'a.jpg'
     expected = 'text/xml', test_xml_file.encode('utf-8')
-    mocked_get_asset_file.return_value = expected
+    properties = {'content_type': expected[0],
+                  'content_size': len(expected[1])}
+    mocked_get_asset_file.return_value = (BytesIO(expected[1]), properties)
+    mocked_get_version.return_value = _asset_version(asset_id, properties)
     dummy_request.matchdict = {
         'id': article_id,
         'asset_id': asset_id
@@ -362,6 +448,7 @@ def test_http_get_asset_file_succeeded(mocked_get_asset_file,
     assert response.status == '200 OK'
     assert response.body == expected[1]
     assert response.content_type == expected[0]
+    assert response.content_length == len(expected[1])
 
 
 @patch.object(managers, 'create_file')
@@ -483,3 +570,309 @@ def test_http_get_article_manifest_succeeded(
     response = article_api.get()
     assert response.status == '200 OK'
     assert response.json == expected
+
+
+def test_parse_byte_ranges():
+    assert parse_byte_ranges('bytes=0-9', 100) == [(0, 10)]
+    assert parse_byte_ranges('bytes=90-', 100) == [(90, 100)]
+    assert parse_byte_ranges('bytes=-10', 100) == [(90, 100)]
+    assert parse_byte_ranges('bytes=95-200', 100) == [(95, 100)]
+    assert parse_byte_ranges('bytes=0-0, -1', 100) == [(0, 1), (99, 100)]
+    assert parse_byte_ranges('bytes=100-', 100) == []
+    assert parse_byte_ranges('bytes=-0', 100) == []
+    assert parse_byte_ranges('bytes=9-0', 100) is None
+    assert parse_byte_ranges('bytes=a-b', 100) is None
+    assert parse_byte_ranges('items=0-9', 100) is None
+
+
+def test_parse_byte_ranges_coalesces_ranges():
+    assert parse_byte_ranges('bytes=50-59,0-9,5-19', 100) == [
+        (0, 20), (50, 60)]
+    assert parse_byte_ranges('bytes=0-9,10-19,-80', 100) == [(0, 100)]
+    assert parse_byte_ranges('bytes=0-0,0-0,0-0', 100) == [(0, 1)]
+
+
+def test_parse_byte_ranges_too_many_ranges():
+    ranges = ','.join('{0}-{0}'.format(i * 2)
+                      for i in range(MAX_BYTE_RANGES))
+    assert len(parse_byte_ranges('bytes=' + ranges, 100)) == MAX_BYTE_RANGES
+    assert parse_byte_ranges('bytes=' + ranges + ',99-', 100) is None
+
+
+def _asset_version(asset_id, properties):
+    return {
+        'document_rev': '2-abc',
+        'created_date': '1500000000.0',
+        'updated_date': '1500000100.0',
+        'attachments': {asset_id: properties},
+    }
+
+
+def _asset_request(dummy_request, content, range_header):
+    def open_asset_file(article_id, asset_id, byte_range=None, **kwargs):
+        if byte_range is not None:
+            return BytesIO(content[byte_range[0]:byte_range[1]]), properties
+        return BytesIO(content), properties
+
+    properties = {
+        'content_type': 'image/jpeg',
+        'content_size': len(content),
+        'digest': 'md5-abc',
+    }
+    version = _asset_version('a.jpg', properties)
+    dummy_request.matchdict = {'id': 'ID123456', 'asset_id': 'a.jpg'}
+    if range_header:
+        dummy_request.headers['Range'] = range_header
+    return (
+        patch.object(managers, 'open_asset_file', side_effect=open_asset_file),
+        patch.object(managers, 'get_article_version', return_value=version),
+    )
+
+
+def test_http_get_asset_file_sends_validators(dummy_request):
+    patch_open, patch_version = _asset_request(dummy_request, b'123', None)
+    with patch_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+        body = b''.join(response.app_iter)
+    assert response.status_code == 200
+    assert body == b'123'
+    assert response.etag == 'md5-abc'
+    assert response.last_modified.timestamp() == 1500000100
+
+
+def test_http_get_asset_file_single_range(dummy_request):
+    content = bytes(range(100))
+    patch_open, patch_version = _asset_request(dummy_request, content,
+                                                  'bytes=10-19')
+    with patch_open as mocked_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+        body = b''.join(response.app_iter)
+    assert response.status_code == 206
+    assert body == content[10:20]
+    assert response.content_length == 10
+    assert response.headers['Content-Range'] == 'bytes 10-19/100'
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert mocked_open.call_args[1]['byte_range'] == (10, 20)
+
+
+def test_http_get_asset_file_multiple_ranges(dummy_request):
+    content = bytes(range(100))
+    patch_open, patch_version = _asset_request(dummy_request, content,
+                                                  'bytes=0-4,-5')
+    with patch_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+        body = b''.join(response.app_iter)
+    assert response.status_code == 206
+    assert response.content_type == 'multipart/byteranges'
+    assert response.content_length == len(body)
+    boundary = response.content_type_params['boundary']
+    parts = body.split(('--' + boundary).encode())
+    assert parts[1].endswith(b'\r\n\r\n' + content[:5] + b'\r\n')
+    assert b'Content-Range: bytes 0-4/100' in parts[1]
+    assert parts[2].endswith(b'\r\n\r\n' + content[-5:] + b'\r\n')
+    assert b'Content-Range: bytes 95-99/100' in parts[2]
+    assert parts[3] == b'--\r\n'
+
+
+def test_http_get_asset_file_too_many_ranges(dummy_request):
+    content = bytes(range(100))
+    patch_open, patch_version = _asset_request(
+        dummy_request, content, 'bytes=' + ','.join(['0-0'] * 100))
+    with patch_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+        body = b''.join(response.app_iter)
+    assert response.status_code == 200
+    assert body == content
+
+
+def test_http_get_asset_file_range_not_satisfiable(dummy_request):
+    patch_open, patch_version = _asset_request(dummy_request, b'123',
+                                                  'bytes=10-')
+    with patch_open, patch_version:
+        with pytest.raises(HTTPRequestRangeNotSatisfiable) as excinfo:
+            ArticleAsset(dummy_request).get()
+    assert excinfo.value.headers['Content-Range'] == 'bytes */3'
+
+
+def test_http_get_asset_file_if_range_does_not_match(dummy_request):
+    content = bytes(range(100))
+    patch_open, patch_version = _asset_request(dummy_request, content,
+                                               'bytes=10-19')
+    dummy_request.headers['If-Range'] = '"md5-old"'
+    with patch_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+        body = b''.join(response.app_iter)
+    assert response.status_code == 200
+    assert body == content
+    assert response.etag == 'md5-abc'
+
+
+def test_http_get_asset_file_not_modified(dummy_request):
+    patch_open, patch_version = _asset_request(dummy_request, b'123', None)
+    dummy_request.headers['If-None-Match'] = '"md5-abc"'
+    with patch_open as mocked_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+    assert isinstance(response, HTTPNotModified)
+    assert response.etag == 'md5-abc'
+    mocked_open.assert_not_called()
+
+
+def test_http_get_asset_file_modified(dummy_request):
+    patch_open, patch_version = _asset_request(dummy_request, b'123', None)
+    dummy_request.headers['If-None-Match'] = '"md5-old"'
+    with patch_open, patch_version:
+        response = ArticleAsset(dummy_request).get()
+        body = b''.join(response.app_iter)
+    assert response.status_code == 200
+    assert body == b'123'
+    assert response.etag == 'md5-abc'
+    assert response.last_modified.timestamp() == 1500000100
+
+
+def _article_version():
+    return {
+        'document_id': 'ID123456',
+        'document_type': 'ART',
+        'content': {'xml': 'test.xml', 'assets': []},
+        'document_rev': '2-abc',
+        'created_date': '1500000000.0',
+        'updated_date': '1500000100.5',
+        'attachments': {},
+    }
+
+
+@patch.object(managers, 'get_article_data')
+def test_http_get_article_sets_validators(mocked_get_article_data,
+                                         dummy_request):
+    mocked_get_article_data.return_value = _article_version()
+    dummy_request.matchdict = {'id': 'ID123456'}
+    response = ArticleAPI(dummy_request).get()
+    assert response.status_code == 200
+    assert response.etag == '2-abc'
+    assert response.last_modified.timestamp() == 1500000100
+
+
+@patch.object(managers, 'get_article_data')
+@patch.object(managers, 'get_article_version')
+def test_http_get_article_if_none_match(mocked_get_article_version,
+                                        mocked_get_article_data,
+                                        dummy_request):
+    mocked_get_article_version.return_value = _article_version()
+    dummy_request.matchdict = {'id': 'ID123456'}
+    dummy_request.headers['If-None-Match'] = '"1-old", "2-abc"'
+    response = ArticleAPI(dummy_request).get()
+    assert isinstance(response, HTTPNotModified)
+    assert response.etag == '2-abc'
+    mocked_get_article_data.assert_not_called()
+
+
+@patch.object(managers, 'get_article_data')
+@patch.object(managers, 'get_article_version')
+def test_http_get_article_if_modified_since(mocked_get_article_version,
+                                            mocked_get_article_data,
+                                            dummy_request):
+    mocked_get_article_version.return_value = _article_version()
+    mocked_get_article_data.return_value = _article_version()
+    dummy_request.matchdict = {'id': 'ID123456'}
+    dummy_request.headers['If-Modified-Since'] = \
+        'Fri, 14 Jul 2017 02:41:40 GMT'
+    assert isinstance(ArticleAPI(dummy_request).get(), HTTPNotModified)
+
+    dummy_request.headers['If-Modified-Since'] = \
+        'Fri, 14 Jul 2017 02:41:39 GMT'
+    response = ArticleAPI(dummy_request).get()
+    assert response.status_code == 200
+    mocked_get_article_data.assert_called_once()
+
+
+@patch.object(managers, 'get_article_file')
+@patch.object(managers, 'get_article_version')
+def test_http_get_xml_file_if_none_match(mocked_get_article_version,
+                                         mocked_get_article_file,
+                                         dummy_request):
+    mocked_get_article_version.return_value = _article_version()
+    dummy_request.matchdict = {'id': 'ID123456'}
+    dummy_request.headers['If-None-Match'] = '"2-abc-xml"'
+    response = ArticleXML(dummy_request).get()
+    assert isinstance(response, HTTPNotModified)
+    mocked_get_article_file.assert_not_called()
+
+
+@patch.object(managers, 'get_article_document')
+@patch.object(managers, 'get_article_version')
+def test_http_get_article_manifest_if_none_match(
+        mocked_get_article_version,
+        mocked_get_article_document,
+        dummy_request):
+    article_document = ArticleDocument('ID123456')
+    article_document.set_data(_article_version())
+    mocked_get_article_document.return_value = article_document
+    mocked_get_article_version.return_value = _article_version()
+    dummy_request.matchdict = {'id': 'ID123456'}
+    dummy_request.headers['If-None-Match'] = '"2-abc"'
+    response = ArticleManifest(dummy_request).get()
+    assert response.status_code == 200
+    assert response.etag == '2-abc-manifest'
+
+    dummy_request.headers['If-None-Match'] = '"2-abc-manifest"'
+    response = ArticleManifest(dummy_request).get()
+    assert isinstance(response, HTTPNotModified)
+    mocked_get_article_document.assert_called_once()
+
+
+def _version_with_public_xml():
+    version = _article_version()
+    version['attachments'] = {
+        managers.article_manager.PUBLIC_XML_FILE_ID: {
+            'content_type': 'application/xml',
+            'content_size': 10,
+            'digest': 'md5-abc',
+        }
+    }
+    return version
+
+
+@patch.object(managers, 'get_article_file')
+@patch.object(managers, 'open_article_public_xml')
+@patch.object(managers, 'get_article_version')
+def test_http_get_xml_file_streams_public_xml(mocked_get_article_version,
+                                              mocked_open_article_public_xml,
+                                              mocked_get_article_file,
+                                              dummy_request):
+    mocked_get_article_version.return_value = _version_with_public_xml()
+    mocked_open_article_public_xml.return_value = (
+        BytesIO(b'<article/>'),
+        {
+            'content_type': 'application/xml',
+            'content_size': 10,
+            'digest': 'q83vEjRWeJA=',
+        }
+    )
+    dummy_request.matchdict = {'id': 'ID123456'}
+    response = ArticleXML(dummy_request).get()
+    assert response.status_code == 200
+    assert response.content_type == 'application/xml'
+    assert b''.join(response.app_iter) == b'<article/>'
+    # os validadores são os mesmos das requisições condicionais
+    assert response.etag == 'md5-abc'
+    assert response.last_modified.timestamp() == 1500000100
+    mocked_open_article_public_xml.assert_called_once_with(
+        article_id='ID123456',
+        **dummy_request.db_settings
+    )
+    mocked_get_article_file.assert_not_called()
+
+
+@patch.object(managers, 'open_article_public_xml')
+@patch.object(managers, 'get_article_version')
+def test_http_get_xml_file_public_xml_if_none_match(
+        mocked_get_article_version,
+        mocked_open_article_public_xml,
+        dummy_request):
+    version = _version_with_public_xml()
+    mocked_get_article_version.return_value = version
+    dummy_request.matchdict = {'id': 'ID123456'}
+    dummy_request.headers['If-None-Match'] = '"md5-abc"'
+    response = ArticleXML(dummy_request).get()
+    assert isinstance(response, HTTPNotModified)
+    mocked_open_article_public_xml.assert_not_called()
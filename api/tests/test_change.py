@@ -1,11 +1,18 @@
+import json
+import threading
 from unittest.mock import patch
 
+import pytest
+from pyramid.httpexceptions import HTTPServiceUnavailable
+
 from api.views.change import ChangeAPI
+from persistence.changes_notifier import ChangesNotifier
 
 
 @patch('managers.list_changes')
 def test_change_api_collection_post_calls_list_changes(mocked_list_changes,
                                                        dummy_request):
+    mocked_list_changes.return_value = []
     dummy_request.GET = {
         'since': '123456',
         'limit': 100,
@@ -13,7 +20,7 @@ def test_change_api_collection_post_calls_list_changes(mocked_list_changes,
     ChangeAPI.collection_get(ChangeAPI(dummy_request))
 
     mocked_list_changes.assert_called_once_with(
-        last_sequence=dummy_request.GET['since'],
+        last_sequence=int(dummy_request.GET['since']),
         limit=dummy_request.GET['limit'],
         **dummy_request.db_settings
     )
@@ -39,3 +46,162 @@ def test_change_api_collection_post_return_changes_list(mocked_list_changes,
     response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
     assert response.status_code == 200
     assert response.json == expected
+    assert response.headers['X-Next-Since'] == '123465'
+
+
+@patch('managers.list_changes')
+def test_change_api_collection_get_limits_page_size(mocked_list_changes,
+                                                    dummy_request):
+    mocked_list_changes.return_value = []
+    dummy_request.registry.settings = {
+        'catalogmanager.changes.max_limit': '50',
+    }
+    dummy_request.GET = {
+        'since': '123456',
+        'limit': 100,
+    }
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+
+    mocked_list_changes.assert_called_once_with(
+        last_sequence=123456,
+        limit=50,
+        **dummy_request.db_settings
+    )
+    assert response.headers['X-Next-Since'] == '123456'
+
+
+@patch('managers.iter_changes')
+def test_change_api_collection_get_streams_ndjson(mocked_iter_changes,
+                                                  dummy_request):
+    expected = [
+        {
+            "change_id": id,
+            "document_id": "ID-{}".format(id),
+            "document_type": "ART",
+            "type": "CREATE"
+        }
+        for id in range(1, 4)
+    ]
+    mocked_iter_changes.return_value = iter(expected)
+    dummy_request.headers['Accept'] = 'application/x-ndjson'
+    dummy_request.GET = {}
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+
+    assert response.content_type == 'application/x-ndjson'
+    assert [
+        json.loads(line)
+        for line in b''.join(response.app_iter).splitlines()
+    ] == expected
+    assert mocked_iter_changes.call_args[1]['limit'] == 0
+
+
+@patch('managers.list_changes')
+def test_change_api_collection_get_long_poll_waits_for_changes(
+        mocked_list_changes, dummy_request):
+    expected = [
+        {
+            "change_id": 123457,
+            "document_id": "ID-123457",
+            "document_type": "ART",
+            "type": "CREATE"
+        }
+    ]
+    changes_notifier = ChangesNotifier()
+    mocked_list_changes.side_effect = [[], expected]
+    dummy_request.db_settings['changes_notifier'] = changes_notifier
+    dummy_request.GET = {
+        'since': '123456',
+        'feed': 'longpoll',
+        'timeout': '5',
+    }
+    threading.Timer(0.05, changes_notifier.notify).start()
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+
+    assert response.json == expected
+    assert mocked_list_changes.call_count == 2
+
+
+@patch('managers.list_changes')
+def test_change_api_collection_get_long_poll_times_out(mocked_list_changes,
+                                                       dummy_request):
+    mocked_list_changes.return_value = []
+    dummy_request.GET = {
+        'since': '123456',
+        'feed': 'longpoll',
+        'timeout': '0.01',
+    }
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+
+    assert response.json == []
+    assert response.headers['X-Next-Since'] == '123456'
+
+
+@patch('managers.list_changes')
+def test_change_api_collection_get_event_source(mocked_list_changes,
+                                                dummy_request):
+    change = {
+        "change_id": 123457,
+        "document_id": "ID-123457",
+        "document_type": "ART",
+        "type": "CREATE"
+    }
+    mocked_list_changes.side_effect = [[change], [], []]
+    dummy_request.headers['Last-Event-ID'] = '123456'
+    dummy_request.GET = {
+        'feed': 'eventsource',
+        'timeout': '0.01',
+    }
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+    body = b''.join(response.app_iter)
+
+    assert response.content_type == 'text/event-stream'
+    assert body.startswith(
+        'id: 123457\ndata: {}\n\n'.format(json.dumps(change)).encode())
+    assert mocked_list_changes.call_args_list[0][1]['last_sequence'] == \
+        123456
+    assert mocked_list_changes.call_args_list[1][1]['last_sequence'] == \
+        123457
+
+
+@patch('managers.list_changes')
+def test_change_api_collection_get_long_poll_limits_waiters(
+        mocked_list_changes, dummy_request):
+    mocked_list_changes.return_value = []
+    changes_notifier = ChangesNotifier(max_waiters=1)
+    assert changes_notifier.acquire_waiter()
+    dummy_request.db_settings['changes_notifier'] = changes_notifier
+    dummy_request.GET = {
+        'since': '123456',
+        'feed': 'longpoll',
+        'timeout': '0.01',
+    }
+    with pytest.raises(HTTPServiceUnavailable) as excinfo:
+        ChangeAPI.collection_get(ChangeAPI(dummy_request))
+    assert excinfo.value.headers['Retry-After'] == '5'
+
+    changes_notifier.release_waiter()
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+    assert response.json == []
+    assert changes_notifier.acquire_waiter()
+
+
+@patch('managers.list_changes')
+def test_change_api_collection_get_event_source_limits_waiters(
+        mocked_list_changes, dummy_request):
+    mocked_list_changes.return_value = []
+    changes_notifier = ChangesNotifier(max_waiters=1)
+    dummy_request.db_settings['changes_notifier'] = changes_notifier
+    dummy_request.GET = {
+        'feed': 'eventsource',
+        'timeout': '0.01',
+    }
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+    with pytest.raises(HTTPServiceUnavailable):
+        ChangeAPI.collection_get(ChangeAPI(dummy_request))
+
+    # a vaga é liberada quando o servidor encerra a resposta, mesmo sem
+    # iterá-la
+    response.app_iter.close()
+    response = ChangeAPI.collection_get(ChangeAPI(dummy_request))
+    b''.join(response.app_iter)
+    assert changes_notifier.acquire_waiter()
@@ -0,0 +1,48 @@
+import configparser
+import os
+from unittest.mock import patch
+
+import pytest
+
+from api import main
+
+
+@patch('managers.create_databases')
+def test_main_provisions_databases_without_pooled_connections(
+        mocked_create_databases):
+    settings = {
+        'catalogmanager.db.host': 'http://localhost',
+        'catalogmanager.db.port': '12345',
+    }
+    main({}, **settings)
+    mocked_create_databases.assert_called_once_with(
+        database_uri='http://localhost:12345',
+        database_username='',
+        database_password='',
+        database_timeout=None,
+    )
+
+
+@patch('managers.create_databases')
+def test_main_provisions_databases_with_db_timeout(mocked_create_databases):
+    settings = {
+        'catalogmanager.db.host': 'http://localhost',
+        'catalogmanager.db.port': '12345',
+        'catalogmanager.db.timeout': '5',
+    }
+    main({}, **settings)
+    assert mocked_create_databases.call_args[1]['database_timeout'] == 5.0
+
+
+@pytest.mark.parametrize('ini_file', ['development.ini', 'production.ini'])
+def test_changes_waiters_leave_server_threads_free(ini_file):
+    # cada consumidor em espera do feed de mudanças ocupa uma thread do
+    # servidor, que deve ter threads livres para as demais requisições
+    config = configparser.ConfigParser(interpolation=None)
+    config.read(os.path.join(os.path.dirname(__file__), '..', '..', ini_file))
+    max_waiters = config.getint('app:main',
+                                'catalogmanager.changes.max_waiters')
+    threads = config.getint('server:main', 'threads')
+    assert 0 < max_waiters < threads
+    if config.get('server:main', 'use') == 'egg:gunicorn#main':
+        assert config.get('server:main', 'worker_class') == 'gthread'
@@ -1,19 +1,33 @@
 import io
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
 
 from pyramid.httpexceptions import (
     HTTPNotFound,
+    HTTPNotModified,
     HTTPInternalServerError,
     HTTPBadRequest,
+    HTTPConflict,
+    HTTPRequestRangeNotSatisfiable,
     HTTPServiceUnavailable,
 )
-from pyramid.response import Response
+from pyramid.response import FileIter, Response
 from cornice.resource import resource
 from prometheus_client import Summary
+from webob.datetime_utils import parse_date
+from webob.etag import ETagMatcher
 
 import managers
 
 
+# tamanho das partes em que os ativos digitais são enviados
+ASSET_BLOCK_SIZE = 64 * 1024
+
+# quantidade máxima de intervalos do cabeçalho Range; acima dela, o
+# cabeçalho é ignorado e o ativo é enviado inteiro
+MAX_BYTE_RANGES = 16
+
 REQUEST_TIME_API_ARTICLE_GET = Summary(
     'api_article_get_request_processing_seconds',
     'Time spent processing api article get')
@@ -28,6 +42,95 @@ REQUEST_TIME_API_ARTICLE_PUT = Summary(
     'Time spent processing api article put')
 
 
+def is_conditional(request):
+    """
+    Verifica se a requisição é condicional (If-None-Match ou
+    If-Modified-Since).
+    """
+    return bool(request.headers.get('If-None-Match') or
+                request.headers.get('If-Modified-Since'))
+
+
+def is_not_modified(request, etag, last_modified):
+    """
+    Avalia as pré-condições If-None-Match e If-Modified-Since da requisição.
+    Caso If-None-Match seja informado, If-Modified-Since é ignorado
+    (RFC 7232).
+
+    :param request: requisição HTTP
+    :param etag: ETag (sem aspas) da representação atual do recurso
+    :param last_modified: data (datetime) da última alteração do recurso
+
+    :returns: True caso o cliente já possua a representação atual
+    """
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        return etag is not None and etag in ETagMatcher.parse(if_none_match)
+    if_modified_since = parse_date(request.headers.get('If-Modified-Since'))
+    if if_modified_since is not None and last_modified is not None:
+        # Last-Modified é enviado com precisão de segundos
+        return last_modified.replace(microsecond=0) <= if_modified_since
+    return False
+
+
+def set_validators(response, etag, last_modified):
+    """
+    Define os cabeçalhos ETag e Last-Modified da resposta, quando conhecidos.
+    """
+    if etag:
+        response.etag = etag
+    if last_modified is not None:
+        response.last_modified = last_modified
+    return response
+
+
+def get_last_modified(version):
+    """
+    Obtém a data da última alteração do registro do Artigo (updated_date ou,
+    caso nunca tenha sido atualizado, created_date).
+    """
+    timestamp = version.get('updated_date') or version.get('created_date')
+    if timestamp:
+        return datetime.fromtimestamp(float(timestamp), timezone.utc)
+
+
+def get_article_validators(version, representation=None):
+    """
+    Obtém ETag e Last-Modified de uma representação do Artigo. A revisão do
+    registro muda a cada alteração do registro e dos seus arquivos, de modo
+    que identifica cada versão de todas as representações do Artigo.
+
+    :param version: dicionário com document_rev, created_date e updated_date
+    :param representation: (opcional) sufixo que distingue a representação
+
+    :returns: tupla (ETag, Last-Modified)
+    """
+    etag = version.get('document_rev')
+    if etag is not None:
+        etag = str(etag)
+        if representation is not None:
+            etag = '{}-{}'.format(etag, representation)
+    return etag, get_last_modified(version)
+
+
+def get_article_not_modified(request, representation=None):
+    """
+    Para requisições condicionais, obtém somente a revisão e as datas do
+    Artigo e, caso a representação do cliente seja a atual, retorna a
+    resposta 304 (Not Modified). Retorna None caso a representação deva ser
+    enviada.
+    """
+    if not is_conditional(request):
+        return None
+    version = managers.get_article_version(
+        article_id=request.matchdict['id'],
+        **request.db_settings
+    )
+    etag, last_modified = get_article_validators(version, representation)
+    if is_not_modified(request, etag, last_modified):
+        return set_validators(HTTPNotModified(), etag, last_modified)
+
+
 @resource(collection_path='/articles', path='/articles/{id}', renderer='json',
           tags=['articles'])
 class ArticleAPI:
@@ -58,6 +161,12 @@ class ArticleAPI:
                 'url': '/rawfiles/7ca9f9b2687cb/' + xml_file_field.filename
             }
             return Response(status_code=201, json=body)
+        except managers.article_manager.ArticleManagerInvalidXMLException \
+                as e:
+            raise HTTPBadRequest(detail=e.message)
+        except managers.article_manager.ArticleManagerConflictException \
+                as e:
+            raise HTTPConflict(detail=e.message)
         except managers.article_manager.ArticleManagerException as e:
             raise HTTPInternalServerError(detail=e.message)
 
@@ -87,6 +196,14 @@ class ArticleAPI:
                 'url': '/rawfiles/7ca9f9b2687cb/' + xml_file_field.filename
             }
             return Response(status_code=200, json=body)
+        except managers.article_manager.ArticleManagerInvalidXMLException \
+                as e:
+            # XML mal formado, inválido ou sem schema: erro do cliente
+            raise HTTPBadRequest(detail=e.message)
+        except managers.article_manager.ArticleManagerConflictException \
+                as e:
+            # registro alterado por outra requisição durante a escrita
+            raise HTTPConflict(detail=e.message)
         except managers.article_manager.ArticleManagerException as e:
             #XXX a exceção tratada aqui está sinalizando uma miríade de
             #situações excepcionais, que abarca erro de dado fornecido pelo
@@ -95,13 +212,20 @@ class ArticleAPI:
 
     @REQUEST_TIME_API_ARTICLE_GET.time()
     def get(self):
-        """Returns Article document metadata."""
+        """Returns Article document metadata. Supports conditional requests
+        (If-None-Match and If-Modified-Since)."""
         try:
+            not_modified = get_article_not_modified(self.request)
+            if not_modified is not None:
+                return not_modified
             article_data = managers.get_article_data(
                 article_id=self.request.matchdict['id'],
                 **self.request.db_settings
             )
-            return Response(status_code=200, json=article_data)
+            return set_validators(
+                Response(status_code=200, json=article_data),
+                *get_article_validators(article_data)
+            )
         except managers.article_manager.ArticleManagerException as e:
             raise HTTPNotFound(detail=e.message)
 
@@ -114,13 +238,25 @@ class ArticleManifest:
         self.context = context
 
     def get(self):
-        """Returns Article document manifest."""
+        """Returns Article document manifest. Supports conditional requests
+        (If-None-Match and If-Modified-Since)."""
         try:
+            not_modified = get_article_not_modified(self.request, 'manifest')
+            if not_modified is not None:
+                return not_modified
             article_document = managers.get_article_document(
                 article_id=self.request.matchdict['id'],
                 **self.request.db_settings
             )
-            return Response(status_code=200, json=article_document.manifest)
+            version = {
+                'document_rev': article_document.document_rev,
+                'created_date': article_document.created_date,
+                'updated_date': article_document.updated_date,
+            }
+            return set_validators(
+                Response(status_code=200, json=article_document.manifest),
+                *get_article_validators(version, 'manifest')
+            )
         except managers.article_manager.ArticleManagerException as e:
             raise HTTPNotFound(detail=e.message)
         except:
@@ -136,29 +272,125 @@ class ArticleXML:
 
     @REQUEST_TIME_API_XML_GET.time()
     def get(self):
-        """Returns XML Article file with updated public URLs to its assets."""
+        """Returns XML Article file with updated public URLs to its assets.
+        Supports conditional requests (If-None-Match and
+        If-Modified-Since)."""
         try:
-            article_id = self.request.matchdict['id']
-            xml_file_content = managers.get_article_file(
-                article_id=article_id,
-                **self.request.db_settings
-            )
-            article_data = managers.get_article_data(
-                article_id=article_id,
+            # revisão do Artigo e propriedades dos seus arquivos, sem o
+            # conteúdo, das quais são obtidos ETag e Last-Modified
+            version = managers.get_article_version(
+                article_id=self.request.matchdict['id'],
                 **self.request.db_settings
             )
-            if article_data['content'].get('assets'):
-                xml_file_content = managers.set_assets_public_url(
-                    article_id=article_id,
-                    xml_content=xml_file_content,
-                    assets_filenames=article_data['content']['assets'],
-                    public_url='/articles/{}/assets/{}'
+            etag, last_modified = self._get_validators(version)
+            if is_conditional(self.request) and \
+                    is_not_modified(self.request, etag, last_modified):
+                return set_validators(HTTPNotModified(), etag,
+                                      last_modified)
+
+            # XML com URLs públicas gerado no registro do Artigo
+            public_xml = None
+            if managers.article_manager.PUBLIC_XML_FILE_ID in \
+                    version['attachments']:
+                public_xml = managers.open_article_public_xml(
+                    article_id=self.request.matchdict['id'],
+                    **self.request.db_settings
+                )
+            if public_xml is not None:
+                content, properties = public_xml
+                return set_validators(
+                    Response(
+                        content_type='application/xml',
+                        content_length=properties['content_size'],
+                        app_iter=FileIter(content,
+                                          block_size=ASSET_BLOCK_SIZE)
+                    ),
+                    etag,
+                    last_modified
                 )
-            return Response(content_type='application/xml',
-                            body_file=io.BytesIO(xml_file_content))
+            return self._get_rewritten_xml()
         except managers.article_manager.ArticleManagerException as e:
             raise HTTPNotFound(detail=e.message)
 
+    def _get_validators(self, version):
+        public_xml = version['attachments'].get(
+            managers.article_manager.PUBLIC_XML_FILE_ID)
+        if public_xml is not None:
+            return public_xml['digest'], get_last_modified(version)
+        return get_article_validators(version, 'xml')
+
+    def _get_rewritten_xml(self):
+        # Artigos registrados sem o XML com URLs públicas
+        article_id = self.request.matchdict['id']
+        xml_file_content = managers.get_article_file(
+            article_id=article_id,
+            **self.request.db_settings
+        )
+        article_data = managers.get_article_data(
+            article_id=article_id,
+            **self.request.db_settings
+        )
+        if article_data['content'].get('assets'):
+            xml_file_content = managers.set_assets_public_url(
+                article_id=article_id,
+                xml_content=xml_file_content,
+                assets_filenames=article_data['content']['assets'],
+                public_url=managers.article_manager.ASSETS_PUBLIC_URL
+            )
+        return set_validators(
+            Response(content_type='application/xml',
+                     body_file=io.BytesIO(xml_file_content)),
+            *get_article_validators(article_data, 'xml')
+        )
+
+
+def parse_byte_ranges(range_header, content_size):
+    """
+    Obtém os intervalos de bytes do cabeçalho HTTP Range. Intervalos
+    sobrepostos ou adjacentes são unidos, e são devolvidos em ordem
+    crescente.
+
+    :param range_header: valor do cabeçalho Range. Ex.: bytes=0-499,-500
+    :param content_size: tamanho, em bytes, do conteúdo
+
+    :returns: lista de tuplas (início, fim), com fim exclusivo, dos
+        intervalos que podem ser atendidos, lista vazia caso nenhum possa ser
+        atendido ou None caso o cabeçalho seja inválido ou tenha mais de
+        MAX_BYTE_RANGES intervalos e deva ser ignorado.
+    """
+    unit, __, ranges_spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes' or not ranges_spec.strip():
+        return None
+    ranges_specs = ranges_spec.split(',')
+    if len(ranges_specs) > MAX_BYTE_RANGES:
+        return None
+    byte_ranges = []
+    for range_spec in ranges_specs:
+        first, separator, last = range_spec.strip().partition('-')
+        if not separator or not (first or last) or \
+                (first and not first.isdigit()) or \
+                (last and not last.isdigit()):
+            return None
+        if not first:
+            start = max(content_size - int(last), 0)
+            stop = content_size if int(last) else 0
+        else:
+            start = int(first)
+            stop = content_size
+            if last:
+                if int(last) < start:
+                    return None
+                stop = min(int(last) + 1, content_size)
+        if start < stop:
+            byte_ranges.append((start, stop))
+    coalesced = []
+    for start, stop in sorted(byte_ranges):
+        if coalesced and start <= coalesced[-1][1]:
+            coalesced[-1] = (coalesced[-1][0], max(coalesced[-1][1], stop))
+        else:
+            coalesced.append((start, stop))
+    return coalesced
+
 
 @resource(path='/articles/{id}/assets/{asset_id}')
 class ArticleAsset:
@@ -169,13 +401,133 @@ class ArticleAsset:
 
     @REQUEST_TIME_API_ASSET_GET.time()
     def get(self):
-        """Returns Asset file."""
+        """Returns Asset file. Supports HTTP Range requests and conditional
+        requests (If-None-Match, If-Modified-Since and If-Range)."""
         try:
-            content_type, content = managers.get_asset_file(
-                article_id=self.request.matchdict['id'],
-                asset_id=self.request.matchdict['asset_id'],
-                **self.request.db_settings
+            # revisão do Artigo e propriedades do ativo, sem o conteúdo, das
+            # quais são obtidos ETag e Last-Modified
+            properties, last_modified = self._get_asset_version()
+            etag = properties.get('digest')
+            if is_conditional(self.request) and \
+                    is_not_modified(self.request, etag, last_modified):
+                return set_validators(HTTPNotModified(), etag,
+                                      last_modified)
+            range_header = self.request.headers.get('Range')
+            if range_header and self._if_range(etag, last_modified):
+                byte_ranges = parse_byte_ranges(
+                    range_header, properties['content_size'])
+                if byte_ranges is not None:
+                    return set_validators(
+                        self._get_ranges(byte_ranges, properties),
+                        etag, last_modified)
+
+            content, properties = self._open_asset_file()
+            response = Response(
+                content_type=self._content_type(properties),
+                content_length=properties['content_size'],
+                app_iter=FileIter(content, block_size=ASSET_BLOCK_SIZE)
             )
-            return Response(content_type=content_type, body=content)
+            response.accept_ranges = 'bytes'
+            return set_validators(response, etag, last_modified)
         except managers.article_manager.ArticleManagerException as e:
             raise HTTPNotFound(detail=e.message)
+
+    def _get_asset_version(self):
+        article_id = self.request.matchdict['id']
+        asset_id = self.request.matchdict['asset_id']
+        version = managers.get_article_version(
+            article_id=article_id,
+            **self.request.db_settings
+        )
+        properties = version['attachments'].get(asset_id)
+        if properties is None:
+            raise managers.article_manager.ArticleManagerException(
+                'AssetDocument file {} (ArticleDocument {}) not found.'.format(
+                    asset_id, article_id)
+            )
+        return properties, get_last_modified(version)
+
+    def _if_range(self, etag, last_modified):
+        # Range é atendido somente se a representação do cliente, indicada
+        # por If-Range, for a atual; caso contrário, o ativo é enviado inteiro
+        if_range = self.request.headers.get('If-Range')
+        if not if_range:
+            return True
+        if if_range.endswith(' GMT'):
+            return last_modified is not None and \
+                parse_date(if_range) == last_modified.replace(microsecond=0)
+        return if_range == '"{}"'.format(etag)
+
+    def _open_asset_file(self, byte_range=None):
+        return managers.open_asset_file(
+            article_id=self.request.matchdict['id'],
+            asset_id=self.request.matchdict['asset_id'],
+            byte_range=byte_range,
+            **self.request.db_settings
+        )
+
+    def _content_type(self, properties):
+        return properties['content_type'] or 'application/octet-stream'
+
+    def _get_ranges(self, byte_ranges, properties):
+        content_size = properties['content_size']
+        if not byte_ranges:
+            error = HTTPRequestRangeNotSatisfiable()
+            error.content_range = 'bytes */{}'.format(content_size)
+            raise error
+
+        if len(byte_ranges) == 1:
+            byte_range = byte_ranges[0]
+            content, __ = self._open_asset_file(byte_range)
+            response = Response(
+                status_code=206,
+                content_type=self._content_type(properties),
+                content_length=byte_range[1] - byte_range[0],
+                app_iter=FileIter(content, block_size=ASSET_BLOCK_SIZE)
+            )
+            response.content_range = (byte_range[0], byte_range[1],
+                                      content_size)
+            response.accept_ranges = 'bytes'
+            return response
+
+        # multipart/byteranges: cada intervalo é obtido e enviado em partes,
+        # somente quando sua vez de ser enviado chega
+        boundary = uuid.uuid4().hex
+        parts = [
+            (
+                (
+                    '--{}\r\nContent-Type: {}\r\n'
+                    'Content-Range: bytes {}-{}/{}\r\n\r\n'.format(
+                        boundary, self._content_type(properties),
+                        start, stop - 1, content_size)
+                ).encode('ascii'),
+                (start, stop)
+            )
+            for start, stop in byte_ranges
+        ]
+        closing = '\r\n--{}--\r\n'.format(boundary).encode('ascii')
+        content_length = len(closing) + sum(
+            len(headers) + stop - start + (2 if i else 0)
+            for i, (headers, (start, stop)) in enumerate(parts)
+        )
+
+        def app_iter():
+            for i, (headers, byte_range) in enumerate(parts):
+                yield (b'\r\n' if i else b'') + headers
+                content, __ = self._open_asset_file(byte_range)
+                file_iter = FileIter(content, block_size=ASSET_BLOCK_SIZE)
+                try:
+                    yield from file_iter
+                finally:
+                    file_iter.close()
+            yield closing
+
+        response = Response(
+            status_code=206,
+            content_type='multipart/byteranges',
+            content_length=content_length,
+            app_iter=app_iter()
+        )
+        response.content_type_params = {'boundary': boundary}
+        response.accept_ranges = 'bytes'
+        return response
@@ -1,8 +1,59 @@
+import json
+import time
 
 from cornice.resource import resource
+from pyramid.httpexceptions import HTTPServiceUnavailable
 from pyramid.response import Response
 
 import managers
+from persistence.changes_notifier import ChangesNotifier
+
+
+MAX_LIMIT = 1000
+FEED_TIMEOUT = 60
+HEARTBEAT = 15
+NDJSON = 'application/x-ndjson'
+# segundos sugeridos ao consumidor recusado por excesso de consumidores em
+# espera (Retry-After)
+RETRY_AFTER = 5
+
+
+class _WaiterAppIter:
+    """
+    app_iter que libera a vaga do consumidor em espera quando é esgotado ou
+    encerrado pelo servidor (close), mesmo que não tenha sido iterado.
+    """
+
+    def __init__(self, app_iter, changes_notifier):
+        self._app_iter = app_iter
+        self._changes_notifier = changes_notifier
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._app_iter)
+        except StopIteration:
+            self._release()
+            raise
+
+    def close(self):
+        self._release()
+        self._app_iter.close()
+
+    def _release(self):
+        if self._changes_notifier is not None:
+            self._changes_notifier.release_waiter()
+            self._changes_notifier = None
+
+
+def _parse_since(since):
+    # change_id é numérico; como texto, não seria comparável ao sequencial
+    # armazenado na base de dados
+    if since.isdigit():
+        return int(since)
+    return since
 
 
 @resource(collection_path='/changes', path='/changes/{id}', renderer='json')
@@ -12,13 +63,151 @@ class ChangeAPI:
         self.request = request
         self.context = context
 
+    @property
+    def settings(self):
+        return self.request.registry.settings or {}
+
+    @property
+    def max_limit(self):
+        return int(
+            self.settings.get('catalogmanager.changes.max_limit', MAX_LIMIT))
+
+    @property
+    def changes_notifier(self):
+        # sem o ChangesNotifier da aplicação, as esperas apenas esgotam o
+        # tempo, e o feed é consultado a cada intervalo
+        return self.request.db_settings.get('changes_notifier') or \
+            ChangesNotifier()
+
+    def _feed_timeout(self):
+        feed_timeout = float(
+            self.settings.get('catalogmanager.changes.feed_timeout',
+                              FEED_TIMEOUT))
+        if self.request.GET.get('timeout'):
+            return min(float(self.request.GET['timeout']), feed_timeout)
+        return feed_timeout
+
     def collection_get(self):
+        """
+        Lista as mudanças posteriores ao sequencial ``since``, em páginas de
+        até ``limit`` registros, no máximo
+        ``catalogmanager.changes.max_limit``. O sequencial a ser informado
+        para obter a página seguinte é retornado no cabeçalho X-Next-Since.
+
+        Com o cabeçalho ``Accept: application/x-ndjson``, as mudanças são
+        transmitidas, uma por linha, à medida que são obtidas da base de
+        dados, e ``limit`` 0 transmite todas as mudanças.
+
+        Com ``feed=longpoll``, caso não haja mudanças, a resposta aguarda
+        novas mudanças por até ``timeout`` segundos. Com
+        ``feed=eventsource``, as mudanças são transmitidas como Server-Sent
+        Events, à medida que são registradas, por até ``timeout`` segundos.
+        Cada consumidor em espera ocupa uma thread do servidor; acima de
+        ``catalogmanager.changes.max_waiters`` consumidores em espera no
+        processo, a resposta é 503, com o cabeçalho Retry-After.
+        """
         limit = 0
         if self.request.GET.get('limit'):
             limit = int(self.request.GET['limit'])
-        changes = managers.list_changes(
-            last_sequence=self.request.GET.get('since', ''),
+        since = _parse_since(str(self.request.GET.get('since', '')))
+
+        feed = self.request.GET.get('feed')
+        if feed == 'eventsource':
+            since = _parse_since(
+                self.request.headers.get('Last-Event-ID', str(since)))
+            return self._event_source(since)
+        if NDJSON in self.request.headers.get('Accept', ''):
+            return self._stream_changes(since, limit)
+
+        if not 0 < limit <= self.max_limit:
+            limit = self.max_limit
+        if feed == 'longpoll':
+            changes = self._long_poll(since, limit)
+        else:
+            changes = self._list_changes(since, limit)
+        next_since = changes[-1]['change_id'] if changes else since
+        response = Response(json=changes)
+        response.headers['X-Next-Since'] = str(next_since)
+        response.headers['Link'] = '</changes?since={}&limit={}>; ' \
+            'rel="next"'.format(next_since, limit)
+        return response
+
+    def _list_changes(self, since, limit):
+        return managers.list_changes(
+            last_sequence=since,
             limit=limit,
             **self.request.db_settings
         )
-        return Response(json=changes)
+
+    def _acquire_waiter(self, changes_notifier):
+        if not changes_notifier.acquire_waiter():
+            raise HTTPServiceUnavailable(
+                detail='Too many changes feed consumers waiting',
+                headers={'Retry-After': str(RETRY_AFTER)})
+
+    def _long_poll(self, since, limit):
+        changes_notifier = self.changes_notifier
+        deadline = time.monotonic() + self._feed_timeout()
+        version = changes_notifier.version
+        changes = self._list_changes(since, limit)
+        if changes:
+            return changes
+        self._acquire_waiter(changes_notifier)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return changes
+                changes_notifier.wait(version, remaining)
+                version = changes_notifier.version
+                changes = self._list_changes(since, limit)
+                if changes:
+                    return changes
+        finally:
+            changes_notifier.release_waiter()
+
+    def _event_source(self, since):
+        changes_notifier = self.changes_notifier
+        heartbeat = float(
+            self.settings.get('catalogmanager.changes.heartbeat', HEARTBEAT))
+        deadline = time.monotonic() + self._feed_timeout()
+
+        def events(since):
+            while True:
+                version = changes_notifier.version
+                changes = self._list_changes(since, self.max_limit)
+                for change in changes:
+                    yield 'id: {}\ndata: {}\n\n'.format(
+                        change['change_id'], json.dumps(change)
+                    ).encode('utf-8')
+                if changes:
+                    since = changes[-1]['change_id']
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                if not changes_notifier.wait(version,
+                                             min(heartbeat, remaining)):
+                    yield b': heartbeat\n\n'
+
+        self._acquire_waiter(changes_notifier)
+        response = Response(
+            content_type='text/event-stream',
+            app_iter=_WaiterAppIter(events(since), changes_notifier))
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
+    def _stream_changes(self, since, limit):
+        changes = managers.iter_changes(
+            last_sequence=since,
+            limit=limit,
+            page_size=self.max_limit,
+            **self.request.db_settings
+        )
+        return Response(
+            content_type=NDJSON,
+            app_iter=(
+                json.dumps(change).encode('utf-8') + b'\n'
+                for change in changes
+            )
+        )
@@ -0,0 +1,71 @@
+"""
+Compara a vazão (pacotes por segundo) do registro de pacotes um a um, por
+ArticleManager.receive_package, com a do registro em lote por
+managers.ingest.ingest_packages, com 1 até a quantidade de CPUs processos,
+em uma base de dados em memória.
+
+Uso, a partir da raiz do repositório:
+
+    python -m benchmarks.batch_ingest
+"""
+import os
+import time
+
+from benchmarks.xml_minify import article_xml
+from managers.article_manager import ArticleManager
+from managers.ingest import ingest_packages
+from managers.models.file import File
+from persistence.databases import InMemoryDBManager
+from persistence.seqnum_generator import SeqNumGenerator
+from persistence.services import ChangesService
+
+
+PACKAGES = 100
+PARAGRAPHS = 1000
+
+
+def get_article_manager():
+    return ArticleManager(
+        InMemoryDBManager(database_name='articles'),
+        ChangesService(
+            InMemoryDBManager(database_name='changes'),
+            SeqNumGenerator(
+                InMemoryDBManager(database_name='changes_seqnum'),
+                'CHANGES_SEQ')
+        )
+    )
+
+
+def get_packages(xml_content):
+    for i in range(PACKAGES):
+        assets_files = [
+            File(file_name='f{}.jpg'.format(j), content=b'x' * 1024)
+            for j in range(PARAGRAPHS)
+        ]
+        yield ('ID{}'.format(i), File(file_name='a.xml', content=xml_content),
+               assets_files)
+
+
+def main():
+    xml_content = article_xml(PARAGRAPHS, 3)
+    article_manager = get_article_manager()
+    start = time.perf_counter()
+    for id, xml_file, files in get_packages(xml_content):
+        article_manager.receive_package(id, xml_file, files)
+    print('{:>12} {:>10.1f} packages/s'.format(
+        'sequential', PACKAGES / (time.perf_counter() - start)))
+
+    for max_workers in range(1, (os.cpu_count() or 1) + 1):
+        article_manager = get_article_manager()
+        start = time.perf_counter()
+        for result in ingest_packages(article_manager,
+                                      get_packages(xml_content),
+                                      max_workers=max_workers):
+            assert result.error is None and not result.missing_files_list
+        print('{:>12} {:>10.1f} packages/s'.format(
+            '{} workers'.format(max_workers),
+            PACKAGES / (time.perf_counter() - start)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""
+Compara o tempo de XMLTree.otimized com o da implementação anterior, que
+serializava, decodificava e analisava novamente o XML como str e reduzia os
+espaços com substituições sucessivas, em XMLs de tamanhos variados.
+
+Uso, a partir da raiz do repositório:
+
+    python -m benchmarks.xml_minify
+"""
+import itertools
+import timeit
+
+from lxml import etree
+
+from managers.xml.xml_tree import XMLTree
+
+
+SIZES = (10, 100, 1000, 5000)
+# quantidade de espaços das sequências no texto dos parágrafos
+SPACES = (3, 256)
+INDENT = ' ' * 8
+
+
+def legacy_otimized(xml_tree):
+    parser = etree.XMLParser(remove_blank_text=True)
+    content = xml_tree.tostring
+    if content is not None:
+        root = etree.XML(content.decode('utf-8'), parser)
+        b = etree.tostring(root, encoding='utf-8')
+        s = b.decode('utf-8')
+        while ' '*2 in s:
+            s = s.replace(' '*2, ' ')
+        return s.encode('utf-8')
+
+
+def article_xml(paragraphs, spaces):
+    """
+    XML de artigo com ``paragraphs`` parágrafos, indentado e com texto
+    contendo sequências de ``spaces`` espaços.
+    """
+    body = ''.join(
+        '\n{indent}<p>Parágrafo {i}{spaces}com{spaces}texto\n{indent}{indent}'
+        '<bold>e{spaces}estilos</bold>\n{indent}{indent}'
+        '<xref ref-type="fig" rid="f{i}">Figura {i}</xref>\n{indent}</p>'
+        '\n{indent}<fig id="f{i}">\n{indent}{indent}'
+        '<graphic xlink:href="f{i}.jpg"/>\n{indent}</fig>'.format(
+            indent=INDENT, spaces=' ' * spaces, i=i)
+        for i in range(paragraphs)
+    )
+    return (
+        '<article xmlns:xlink="http://www.w3.org/1999/xlink">'
+        '\n    <body>{}\n    </body>\n</article>'.format(body)
+    ).encode('utf-8')
+
+
+def main():
+    print('{:>10} {:>6} {:>10} {:>12} {:>13} {:>8}'.format(
+        'paragraphs', 'spaces', 'bytes', 'legacy (ms)', 'otimized (ms)',
+        'speedup'))
+    for spaces, size in itertools.product(SPACES, SIZES):
+        xml_tree = XMLTree(article_xml(size, spaces))
+        assert legacy_otimized(xml_tree) == xml_tree.otimized
+        number = max(1, 2000 // size)
+        legacy = min(timeit.repeat(
+            lambda: legacy_otimized(xml_tree), number=number, repeat=3))
+        otimized = min(timeit.repeat(
+            lambda: xml_tree.otimized, number=number, repeat=3))
+        print('{:>10} {:>6} {:>10} {:>12.3f} {:>13.3f} {:>7.1f}x'.format(
+            size,
+            spaces,
+            len(xml_tree.tostring),
+            legacy / number * 1000,
+            otimized / number * 1000,
+            legacy / otimized))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Compara o tempo e o pico de memória (RSS) da obtenção dos ativos digitais e
+do conteúdo canônico de XMLs grandes por ArticleXMLTree (árvore completa) e
+por ArticleXMLStream (iterparse), cada medição em um processo novo.
+
+Uso, a partir da raiz do repositório:
+
+    python -m benchmarks.xml_streaming
+"""
+import multiprocessing
+import resource
+import tempfile
+import time
+
+from benchmarks.xml_minify import article_xml
+from managers.xml.article_xml_stream import ArticleXMLStream
+from managers.xml.article_xml_tree import ArticleXMLTree
+
+
+SIZES = (20000, 100000, 200000)
+ROW = '{:>10} {:>10.1f} {:>10.2f} {:>10.1f} {:>10.2f} {:>11.1f}'
+
+
+def measure(queue, tree_class, file_name, paragraphs):
+    with open(file_name, 'rb') as fp:
+        xml_content = fp.read()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    xml_tree = tree_class(xml_content)
+    assert len(xml_tree.asset_nodes) == paragraphs
+    xml_tree.content
+    elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((len(xml_content), elapsed, (peak - baseline) / 1024))
+
+
+def run(tree_class, file_name, paragraphs):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=measure, args=(queue, tree_class, file_name, paragraphs))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+
+def main():
+    print('{:>10} {:>10} {:>10} {:>10} {:>10} {:>11}'.format(
+        'paragraphs', 'MB', 'tree (s)', 'tree (MB)', 'stream (s)',
+        'stream (MB)'))
+    for size in SIZES:
+        with tempfile.NamedTemporaryFile(suffix='.xml') as fp:
+            fp.write(article_xml(size, 3))
+            fp.flush()
+            length, tree_time, tree_memory = run(
+                ArticleXMLTree, fp.name, size)
+            length, stream_time, stream_memory = run(
+                ArticleXMLStream, fp.name, size)
+        print(ROW.format(
+            size, length / 1024 / 1024, tree_time, tree_memory, stream_time,
+            stream_memory))
+
+
+if __name__ == '__main__':
+    main()
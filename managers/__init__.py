@@ -1,7 +1,9 @@
 from managers.article_manager import ArticleManager
 from managers.exceptions import ManagerFileError
+from managers import ingest
 from managers.models.article_model import ArticleDocument
 from managers.models.file import File
+from managers.xml.article_xml_stream import STREAMING_THRESHOLD
 from persistence.databases import CouchDBManager
 from persistence.services import (
     DatabaseService,
@@ -10,24 +12,60 @@ from persistence.services import (
 from persistence.seqnum_generator import SeqNumGenerator
 
 
+def _get_db_manager(database_config):
+    """
+    Obtém a instância de DBManager para as configurações informadas, a partir
+    do pool de instâncias compartilhadas (``database_pool``), caso exista.
+    """
+    database_config.pop('changes_writer', None)
+    database_config.pop('changes_notifier', None)
+    database_config.pop('xml_streaming_threshold', None)
+    database_config.pop('xml_schemas_dir', None)
+    database_pool = database_config.pop('database_pool', None)
+    if database_pool is not None:
+        return database_pool.get(**database_config)
+    return CouchDBManager(**database_config)
+
+
+def _get_seqnum_generator(database_config):
+    """
+    Obtém o SeqNumGenerator para as configurações informadas. Caso exista o
+    pool de instâncias compartilhadas (``database_pool``), o SeqNumGenerator
+    é compartilhado por todas as requisições do processo. Os números são
+    reservados um a um, pois a ordem dos registros de mudança deve seguir a
+    ordem em que são registrados (ChangesService).
+    """
+    database_pool = database_config.pop('database_pool', None)
+    if database_pool is not None:
+        return database_pool.get_seqnum_generator(
+            'CHANGES_SEQ', **database_config)
+    return SeqNumGenerator(
+        CouchDBManager(**database_config),
+        'CHANGES_SEQ'
+    )
+
+
 def _get_changes_dbmanager(database_config_copy):
     changes_database_config = database_config_copy
     changes_database_config['database_name'] = "changes"
-    return CouchDBManager(**changes_database_config)
+    return _get_db_manager(changes_database_config)
 
 
 def _get_changes_services(db_settings):
-    database_config = db_settings
+    database_config = db_settings.copy()
+    changes_writer = database_config.pop('changes_writer', None)
+    changes_notifier = database_config.pop('changes_notifier', None)
+    database_config.pop('xml_streaming_threshold', None)
+    database_config.pop('xml_schemas_dir', None)
 
     changes_seqnum_database_config = database_config.copy()
     changes_seqnum_database_config['database_name'] = "changes_seqnum"
 
     return ChangesService(
         _get_changes_dbmanager(database_config.copy()),
-        SeqNumGenerator(
-            CouchDBManager(**changes_seqnum_database_config),
-            'CHANGES_SEQ'
-        )
+        _get_seqnum_generator(changes_seqnum_database_config),
+        changes_writer,
+        changes_notifier
     )
 
 
@@ -37,11 +75,35 @@ def _get_article_manager(**db_settings):
     articles_database_config['database_name'] = "articles"
 
     return ArticleManager(
-        CouchDBManager(**articles_database_config),
-        _get_changes_services(db_settings)
+        _get_db_manager(articles_database_config),
+        _get_changes_services(db_settings),
+        db_settings.get('xml_streaming_threshold', STREAMING_THRESHOLD),
+        db_settings.get('xml_schemas_dir')
     )
 
 
+def create_databases(**db_settings):
+    """
+    Provisiona as bases de dados usadas pelo Catalog Manager e seus índices,
+    criando-os caso não existam. Deve ser executado na inicialização da
+    aplicação.
+
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+        Pode conter:
+        - database_timeout: timeout, em segundos, das conexões HTTP
+    """
+    for database_name in ("articles", "changes", "changes_seqnum"):
+        database_config = db_settings.copy()
+        database_config['database_name'] = database_name
+        db_manager = _get_db_manager(database_config)
+        db_manager.create_database()
+        db_manager.create_indexes()
+
+
 def create_file(filename, content):
     """
     Cria instancia de objeto File que será usado para o tratamento dos
@@ -67,7 +129,8 @@ def post_article(xml_file, **db_settings):
 def put_article(article_id, xml_file, assets_files=[], **db_settings):
     """
     Registra Documento de Artigo, com XML e seus ativos digitais e cria
-    metadados para controle de integridade referencial
+    metadados para controle de integridade referencial. Caso o Artigo já
+    esteja registrado, escreve apenas os arquivos alterados
 
     :param article_id: ID do Documento do tipo Artigo, para identificação
         referencial
@@ -82,10 +145,12 @@ def put_article(article_id, xml_file, assets_files=[], **db_settings):
         - database_password: senha do banco de dados
 
     :returns: lista com os nomes dos arquivos de ativos digitais não
-        referenciados no XML e lista com os nomes dos arquivos de ativos
+        referenciados no XML, lista com os nomes dos arquivos de ativos
         digitais referenciados no XML e que não constam na lista de
-        arquivos de ativos digitais informada
-    :rtype: tuple(list(), list())
+        arquivos de ativos digitais informada e lista com os nomes dos
+        arquivos (XML e ativos digitais) escritos na base de dados, que
+        exclui os já registrados com o mesmo conteúdo (SHA-1)
+    :rtype: tuple(list(), list(), list())
     """
     article_manager = _get_article_manager(**db_settings)
     return article_manager.receive_package(id=article_id,
@@ -93,6 +158,35 @@ def put_article(article_id, xml_file, assets_files=[], **db_settings):
                                            files=assets_files)
 
 
+def ingest_packages(packages, max_workers=None, max_in_flight=None,
+                    **db_settings):
+    """
+    Registra pacotes de Artigos em lote, como put_article, processando os
+    XMLs (análise, validação, conteúdo canônico e SHA-1) em paralelo em
+    processos distintos e escrevendo os pacotes processados na base de
+    dados no processo corrente
+
+    :param packages: iterável de tuplas (ID do Artigo, objeto File do XML,
+        lista de objetos File dos ativos digitais), consumido à medida que
+        os pacotes são registrados
+    :param max_workers: quantidade de processos; por padrão, a de CPUs
+    :param max_in_flight: quantidade máxima de pacotes em processamento ou
+        aguardando escrita
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+
+    :returns: iterador de IngestResult (id, as listas retornadas por
+        put_article e error, a mensagem de erro caso o pacote não tenha
+        sido registrado), na ordem em que os pacotes são registrados
+    """
+    article_manager = _get_article_manager(**db_settings)
+    return ingest.ingest_packages(article_manager, packages, max_workers,
+                                  max_in_flight)
+
+
 def get_article_data(article_id, **db_settings):
     """
     Recupera metadados do Documento de Artigo, usados para controle de
@@ -112,6 +206,26 @@ def get_article_data(article_id, **db_settings):
     return article_manager.get_article_data(article_id)
 
 
+def get_article_version(article_id, **db_settings):
+    """
+    Recupera a revisão e as datas do Documento de Artigo e as propriedades
+    dos seus ativos digitais, sem ler o conteúdo do XML e dos ativos
+
+    :param article_id: ID do Documento do tipo Artigo, para identificação
+        referencial
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+
+    :returns: dicionário com document_rev, created_date, updated_date e
+        attachments (content_type, content_size e digest de cada arquivo)
+    """
+    article_manager = _get_article_manager(**db_settings)
+    return article_manager.get_article_version(article_id)
+
+
 def get_article_document(article_id, **db_settings):
     """
     Recupera metadados do Documento de Artigo, usados para controle de
@@ -149,6 +263,27 @@ def get_article_file(article_id, **db_settings):
     return article_manager.get_article_file(article_id)
 
 
+def open_article_public_xml(article_id, **db_settings):
+    """
+    Abre o XML do Artigo com as URLs públicas dos ativos digitais, gerado no
+    registro do Artigo, para leitura em partes
+
+    :param article_id: ID do Documento do tipo Artigo, para identificação
+        referencial
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+
+    :returns: tupla com arquivo (file-like) e propriedades do XML
+        (content_type, content_size e digest), ou None caso o Artigo não
+        exista ou tenha sido registrado sem o XML com URLs públicas
+    """
+    article_manager = _get_article_manager(**db_settings)
+    return article_manager.open_public_xml(article_id)
+
+
 def get_asset_file(article_id, asset_id, **db_settings):
     """
     Recupera Ativo Digital do Artigo
@@ -168,6 +303,49 @@ def get_asset_file(article_id, asset_id, **db_settings):
     return article_manager.get_asset_file(article_id, asset_id)
 
 
+def open_asset_file(article_id, asset_id, byte_range=None, **db_settings):
+    """
+    Abre Ativo Digital do Artigo para leitura em partes, sem carregar todo o
+    conteúdo em memória
+
+    :param article_id: ID do Documento do tipo Artigo, para identificação
+        referencial
+    :param asset_id: nome de identificação do ativo digital
+    :param byte_range: (opcional) tupla (início, fim), com fim exclusivo, do
+        intervalo de bytes a ser lido
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+
+    :returns: tupla com arquivo (file-like) e propriedades do ativo digital
+        (content_type, content_size e digest)
+    """
+    article_manager = _get_article_manager(**db_settings)
+    return article_manager.open_asset_file(article_id, asset_id, byte_range)
+
+
+def get_asset_properties(article_id, asset_id, **db_settings):
+    """
+    Recupera as propriedades do Ativo Digital do Artigo, sem o seu conteúdo
+
+    :param article_id: ID do Documento do tipo Artigo, para identificação
+        referencial
+    :param asset_id: nome de identificação do ativo digital
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+
+    :returns: dicionário com content_type, content_size e digest do ativo
+        digital
+    """
+    article_manager = _get_article_manager(**db_settings)
+    return article_manager.get_asset_properties(article_id, asset_id)
+
+
 def set_assets_public_url(article_id, xml_content, assets_filenames,
                           public_url):
     """
@@ -217,3 +395,32 @@ def list_changes(last_sequence, limit, **db_settings):
     )
     return change_service.list_changes(last_sequence=last_sequence,
                                        limit=limit)
+
+
+def iter_changes(last_sequence, limit, page_size, **db_settings):
+    """
+    Itera sobre as mudanças a partir de sequencial informado, na ordem em que
+    ocorreram, limitadas ao parâmetro de limite informado, obtendo-as da base
+    de dados em páginas de tamanho page_size.
+
+    :param last_sequence: sequencial de mudança, que deve ser a referência
+        para a busca dos sequenciais a serem listados.
+    :param limit: limite máximo de registros de mudança que devem ser
+        listados ou 0 para todos.
+    :param page_size: quantidade de registros de mudança obtidos por consulta
+        à base de dados.
+    :param db_settings: dicionário com as configurações do banco de dados.
+        Deve conter:
+        - database_uri: URI do banco de dados (host:porta)
+        - database_username: usuário do banco de dados
+        - database_password: senha do banco de dados
+
+    :returns: iterador de mudanças
+    """
+    change_service = DatabaseService(
+        None,
+        _get_changes_services(db_settings.copy())
+    )
+    return change_service.iter_changes(last_sequence=last_sequence,
+                                       limit=limit,
+                                       page_size=page_size)
@@ -1,21 +1,32 @@
 # coding=utf-8
 
+import collections
+
 from persistence.models import (
         get_record,
         RecordType,
     )
 from persistence.databases import (
     DocumentNotFound,
+    UpdateFailure,
 )
 from persistence.services import DatabaseService
 from .models.article_model import (
     ArticleDocument,
 )
 from .models.file import File
+from .xml.article_xml_stream import STREAMING_THRESHOLD
+from .xml.validation import validate_article_xml
 
 
 Record = get_record
 
+# URL pública dos ativos digitais do Artigo, nos hrefs do XML disponibilizado
+ASSETS_PUBLIC_URL = '/articles/{}/assets/{}'
+# anexo com o XML do Artigo com os hrefs dos ativos digitais substituídos
+# pelas URLs públicas, gerado a cada registro do Artigo
+PUBLIC_XML_FILE_ID = 'public-rendition.xml'
+
 
 class ArticleManagerException(Exception):
 
@@ -23,40 +34,315 @@ class ArticleManagerException(Exception):
         self.message = message
 
 
+class ArticleManagerInvalidXMLException(ArticleManagerException):
+    """
+    XML do pacote do Artigo mal formado, inválido ou sem schema para a sua
+    versão: erro nos dados enviados pelo cliente.
+    """
+
+
+class ArticleManagerConflictException(ArticleManagerException):
+    """
+    Registro do Artigo alterado por outra requisição durante a escrita do
+    pacote: o cliente deve reenviar o pacote.
+    """
+
+
 class ArticleManagerMissingAssetFileException(Exception):
     pass
 
 
+# pacote do Artigo lido, validado e pronto para ser persistido, composto
+# apenas de tipos serializáveis (pickle) para que possa ser obtido em outro
+# processo (managers.ingest): files contém o XML canônico e os ativos
+# digitais recebidos, como tuplas (nome, conteúdo, propriedades), com
+# conteúdo None para os recebidos sem conteúdo (File.without_content), e
+# public_xml o anexo do XML com as URLs públicas dos ativos digitais
+ArticlePackage = collections.namedtuple('ArticlePackage', [
+    'id',
+    'record_content',
+    'files',
+    'public_xml',
+    'unexpected_files_list',
+    'missing_files_list',
+])
+
+
+def _read_article(id, xml_file, files, xml_streaming_threshold,
+                  xml_schemas_dir):
+    article = ArticleDocument(id, xml_streaming_threshold)
+    article.xml_file = xml_file
+    article.update_asset_files(files)
+    _validate_article(article, xml_schemas_dir)
+    return article
+
+
+def _validate_article(article, xml_schemas_dir):
+    """
+    Verifica se o XML do Artigo é bem formado e o valida com o schema da
+    sua versão, caso a validação esteja configurada (xml_schemas_dir), antes
+    de qualquer acesso à base de dados.
+
+    Erro:
+    ArticleManagerInvalidXMLException: XML mal formado, inválido ou sem
+        schema para a versão
+    """
+    if xml_schemas_dir is not None:
+        errors = validate_article_xml(article.xml_tree, xml_schemas_dir)
+    elif article.xml_tree.xml_error is not None:
+        errors = [article.xml_tree.xml_error.strip()]
+    else:
+        errors = []
+    if errors:
+        raise ArticleManagerInvalidXMLException(
+            'XML file {} is not valid:\n{}'.format(
+                article.xml_file.name, '\n'.join(errors))
+        )
+
+
+def _get_package_files(article):
+    """
+    Obtém o XML, com o conteúdo canônico, e os ativos digitais recebidos do
+    Artigo, como tuplas (nome, conteúdo, propriedades).
+    """
+    # conteúdo canônico obtido antes da substituição dos hrefs, que
+    # invalida o conteúdo memorizado pela árvore
+    xml_content = article.xml_tree.content
+    files = [
+        (
+            article.xml_file.name,
+            xml_content,
+            dict(
+                article.xml_file.properties(),
+                content_size=len(xml_content),
+                sha1=article.xml_tree.digest,
+            )
+        ),
+    ]
+    files.extend(
+        (asset.file.name, asset.file.content, asset.file.properties())
+        for asset in article.assets.values()
+        if asset.file is not None
+    )
+    return files
+
+
+def _get_public_xml_attachment(article):
+    public_xml = _get_public_xml(article)
+    return (
+        PUBLIC_XML_FILE_ID,
+        public_xml,
+        {
+            'content_type': 'application/xml',
+            'content_size': len(public_xml),
+            'file_name': PUBLIC_XML_FILE_ID,
+        }
+    )
+
+
+def _get_public_xml(article):
+    """
+    Obtém o XML do Artigo com os hrefs dos ativos digitais substituídos
+    pelas suas URLs públicas, mantendo os hrefs originais no Artigo.
+    """
+    for name, asset in article.assets.items():
+        asset.href = ASSETS_PUBLIC_URL.format(article.id, name)
+    try:
+        return article.xml_tree.content
+    finally:
+        for name, asset in article.assets.items():
+            asset.href = name
+
+
+def prepare_package(id, xml_file, files=None,
+                    xml_streaming_threshold=STREAMING_THRESHOLD,
+                    xml_schemas_dir=None):
+    """
+    Etapa de processamento do registro do pacote do Artigo, sem acesso à
+    base de dados: análise e validação do XML, identificação dos ativos
+    digitais, obtenção do conteúdo canônico e do XML com as URLs públicas e
+    cálculo dos SHA-1 dos arquivos. O pacote obtido é persistido por
+    ArticleManager.register_package.
+
+    Params:
+    id: ID do Artigo
+    xml_file: File do XML
+    files: lista de File dos ativos digitais, que podem estar sem o
+        conteúdo (File.without_content)
+    xml_streaming_threshold: tamanho a partir do qual o XML é lido em partes
+    xml_schemas_dir: diretório dos schemas, ou None para não validar o XML
+
+    Retorno:
+    ArticlePackage
+
+    Erro:
+    ArticleManagerInvalidXMLException: XML mal formado, inválido ou sem
+        schema para a versão
+    """
+    article = _read_article(
+        id, xml_file, files, xml_streaming_threshold, xml_schemas_dir)
+    return ArticlePackage(
+        id=article.id,
+        record_content=article.get_record_content(),
+        files=_get_package_files(article),
+        public_xml=_get_public_xml_attachment(article),
+        unexpected_files_list=article.unexpected_files_list,
+        missing_files_list=article.missing_files_list,
+    )
+
+
 class ArticleManager:
 
-    def __init__(self, articles_db_manager, changes_services):
+    def __init__(self, articles_db_manager, changes_services,
+                 xml_streaming_threshold=STREAMING_THRESHOLD,
+                 xml_schemas_dir=None):
         self.article_db_service = DatabaseService(
             articles_db_manager, changes_services)
+        self.xml_streaming_threshold = xml_streaming_threshold
+        # diretório dos schemas para validação dos XMLs recebidos, ou None
+        # para não validá-los
+        self.xml_schemas_dir = xml_schemas_dir
 
     def receive_package(self, id, xml_file, files=None):
-        article = self.receive_xml_file(id, xml_file)
-        self.receive_asset_files(article, files)
-        return article.unexpected_files_list, article.missing_files_list
+        article = _read_article(
+            id, xml_file, files, self.xml_streaming_threshold,
+            self.xml_schemas_dir)
+        updated = self._register_article(article)
+        return (
+            article.unexpected_files_list,
+            article.missing_files_list,
+            updated,
+        )
+
+    def register_package(self, package):
+        """
+        Persiste o pacote do Artigo obtido por prepare_package, possivelmente
+        em outro processo, como em receive_package.
+
+        Params:
+        package: ArticlePackage
+
+        Retorno:
+        Tupla com as listas de arquivos não referenciados no XML, de ativos
+        digitais faltantes e de arquivos escritos na base de dados
+        """
+        updated = self._write_package(
+            package.id,
+            package.record_content,
+            package.files,
+            lambda: package.public_xml
+        )
+        return (
+            package.unexpected_files_list,
+            package.missing_files_list,
+            updated,
+        )
 
     def receive_xml_file(self, id, xml_file):
-        article = ArticleDocument(id)
-        article.xml_file = xml_file
+        article = _read_article(
+            id, xml_file, None, self.xml_streaming_threshold,
+            self.xml_schemas_dir)
+        self._register_article(article)
+        return article
+
+    def _register_article(self, article):
+        return self._write_package(
+            article.id,
+            article.get_record_content(),
+            _get_package_files(article),
+            lambda: _get_public_xml_attachment(article)
+        )
+
+    def _write_package(self, article_id, record_content, files,
+                       get_public_xml):
+        """
+        Persiste o registro do Artigo, o XML, o XML com as URLs públicas dos
+        ativos digitais e os ativos digitais disponíveis em uma única escrita
+        na base de dados. Assim, o XML com as URLs públicas é sempre da mesma
+        revisão do registro, do XML e da lista de ativos digitais.
+
+        Caso o Artigo já esteja registrado, são escritos apenas o XML e os
+        ativos digitais cujo SHA-1 difere do registrado em
+        attachments_properties (para o XML, o SHA-1 do conteúdo canônico), e
+        são removidos os ativos digitais que o XML não referencia mais. Um
+        pacote sem alterações não gera escrita nem registro de mudança.
+
+        Caso outra requisição registre o Artigo entre a leitura e a escrita,
+        o pacote é escrito como atualização do registro criado por ela.
+
+        Params:
+        article_id: ID do Artigo
+        record_content: conteúdo do registro (get_record_content)
+        files: tuplas (nome, conteúdo, propriedades) do XML e dos ativos
+            digitais (_get_package_files)
+        get_public_xml: função que obtém o anexo do XML com as URLs
+            públicas, chamada apenas quando é necessário escrevê-lo
+
+        Retorno:
+        Lista com os nomes dos arquivos do pacote escritos na base de dados
+
+        Erro:
+        ArticleManagerConflictException: registro do Artigo alterado por
+            outra requisição durante a atualização
+        """
+        try:
+            registered = self.article_db_service.read_for_update(article_id)
+        except DocumentNotFound:
+            try:
+                self.article_db_service.register_with_attachments(
+                    article_id,
+                    Record(
+                        document_id=article_id,
+                        content=record_content,
+                        document_type=RecordType.ARTICLE),
+                    files + [get_public_xml()]
+                )
+                return [file_id for file_id, content, properties in files]
+            except UpdateFailure:
+                registered = self.article_db_service.read_for_update(
+                    article_id)
 
         article_record = Record(
-            document_id=article.id,
-            content=article.get_record_content(),
+            document_id=article_id,
+            content=record_content,
             document_type=RecordType.ARTICLE)
 
-        self.article_db_service.register(
-            article.id, article_record)
+        registered_properties = registered['attachments_properties']
+        attachments = [
+            (file_id, content, properties)
+            for file_id, content, properties in files
+            if properties['sha1'] !=
+            registered_properties.get(file_id, {}).get('sha1')
+        ]
+        updated = [file_id for file_id, content, properties in attachments]
+        content_changed = registered['content'] != article_record['content']
+        registered_files = registered.get('attachments', [])
+        if (updated or content_changed or
+                PUBLIC_XML_FILE_ID not in registered_files):
+            attachments.append(get_public_xml())
+        referenced = {record_content['xml'], PUBLIC_XML_FILE_ID}
+        referenced.update(record_content['assets'])
+        removed = [
+            file_id
+            for file_id in registered_files
+            if file_id not in referenced
+        ]
+        if not attachments and not removed:
+            return []
 
-        self.article_db_service.put_attachment(
-            document_id=article.id,
-            file_id=article.xml_file.name,
-            content=article.xml_tree.content,
-            file_properties=article.xml_file.properties()
-        )
-        return article
+        article_record.update({
+            'created_date': registered['created_date'],
+            'document_rev': registered['document_rev'],
+            'attachments_properties': dict(registered_properties),
+        })
+        try:
+            self.article_db_service.update_with_attachments(
+                article_id, article_record, attachments, removed)
+        except UpdateFailure:
+            raise ArticleManagerConflictException(
+                'Article {} was changed by another request'.format(
+                    article_id))
+        return updated
 
     def receive_asset_files(self, article, files):
         if files is not None:
@@ -77,18 +363,38 @@ class ArticleManager:
     def add_document(self, article_document):
         pass
 
+    def _read_article_record(self, article_id):
+        article_record = self.article_db_service.read(article_id)
+        # o XML com URLs públicas é derivado do XML, e não um arquivo do
+        # pacote do Artigo
+        if PUBLIC_XML_FILE_ID in article_record.get('attachments', []):
+            article_record['attachments'].remove(PUBLIC_XML_FILE_ID)
+        return article_record
+
     def get_article_data(self, article_id):
         try:
-            article_record = self.article_db_service.read(article_id)
+            article_record = self._read_article_record(article_id)
             return article_record
         except DocumentNotFound:
             raise ArticleManagerException(
                 'ArticleDocument {} not found'.format(article_id)
             )
 
+    def get_article_version(self, article_id):
+        """
+        Obtém a revisão e as datas do Artigo e as propriedades dos seus
+        arquivos (content_type, content_size e digest), sem o conteúdo.
+        """
+        try:
+            return self.article_db_service.read_version(article_id)
+        except DocumentNotFound:
+            raise ArticleManagerException(
+                'ArticleDocument {} not found'.format(article_id)
+            )
+
     def get_article_document(self, article_id):
         try:
-            article_record = self.article_db_service.read(article_id)
+            article_record = self._read_article_record(article_id)
             article_document = ArticleDocument(
                 article_record['document_id']
             )
@@ -114,6 +420,24 @@ class ArticleManager:
                 'XML file {} not found'.format(article_id)
             )
 
+    def open_public_xml(self, article_id):
+        """
+        Abre o XML do Artigo com as URLs públicas dos ativos digitais, gerado
+        no registro do Artigo, para leitura em partes.
+
+        Retorno:
+        Tupla com arquivo (file-like) e propriedades do XML (content_type,
+        content_size e digest), ou None caso o Artigo não exista ou tenha
+        sido registrado sem o XML com URLs públicas
+        """
+        try:
+            return self.article_db_service.open_attachment(
+                document_id=article_id,
+                file_id=PUBLIC_XML_FILE_ID
+            )
+        except DocumentNotFound:
+            return None
+
     def get_asset_files(self, article_id):
         article_record = self.get_article_data(article_id)
         assets = article_record['content'].get('assets') or []
@@ -126,6 +450,43 @@ class ArticleManager:
                 missing.append(file_id)
         return asset_files, missing
 
+    def open_asset_file(self, article_id, asset_id, byte_range=None):
+        """
+        Abre Ativo Digital do Artigo, ou o intervalo de bytes informado, para
+        leitura em partes.
+
+        Retorno:
+        Tupla com arquivo (file-like) e propriedades do ativo digital
+        (content_type, content_size e digest)
+        """
+        try:
+            return self.article_db_service.open_attachment(
+                document_id=article_id,
+                file_id=asset_id,
+                byte_range=byte_range
+            )
+        except DocumentNotFound:
+            raise ArticleManagerException(
+                'AssetDocument file {} (ArticleDocument {}) not found.'.format(
+                    asset_id, article_id)
+            )
+
+    def get_asset_properties(self, article_id, asset_id):
+        """
+        Obtém as propriedades do Ativo Digital do Artigo (content_type,
+        content_size e digest), sem o seu conteúdo.
+        """
+        try:
+            return self.article_db_service.head_attachment(
+                document_id=article_id,
+                file_id=asset_id
+            )
+        except DocumentNotFound:
+            raise ArticleManagerException(
+                'AssetDocument file {} (ArticleDocument {}) not found.'.format(
+                    asset_id, article_id)
+            )
+
     def get_asset_file(self, article_id, asset_id):
         try:
             content = self.article_db_service.get_attachment(
@@ -0,0 +1,139 @@
+# coding=utf-8
+
+import collections
+import concurrent.futures
+import itertools
+import logging
+import os
+
+from .article_manager import (
+    ArticleManagerException,
+    prepare_package,
+)
+
+
+LOGGER = logging.getLogger(__name__)
+
+# pacotes em processamento ou aguardando escrita por processo, quando
+# max_in_flight não é informado
+IN_FLIGHT_PER_WORKER = 2
+
+# resultado do registro de um pacote: as listas de receive_package ou, em
+# caso de falha, a mensagem de erro
+IngestResult = collections.namedtuple('IngestResult', [
+    'id',
+    'unexpected_files_list',
+    'missing_files_list',
+    'updated',
+    'error',
+])
+
+
+def _prepare_package(id, xml_file, files, xml_streaming_threshold,
+                     xml_schemas_dir):
+    # executado nos processos de trabalho; ArticleManagerException não é
+    # serializável (pickle) e é devolvida como mensagem de erro
+    try:
+        return prepare_package(
+            id, xml_file, files, xml_streaming_threshold, xml_schemas_dir
+        ), None
+    except ArticleManagerException as e:
+        return None, e.message
+
+
+def _restore_contents(package, files):
+    # os ativos digitais são enviados aos processos de trabalho e devolvidos
+    # sem o conteúdo, que é obtido dos arquivos lidos
+    contents = {file.name: file.content for file in files}
+    return package._replace(files=[
+        (name, contents.get(name) if content is None else content, properties)
+        for name, content, properties in package.files
+    ])
+
+
+def _register_package(article_manager, id, files, future):
+    try:
+        package, error = future.result()
+        if error is None:
+            package = _restore_contents(package, files)
+            return IngestResult(
+                id, *article_manager.register_package(package), error=None)
+    except Exception as e:
+        LOGGER.exception('Package %s could not be ingested', id)
+        error = str(e) or e.__class__.__name__
+    return IngestResult(id, None, None, None, error)
+
+
+def ingest_packages(article_manager, packages, max_workers=None,
+                    max_in_flight=None):
+    """
+    Registra os pacotes de Artigos em lote. A etapa de processamento dos
+    pacotes (prepare_package: análise e validação do XML e obtenção do
+    conteúdo canônico e do XML com as URLs públicas) é distribuída entre
+    max_workers processos, aos quais são enviados o XML e somente as
+    propriedades (inclusive o SHA-1) dos ativos digitais, sem o conteúdo.
+    Os pacotes processados são persistidos pelo article_manager
+    (register_package) no processo corrente, na ordem em que ficam prontos;
+    os pacotes de um mesmo ID, porém, são persistidos na ordem em que foram
+    lidos, de modo que prevalece o último.
+
+    São lidos de packages no máximo max_in_flight pacotes ainda não
+    persistidos, o que limita a memória ocupada pelos conteúdos dos
+    arquivos. A falha de um pacote não interrompe o lote.
+
+    Params:
+    article_manager: ArticleManager
+    packages: iterável de tuplas (ID, File do XML, lista de File dos ativos
+        digitais)
+    max_workers: quantidade de processos; por padrão, a de CPUs
+    max_in_flight: quantidade máxima de pacotes em processamento ou
+        aguardando escrita; por padrão, IN_FLIGHT_PER_WORKER por processo
+
+    Retorno:
+    Iterador de IngestResult, um por pacote
+
+    Erro:
+    ValueError: max_workers ou max_in_flight menor que 1
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = max_workers * IN_FLIGHT_PER_WORKER
+    if max_workers < 1 or max_in_flight < 1:
+        raise ValueError('max_workers and max_in_flight must be at least 1')
+
+    packages = iter(packages)
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        # pacotes não persistidos, com os ativos digitais recebidos
+        pending = {}
+        # pacotes de cada ID não persistidos, na ordem em que foram lidos
+        queues = {}
+        # pacotes em processamento
+        running = set()
+        while True:
+            # os pacotes retidos atrás de outro de mesmo ID contam no limite
+            for id, xml_file, files in itertools.islice(
+                    packages, max_in_flight - len(pending)):
+                files = files or []
+                future = executor.submit(
+                    _prepare_package, id, xml_file,
+                    [file.without_content() for file in files],
+                    article_manager.xml_streaming_threshold,
+                    article_manager.xml_schemas_dir)
+                pending[future] = (id, files)
+                queues.setdefault(id, collections.deque()).append(future)
+                running.add(future)
+            if not pending:
+                break
+            done, running = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for id in {pending[future][0] for future in done}:
+                # persiste os pacotes prontos do ID até o primeiro que ainda
+                # está em processamento
+                queue = queues[id]
+                while queue and queue[0] not in running:
+                    future = queue.popleft()
+                    yield _register_package(
+                        article_manager, *pending.pop(future), future)
+                if not queue:
+                    del queues[id]
@@ -1,7 +1,10 @@
 # coding=utf-8
 
 import os
-from ..xml.article_xml_tree import ArticleXMLTree
+from ..xml.article_xml_stream import (
+    get_article_xml_tree,
+    STREAMING_THRESHOLD,
+)
 
 
 class AssetDocument:
@@ -40,12 +43,18 @@ class ArticleDocument:
     Os metadados contam com uma referência ao Artigo codificado em XML e
     referências aos seus ativos digitais.
 
+    XMLs maiores que ``xml_streaming_threshold`` bytes são lidos em partes
+    (:class:`managers.xml.article_xml_stream.ArticleXMLStream`), sem manter
+    a árvore completa em memória.
+
     Exemplo de uso:
 
         >>> doc = ArticleDocument('art01')
     """
-    def __init__(self, article_id):
+    def __init__(self, article_id,
+                 xml_streaming_threshold=STREAMING_THRESHOLD):
         self.id = article_id
+        self.xml_streaming_threshold = xml_streaming_threshold
         self.assets = {}
         self.unexpected_files_list = []
         self._xml_file = None
@@ -53,6 +62,11 @@ class ArticleDocument:
         self.xml_name = None
         self.xml_content = None
 
+        # revisão e datas do registro do Artigo na base de dados
+        self.document_rev = None
+        self.created_date = None
+        self.updated_date = None
+
     @property
     def xml_file(self):
         """Acessa ou define o documento Artigo em XML, representado por uma
@@ -72,10 +86,12 @@ class ArticleDocument:
     def xml_file(self, xml_file):
         self._xml_file = xml_file
         if xml_file is not None:
-            self.xml_tree = ArticleXMLTree(self._xml_file.content)
+            self.xml_tree = get_article_xml_tree(
+                self._xml_file.content, self.xml_streaming_threshold)
+            # XML mal formado (xml_tree.xml_error) não tem ativos
             self.assets = {
                 name: AssetDocument(node)
-                for name, node in self.xml_tree.asset_nodes.items()
+                for name, node in (self.xml_tree.asset_nodes or {}).items()
             }
 
     def update_asset_files(self, files):
@@ -157,6 +173,9 @@ class ArticleDocument:
         return _record
 
     def set_data(self, data):
+        self.document_rev = data.get('document_rev')
+        self.created_date = data.get('created_date')
+        self.updated_date = data.get('updated_date')
         content = self._v0_to_v1(data)
         self.manifest = content
         self.id = content['id']
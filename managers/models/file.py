@@ -16,6 +16,8 @@ class File:
         self.content_type = content_type
         if content_type is None and file_name is not None:
             self.content_type = mimetypes.guess_type(file_name)[0]
+        # SHA-1 mantido pelas cópias sem conteúdo (without_content)
+        self._sha1 = None
 
     def properties(self):
         """Retorna metadados do arquivo.
@@ -24,8 +26,26 @@ class File:
             'content_size': self.size,
             'content_type': self.content_type,
             'file_name': self.name,
+            'sha1': self.sha1,
         }
 
+    @property
+    def sha1(self):
+        """SHA-1 (hexadecimal) do conteúdo do arquivo, ou None sem conteúdo.
+        """
+        if self.content is not None:
+            return hashlib.sha1(self.content).hexdigest()
+        return self._sha1
+
+    def without_content(self):
+        """Retorna cópia do arquivo com os seus metadados, inclusive o SHA-1,
+        e sem o conteúdo.
+        """
+        file = File(self.name, content_type=self.content_type)
+        file.size = self.size
+        file._sha1 = self.sha1
+        return file
+
     def get_version(self):
         checksum = hashlib.sha1(self.content).hexdigest()
         return '/'.join([checksum[:13], self.name])
@@ -198,18 +198,19 @@ def dbserver_service(functional_config, database_config):
     seqnum_database_config = couchdb_config.copy()
     seqnum_database_config['database_name'] = "seqnum"
 
-    seqnumber_generator = SeqNumGenerator(
-        CouchDBManager(**seqnum_database_config),
-        'CHANGE'
-    )
-    changes_service = ChangesService(
-        CouchDBManager(**changes_database_config),
-        seqnumber_generator
-    )
-    return (
-        CouchDBManager(**articles_database_config),
-        changes_service
-    )
+    db_managers = [
+        CouchDBManager(**database_config)
+        for database_config in (seqnum_database_config,
+                                changes_database_config,
+                                articles_database_config)
+    ]
+    for db_manager in db_managers:
+        db_manager.create_database()
+    seqnum_db_manager, changes_db_manager, articles_db_manager = db_managers
+
+    seqnumber_generator = SeqNumGenerator(seqnum_db_manager, 'CHANGE')
+    changes_service = ChangesService(changes_db_manager, seqnumber_generator)
+    return (articles_db_manager, changes_service)
 
 
 @pytest.fixture
@@ -1,10 +1,12 @@
 from unittest.mock import patch
 
 import pytest
+from lxml import etree
 
 from persistence.databases import (
     DocumentNotFound,
     DBFailed,
+    UpdateFailure,
 )
 from persistence.services import DatabaseService
 from persistence.models import RecordType
@@ -14,8 +16,12 @@ from managers.models.article_model import (
 )
 from managers.article_manager import (
     ArticleManager,
-    ArticleManagerException
+    ArticleManagerConflictException,
+    ArticleManagerException,
+    ArticleManagerInvalidXMLException,
+    PUBLIC_XML_FILE_ID,
 )
+from managers.models.file import File
 from managers.xml.xml_tree import (
     XMLTree
 )
@@ -27,7 +33,7 @@ def test_receive_xml_file(databaseservice_params, test_package_A,
         databaseservice_params[0],
         databaseservice_params[1])
     expected = {
-        'attachments': [test_packA_filenames[0]],
+        'attachments': [test_packA_filenames[0], PUBLIC_XML_FILE_ID],
         'content': {
             'xml': test_packA_filenames[0],
         },
@@ -48,13 +54,282 @@ def test_receive_package(databaseservice_params, test_package_A):
     article_manager = ArticleManager(
         databaseservice_params[0],
         databaseservice_params[1])
-    unexpected, missing = article_manager.receive_package(
+    unexpected, missing, updated = article_manager.receive_package(
         id='ID',
         xml_file=test_package_A[0],
         files=test_package_A[1:]
     )
     assert unexpected == []
     assert missing == []
+    assert sorted(updated) == sorted(file.name for file in test_package_A)
+
+
+def test_receive_package_writes_package_once(databaseservice_params,
+                                            test_package_A,
+                                            test_packA_filenames):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    got = article_manager.article_db_service.read('ID')
+    assert sorted(got['attachments']) == \
+        sorted(test_packA_filenames + (PUBLIC_XML_FILE_ID, ))
+    changes = databaseservice_params[1].changes_db_manager.find({}, [], [])
+    assert len(changes) == 1
+    assert changes[0]['document_id'] == 'ID'
+    assert changes[0]['type'] == 'C'
+
+
+def test_receive_package_streaming(databaseservice_params, test_package_A,
+                                   test_packA_filenames):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1],
+        xml_streaming_threshold=0)
+    unexpected, missing, updated = article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    assert missing == []
+    assert sorted(updated) == sorted(test_packA_filenames)
+    xml_content = article_manager.get_article_file('ID')
+    assert xml_content == XMLTree(test_package_A[0].content).content
+    content, properties = article_manager.open_public_xml('ID')
+    public_xml = content.read()
+    for name in test_packA_filenames[1:]:
+        assert '/articles/ID/assets/{}'.format(name).encode() in public_xml
+
+
+def test_receive_package_invalid_xml_writes_nothing(databaseservice_params,
+                                                    test_package_A, tmpdir):
+    tmpdir.join('sps-1.2.xsd').write(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+        '<xs:element name="article"><xs:complexType/></xs:element>'
+        '</xs:schema>'
+    )
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1],
+        xml_schemas_dir=str(tmpdir))
+    with pytest.raises(ArticleManagerInvalidXMLException) as excinfo:
+        article_manager.receive_package(
+            id='ID',
+            xml_file=test_package_A[0],
+            files=test_package_A[1:]
+        )
+    assert 'is not valid' in excinfo.value.message
+    with pytest.raises(DocumentNotFound):
+        article_manager.article_db_service.read('ID')
+    changes = databaseservice_params[1].changes_db_manager.find({}, [], [])
+    assert changes == []
+
+
+@pytest.mark.parametrize('validate', [False, True])
+@pytest.mark.parametrize('xml_streaming_threshold', [None, 0])
+def test_receive_package_malformed_xml_writes_nothing(databaseservice_params,
+                                                      test_package_A, tmpdir,
+                                                      validate,
+                                                      xml_streaming_threshold):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1],
+        xml_streaming_threshold=xml_streaming_threshold,
+        xml_schemas_dir=str(tmpdir) if validate else None)
+    with pytest.raises(ArticleManagerInvalidXMLException) as excinfo:
+        article_manager.receive_package(
+            id='ID',
+            xml_file=File(file_name='malformed.xml',
+                          content=b'<article><p></article>'),
+            files=test_package_A[1:]
+        )
+    assert 'malformed.xml is not valid' in excinfo.value.message
+    with pytest.raises(DocumentNotFound):
+        article_manager.article_db_service.read('ID')
+
+
+def test_receive_package_valid_xml(databaseservice_params, test_package_A,
+                                   test_packA_filenames, tmpdir):
+    tmpdir.join('sps-1.2.xsd').write(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+        '<xs:element name="article"><xs:complexType mixed="true">'
+        '<xs:sequence><xs:any processContents="skip" minOccurs="0"'
+        ' maxOccurs="unbounded"/></xs:sequence>'
+        '<xs:anyAttribute processContents="skip"/>'
+        '</xs:complexType></xs:element></xs:schema>'
+    )
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1],
+        xml_schemas_dir=str(tmpdir))
+    unexpected, missing, updated = article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    assert sorted(updated) == sorted(test_packA_filenames)
+
+
+def test_receive_package_unchanged_writes_nothing(databaseservice_params,
+                                                  test_package_A):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    registered = article_manager.article_db_service.read('ID')
+    unexpected, missing, updated = article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    assert updated == []
+    got = article_manager.article_db_service.read('ID')
+    assert got['document_rev'] == registered['document_rev']
+    assert got.get('updated_date') is None
+    changes = databaseservice_params[1].changes_db_manager.find({}, [], [])
+    assert len(changes) == 1
+
+
+def test_receive_package_writes_changed_asset_only(databaseservice_params,
+                                                   test_package_A):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    changed_asset = File(file_name=test_package_A[1].name,
+                         content=b'changed content')
+    unexpected, missing, updated = article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=[changed_asset] + list(test_package_A[2:])
+    )
+    assert updated == [changed_asset.name]
+    content_type, content = article_manager.get_asset_file(
+        'ID', changed_asset.name)
+    assert content == b'changed content'
+    got = article_manager.article_db_service.read_for_update('ID')
+    assert got['attachments_properties'][changed_asset.name]['sha1'] == \
+        changed_asset.sha1
+    changes = databaseservice_params[1].changes_db_manager.find({}, [], [])
+    assert sorted(change['type'] for change in changes) == ['C', 'U']
+
+
+def test_receive_package_registered_concurrently_is_updated(
+        databaseservice_params, test_package_A):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    changed_asset = File(file_name=test_package_A[1].name,
+                         content=b'changed content')
+    db_service = article_manager.article_db_service
+    # outra requisição registra o Artigo após a leitura deste pacote
+    with patch.object(db_service, 'read_for_update',
+                      side_effect=[DocumentNotFound,
+                                   db_service.read_for_update('ID')]):
+        unexpected, missing, updated = article_manager.receive_package(
+            id='ID',
+            xml_file=test_package_A[0],
+            files=[changed_asset] + list(test_package_A[2:])
+        )
+    assert updated == [changed_asset.name]
+    content_type, content = article_manager.get_asset_file(
+        'ID', changed_asset.name)
+    assert content == b'changed content'
+    changes = databaseservice_params[1].changes_db_manager.find({}, [], [])
+    assert sorted(change['type'] for change in changes) == ['C', 'U']
+
+
+def test_receive_package_update_conflict(databaseservice_params,
+                                         test_package_A):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    changed_asset = File(file_name=test_package_A[1].name,
+                         content=b'changed content')
+    with patch.object(article_manager.article_db_service,
+                      'update_with_attachments',
+                      side_effect=UpdateFailure('Document update conflict')):
+        with pytest.raises(ArticleManagerConflictException):
+            article_manager.receive_package(
+                id='ID',
+                xml_file=test_package_A[0],
+                files=[changed_asset] + list(test_package_A[2:])
+            )
+
+
+def test_receive_package_stores_public_xml(databaseservice_params,
+                                          test_package_A,
+                                          test_packA_filenames):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article = article_manager.receive_xml_file(id='ID',
+                                               xml_file=test_package_A[0])
+    content, properties = article_manager.open_public_xml('ID')
+    public_xml = XMLTree(content.read())
+    hrefs = [
+        node.get('{http://www.w3.org/1999/xlink}href')
+        for node in public_xml.tree.findall(
+            './/*[@{http://www.w3.org/1999/xlink}href]')
+    ]
+    for name in test_packA_filenames[1:]:
+        assert '/articles/ID/assets/{}'.format(name) in hrefs
+    assert properties['content_type'] == 'application/xml'
+    # os hrefs do XML registrado e do Artigo não são alterados
+    assert sorted(article.assets) == sorted(test_packA_filenames[1:])
+    xml_content = article_manager.get_article_file('ID')
+    assert b'/articles/ID/assets/' not in xml_content
+    assert PUBLIC_XML_FILE_ID not in \
+        article_manager.get_article_data('ID')['attachments']
+
+
+@pytest.mark.parametrize('xml_streaming_threshold', [None, 0])
+def test_receive_package_stores_well_formed_xml_with_entities(
+        databaseservice_params, xml_streaming_threshold):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1],
+        xml_streaming_threshold=xml_streaming_threshold)
+    xml_file = File(
+        file_name='a.xml',
+        content=b'<!DOCTYPE article [<!ENTITY foo "FOO">]>'
+                b'<article><p>a &foo; b</p></article>'
+    )
+    article_manager.receive_package(id='ID', xml_file=xml_file, files=[])
+    content, properties = article_manager.open_public_xml('ID')
+    for xml_content in (article_manager.get_article_file('ID'),
+                        content.read()):
+        tree = etree.fromstring(xml_content)
+        assert tree.findtext('p') == 'a FOO b'
+
+
+def test_open_public_xml_not_registered(databaseservice_params):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    assert article_manager.open_public_xml('ID') is None
 
 
 @patch.object(DatabaseService, 'read')
@@ -207,6 +482,25 @@ def test_get_asset_file(databaseservice_params,
         assert file.content == content
 
 
+def test_open_asset_file(databaseservice_params, test_package_A):
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+    article_manager.receive_package(id='ID',
+                                    xml_file=test_package_A[0],
+                                    files=test_package_A[1:])
+    for file in test_package_A[1:]:
+        content, properties = article_manager.open_asset_file('ID', file.name)
+        assert content.read() == file.content
+        assert properties['content_size'] == len(file.content)
+    pytest.raises(
+        ArticleManagerException,
+        article_manager.open_asset_file,
+        'ID',
+        'missing.jpg'
+    )
+
+
 def test_get_asset_files(databaseservice_params, test_package_A):
     files = test_package_A[1:]
     article_manager = ArticleManager(
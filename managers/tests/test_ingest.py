@@ -0,0 +1,239 @@
+import concurrent.futures
+import time
+from unittest.mock import patch
+
+import pytest
+
+from managers import ingest
+from managers.article_manager import (
+    ArticleManager,
+    PUBLIC_XML_FILE_ID,
+)
+from managers.ingest import ingest_packages
+from managers.models.file import File
+from persistence.databases import InMemoryDBManager
+
+
+@pytest.fixture
+def article_manager(databaseservice_params):
+    return ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1])
+
+
+def test_ingest_packages(article_manager, test_package_A, test_package_C,
+                         test_packA_filenames):
+    packages = [
+        ('ID{}'.format(i), test_package_A[0], test_package_A[1:])
+        for i in range(4)
+    ]
+    packages.append(('IDC', test_package_C[0], test_package_C[1:]))
+    results = list(ingest_packages(
+        article_manager, packages, max_workers=2, max_in_flight=2))
+
+    results = {result.id: result for result in results}
+    assert sorted(results) == ['ID0', 'ID1', 'ID2', 'ID3', 'IDC']
+    for i in range(4):
+        result = results['ID{}'.format(i)]
+        assert result.error is None
+        assert result.unexpected_files_list == []
+        assert result.missing_files_list == []
+        assert sorted(result.updated) == sorted(test_packA_filenames)
+        got = article_manager.article_db_service.read('ID{}'.format(i))
+        assert sorted(got['attachments']) == \
+            sorted(test_packA_filenames + (PUBLIC_XML_FILE_ID, ))
+    assert results['IDC'].unexpected_files_list == ['fig.jpg']
+
+
+def test_ingest_packages_same_result_as_receive_package(
+        databaseservice_params, article_manager, test_package_A):
+    list(ingest_packages(
+        article_manager,
+        [('ID', test_package_A[0], test_package_A[1:])],
+        max_workers=1))
+    ingested = article_manager.article_db_service.read_for_update('ID')
+
+    expected_manager = ArticleManager(
+        InMemoryDBManager(database_name='expected'),
+        databaseservice_params[1])
+    expected_manager.receive_package(
+        id='ID',
+        xml_file=test_package_A[0],
+        files=test_package_A[1:]
+    )
+    expected = expected_manager.article_db_service.read_for_update('ID')
+    assert ingested['content'] == expected['content']
+    assert ingested['attachments_properties'] == \
+        expected['attachments_properties']
+    assert article_manager.open_public_xml('ID')[0].read() == \
+        expected_manager.open_public_xml('ID')[0].read()
+
+
+def test_ingest_packages_unchanged_writes_nothing(article_manager,
+                                                  test_package_A):
+    packages = [('ID', test_package_A[0], test_package_A[1:])]
+    list(ingest_packages(article_manager, packages, max_workers=1))
+    rev = article_manager.article_db_service.read('ID')['document_rev']
+
+    result, = ingest_packages(article_manager, packages, max_workers=1)
+    assert result.error is None
+    assert result.updated == []
+    assert article_manager.article_db_service.read('ID')['document_rev'] == \
+        rev
+
+
+def test_ingest_packages_failure_does_not_stop_batch(article_manager,
+                                                     test_package_A):
+    register_package = article_manager.register_package
+
+    def fail_bad_package(package):
+        if package.id == 'BAD':
+            raise RuntimeError('deliberate failure')
+        return register_package(package)
+
+    packages = [
+        ('BAD', test_package_A[0], test_package_A[1:]),
+        ('ID', test_package_A[0], test_package_A[1:]),
+    ]
+    with patch.object(article_manager, 'register_package',
+                      side_effect=fail_bad_package):
+        results = {
+            result.id: result
+            for result in ingest_packages(article_manager, packages,
+                                          max_workers=1)
+        }
+    assert results['BAD'].error == 'deliberate failure'
+    assert results['BAD'].updated is None
+    assert results['ID'].error is None
+    article_manager.article_db_service.read('ID')
+
+
+def test_ingest_packages_sends_assets_without_content(article_manager,
+                                                      test_package_A):
+    sent = []
+
+    def prepare_package(id, xml_file, files, *args):
+        sent.extend(files)
+        return ingest.prepare_package(id, xml_file, files, *args), None
+
+    # processamento em threads, que compartilham o patch
+    with patch.object(concurrent.futures, 'ProcessPoolExecutor',
+                      concurrent.futures.ThreadPoolExecutor), \
+            patch.object(ingest, '_prepare_package', prepare_package):
+        result, = ingest_packages(
+            article_manager,
+            [('ID', test_package_A[0], test_package_A[1:])],
+            max_workers=1)
+    assert result.error is None
+    assert [file.content for file in sent] == [None] * len(sent)
+    assert [file.sha1 for file in sent] == \
+        [file.sha1 for file in test_package_A[1:]]
+    for file in test_package_A[1:]:
+        content_type, content = article_manager.get_asset_file(
+            'ID', file.name)
+        assert content == file.content
+
+
+def test_ingest_packages_same_id_written_in_order(article_manager,
+                                                  test_package_A):
+    changed_asset = File(file_name=test_package_A[1].name,
+                         content=b'changed content')
+
+    def prepare_package(id, xml_file, files, *args):
+        # o primeiro pacote fica pronto depois do segundo
+        if files[0].sha1 != changed_asset.sha1:
+            time.sleep(0.2)
+        return ingest.prepare_package(id, xml_file, files, *args), None
+
+    packages = [
+        ('ID', test_package_A[0], test_package_A[1:]),
+        ('ID', test_package_A[0], [changed_asset] + list(test_package_A[2:])),
+    ]
+    with patch.object(concurrent.futures, 'ProcessPoolExecutor',
+                      concurrent.futures.ThreadPoolExecutor), \
+            patch.object(ingest, '_prepare_package', prepare_package):
+        results = list(ingest_packages(article_manager, packages,
+                                       max_workers=2))
+    assert [result.error for result in results] == [None, None]
+    assert results[1].updated == [changed_asset.name]
+    content_type, content = article_manager.get_asset_file(
+        'ID', changed_asset.name)
+    assert content == b'changed content'
+
+
+def test_ingest_packages_invalid_xml(databaseservice_params, test_package_A,
+                                     tmpdir):
+    tmpdir.join('sps-1.2.xsd').write(
+        '<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+        '<xs:element name="article"><xs:complexType/></xs:element>'
+        '</xs:schema>'
+    )
+    article_manager = ArticleManager(
+        databaseservice_params[0],
+        databaseservice_params[1],
+        xml_schemas_dir=str(tmpdir))
+    result, = ingest_packages(
+        article_manager,
+        [('ID', test_package_A[0], test_package_A[1:])],
+        max_workers=1)
+    assert 'is not valid' in result.error
+    changes = databaseservice_params[1].changes_db_manager.find({}, [], [])
+    assert changes == []
+
+
+def test_ingest_packages_bounds_packages_in_flight(article_manager,
+                                                   test_package_A):
+    read = []
+
+    def packages():
+        for i in range(6):
+            read.append(i)
+            yield 'ID{}'.format(i), test_package_A[0], test_package_A[1:]
+
+    ingested = 0
+    for result in ingest_packages(article_manager, packages(),
+                                  max_workers=2, max_in_flight=3):
+        assert len(read) - ingested <= 3
+        ingested += 1
+    assert ingested == 6
+
+
+def test_ingest_packages_bounds_same_id_packages_in_flight(article_manager,
+                                                           test_package_A):
+    changed_asset = File(file_name=test_package_A[1].name,
+                         content=b'changed content')
+    read = []
+
+    def prepare_package(id, xml_file, files, *args):
+        # os pacotes seguintes ficam prontos antes do primeiro e aguardam
+        # a sua escrita
+        if files[0].sha1 == changed_asset.sha1:
+            time.sleep(0.2)
+        return ingest.prepare_package(id, xml_file, files, *args), None
+
+    def packages():
+        read.append(0)
+        yield 'ID', test_package_A[0], \
+            [changed_asset] + list(test_package_A[2:])
+        for i in range(1, 6):
+            read.append(i)
+            yield 'ID', test_package_A[0], test_package_A[1:]
+
+    ingested = 0
+    with patch.object(concurrent.futures, 'ProcessPoolExecutor',
+                      concurrent.futures.ThreadPoolExecutor), \
+            patch.object(ingest, '_prepare_package', prepare_package):
+        for result in ingest_packages(article_manager, packages(),
+                                      max_workers=2, max_in_flight=3):
+            assert result.error is None
+            assert len(read) - ingested <= 3
+            ingested += 1
+    assert ingested == 6
+    content_type, content = article_manager.get_asset_file(
+        'ID', test_package_A[1].name)
+    assert content == test_package_A[1].content
+
+
+def test_ingest_packages_invalid_max_in_flight(article_manager):
+    with pytest.raises(ValueError):
+        list(ingest_packages(article_manager, [], max_in_flight=0))
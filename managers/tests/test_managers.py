@@ -5,6 +5,7 @@ from unittest.mock import patch
 import managers
 from persistence.services import DatabaseService
 from managers.article_manager import ArticleManager
+from persistence.pool import DBManagerPool
 
 
 @patch.object(managers, '_get_changes_services')
@@ -49,3 +50,20 @@ def test_post_article(
     mocked_article_manager_add.assert_called_once()
     assert result is not None
     assert result == expected
+
+
+def test_get_db_manager_uses_database_pool(database_config):
+    db_settings = {
+        'database_uri': '{}:{}'.format(
+            database_config['db_host'],
+            database_config['db_port']
+        ),
+        'database_username': database_config['username'],
+        'database_password': database_config['password'],
+        'database_pool': DBManagerPool(),
+    }
+    article_manager = managers._get_article_manager(**db_settings)
+    other_article_manager = managers._get_article_manager(**db_settings)
+    assert article_manager.article_db_service.db_manager is \
+        other_article_manager.article_db_service.db_manager
+    assert 'database_pool' in db_settings
@@ -1,7 +1,27 @@
+import hashlib
+import importlib.util
+import threading
+from io import BytesIO
+from unittest.mock import patch
 
+import pytest
+from lxml import etree
+
+from managers.xml import (
+    parsers,
+    validation,
+)
 from managers.xml.xml_tree import (
     XMLTree
 )
+from managers.xml.article_xml_tree import (
+    ArticleXMLTree
+)
+from managers.xml.article_xml_stream import (
+    ArticleXMLStream,
+    get_article_xml_tree,
+    stream_article_xml,
+)
 
 
 def test_good_xml():
@@ -116,3 +136,283 @@ def test_otimized_elimina_tab_linebreak_em_elementos_que_nao_contem_texto():
     """
     s_expected = '<article><p>A ljllj </p><p>Parágrafo 2</p></article>'
     otimize(s_xml, s_expected)
+
+
+def test_otimized_reduz_sequencias_de_espacos():
+    s_xml = '<article id="a    b">' \
+        '<p>A' + ' ' * 1000 + 'ljllj   <bold>Ção</bold>    </p>' \
+        '</article>'
+    s_expected = '<article id="a b"><p>A ljllj <bold>Ção</bold> </p>' \
+        '</article>'
+    otimize(s_xml, s_expected)
+
+
+def test_content_e_digest_sao_memorizados():
+    xml_tree = XMLTree(b'<article id="a1">\n<text/>\n</article>')
+    content = xml_tree.content
+    assert xml_tree.content is content
+    assert xml_tree.digest == hashlib.sha1(content).hexdigest()
+
+
+def test_digest_xml_mal_formado():
+    assert XMLTree(b'<article id="a1">\n<text>\n</article>').digest is None
+
+
+def test_alteracao_de_href_invalida_content_e_digest():
+    xml_tree = ArticleXMLTree(
+        b'<article xmlns:xlink="http://www.w3.org/1999/xlink">'
+        b'<graphic xlink:href="a.jpg"/></article>'
+    )
+    digest = xml_tree.digest
+    xml_tree.asset_nodes['a.jpg'].href = '/articles/ID/assets/a.jpg'
+    assert b'/articles/ID/assets/a.jpg' in xml_tree.content
+    assert xml_tree.digest != digest
+
+
+def test_asset_nodes_indice_obtido_uma_vez_por_arvore():
+    xml_tree = ArticleXMLTree(
+        b'<article xmlns:xlink="http://www.w3.org/1999/xlink">'
+        b'<graphic xlink:href="a.jpg"/>'
+        b'<ext-link xlink:href="http://www.scielo.br/a.jpg"/>'
+        b'<graphic xlink:href="b.jpg"/></article>'
+    )
+    asset_nodes = xml_tree.asset_nodes
+    assert list(asset_nodes) == ['a.jpg', 'b.jpg']
+    assert xml_tree.asset_nodes is asset_nodes
+    assert [node.href for node in xml_tree.external_href_nodes] == \
+        ['http://www.scielo.br/a.jpg']
+
+
+def test_asset_nodes_acompanha_alteracao_de_href():
+    xml_tree = ArticleXMLTree(
+        b'<article xmlns:xlink="http://www.w3.org/1999/xlink">'
+        b'<graphic xlink:href="a.jpg"/><graphic xlink:href="b.jpg"/>'
+        b'</article>'
+    )
+    node = xml_tree.asset_nodes['a.jpg']
+    node.href = '/articles/ID/assets/a.jpg'
+    assert list(xml_tree.asset_nodes) == \
+        ['/articles/ID/assets/a.jpg', 'b.jpg']
+    node.href = 'a.jpg'
+    assert list(xml_tree.asset_nodes) == ['a.jpg', 'b.jpg']
+    assert xml_tree.asset_nodes['a.jpg'] is node
+
+
+def test_asset_nodes_novo_conteudo_refaz_indice():
+    xml_tree = ArticleXMLTree(
+        b'<article xmlns:xlink="http://www.w3.org/1999/xlink">'
+        b'<graphic xlink:href="a.jpg"/></article>'
+    )
+    assert list(xml_tree.asset_nodes) == ['a.jpg']
+    xml_tree.content = (
+        b'<article xmlns:xlink="http://www.w3.org/1999/xlink">'
+        b'<graphic xlink:href="c.jpg"/></article>'
+    )
+    assert list(xml_tree.asset_nodes) == ['c.jpg']
+
+
+STREAM_XML = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<!DOCTYPE article>\n'
+    '<article xmlns:xlink="http://www.w3.org/1999/xlink" xml:lang="pt">\n'
+    '  <!--  comentário  -->\n'
+    '  <p id="p1">Texto   com <bold>Ção</bold> &amp; espaços\r\n'
+    '    <graphic xlink:href="a.jpg"/>\n'
+    '  </p>\n'
+    '  <fig><graphic xlink:href="b.tif"/><?pi  dados  ?></fig>\n'
+    '  <ext-link xlink:href="http://www.scielo.br/a.jpg"> </ext-link>\n'
+    '  <graphic xlink:href="a.jpg"/>\n'
+    '</article>\n'
+).encode('utf-8')
+
+
+def test_stream_article_xml_equivale_a_article_xml_tree():
+    xml_tree = ArticleXMLTree(STREAM_XML)
+    output = BytesIO()
+    assets = stream_article_xml(BytesIO(STREAM_XML), output)
+    assert assets == list(xml_tree.asset_nodes) == ['a.jpg', 'b.tif']
+    assert output.getvalue() == xml_tree.content
+
+
+def test_stream_article_xml_sem_output_obtem_ativos():
+    assert stream_article_xml(BytesIO(STREAM_XML)) == ['a.jpg', 'b.tif']
+
+
+def test_stream_article_xml_substitui_hrefs():
+    output = BytesIO()
+    stream_article_xml(
+        BytesIO(STREAM_XML), output, {'a.jpg': '/articles/ID/assets/a.jpg'})
+    assert output.getvalue().count(b'"/articles/ID/assets/a.jpg"') == 2
+    assert b'"b.tif"' in output.getvalue()
+
+
+def test_article_xml_stream_alteracao_de_href():
+    xml_tree = ArticleXMLTree(STREAM_XML)
+    xml_stream = ArticleXMLStream(STREAM_XML)
+    assert xml_stream.content == xml_tree.content
+    assert xml_stream.digest == xml_tree.digest
+    for tree in (xml_tree, xml_stream):
+        tree.asset_nodes['b.tif'].href = '/articles/ID/assets/b.tif'
+    assert list(xml_stream.asset_nodes) == \
+        ['a.jpg', '/articles/ID/assets/b.tif']
+    assert xml_stream.content == xml_tree.content
+    assert xml_stream.digest == xml_tree.digest
+
+
+def test_article_xml_stream_xml_mal_formado():
+    xml_stream = ArticleXMLStream(b'<article id="a1">\n<text>\n</article>')
+    assert xml_stream.xml_error is not None
+    assert xml_stream.content is None
+    assert xml_stream.digest is None
+    assert xml_stream.asset_nodes is None
+
+
+def test_get_article_xml_tree_seleciona_leitura_em_partes_pelo_tamanho():
+    assert isinstance(
+        get_article_xml_tree(STREAM_XML, len(STREAM_XML) - 1),
+        ArticleXMLStream)
+    assert isinstance(
+        get_article_xml_tree(STREAM_XML, len(STREAM_XML)), ArticleXMLTree)
+    assert isinstance(get_article_xml_tree(STREAM_XML, None), ArticleXMLTree)
+
+
+def test_get_parser_reutiliza_parser_da_thread():
+    parser = parsers.get_parser()
+    assert parsers.get_parser() is parser
+    assert parsers.get_parser(remove_blank_text=True) is not parser
+    other_thread_parsers = []
+    thread = threading.Thread(
+        target=lambda: other_thread_parsers.append(parsers.get_parser()))
+    thread.start()
+    thread.join()
+    assert other_thread_parsers[0] is not parser
+
+
+def test_xml_tree_substitui_apenas_entidades_internas(tmpdir):
+    xml = (
+        b'<!DOCTYPE article [\n'
+        b'<!ENTITY lol "lol">\n'
+        b'<!ENTITY lol2 "&lol;&lol;&lol;">\n'
+        b']>\n'
+        b'<article><p>a &lol2; b</p></article>'
+    )
+    expected = b'<article><p>a lollollol b</p></article>'
+    assert XMLTree(xml).content == expected
+    output = BytesIO()
+    stream_article_xml(BytesIO(xml), output)
+    assert output.getvalue() == expected
+
+
+def test_xml_tree_rejeita_entidades_externas_e_nao_declaradas(tmpdir):
+    secret = tmpdir.join('secret.txt')
+    secret.write('secret')
+    external = (
+        '<!DOCTYPE article [<!ENTITY secret SYSTEM "file://{}">]>'
+        '<article><p>&secret;</p></article>'
+    ).format(secret).encode('utf-8')
+    undeclared = (
+        b'<!DOCTYPE article PUBLIC "-//NLM//DTD JATS//EN" "JATS.dtd">'
+        b'<article><p>&foo;</p></article>'
+    )
+    for xml in (external, undeclared):
+        assert XMLTree(xml).xml_error is not None
+        assert ArticleXMLStream(xml).xml_error is not None
+
+
+def test_xml_tree_rejeita_expansao_exponencial_de_entidades():
+    entities = ''.join(
+        '<!ENTITY lol{} "{}">'.format(i, '&lol{};'.format(i - 1) * 10)
+        for i in range(1, 10)
+    )
+    xml = (
+        '<!DOCTYPE article [<!ENTITY lol0 "lol">{}]>'
+        '<article><p>&lol9;</p></article>'
+    ).format(entities).encode('utf-8')
+    assert XMLTree(xml).xml_error is not None
+
+
+@pytest.mark.parametrize('lxml_version, libxml_version', [
+    ((4, 2, 1, 0), (2, 14, 6)),
+    ((6, 1, 3, 0), (2, 9, 8)),
+])
+def test_parsers_exigem_lxml_que_resolve_apenas_entidades_internas(
+        lxml_version, libxml_version):
+    spec = importlib.util.spec_from_file_location(
+        'parsers_copy', parsers.__file__)
+    with patch.object(etree, 'LXML_VERSION', lxml_version), \
+            patch.object(etree, 'LIBXML_VERSION', libxml_version):
+        with pytest.raises(ImportError):
+            spec.loader.exec_module(importlib.util.module_from_spec(spec))
+
+
+VALIDATION_XML = (
+    b'<article specific-use="sps-test" dtd-version="1.0">'
+    b'<front/><body><p>a</p></body></article>'
+)
+VALIDATION_XSD = (
+    b'<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema">'
+    b'<xs:element name="article"><xs:complexType><xs:sequence>'
+    b'<xs:element name="front"/><xs:element name="body" minOccurs="0"/>'
+    b'</xs:sequence><xs:anyAttribute processContents="skip"/>'
+    b'</xs:complexType></xs:element></xs:schema>'
+)
+VALIDATION_DTD = (
+    b'<!ELEMENT article (front, body?)>'
+    b'<!ATTLIST article specific-use CDATA #IMPLIED'
+    b' dtd-version CDATA #IMPLIED>'
+    b'<!ELEMENT front EMPTY><!ELEMENT body (p*)><!ELEMENT p (#PCDATA)>'
+)
+
+
+def test_validate_article_xml_com_xsd(tmpdir):
+    tmpdir.join('sps-test.xsd').write_binary(VALIDATION_XSD)
+    invalid = VALIDATION_XML.replace(b'<front/>', b'')
+    for tree_class in (ArticleXMLTree, ArticleXMLStream):
+        assert validation.validate_article_xml(
+            tree_class(VALIDATION_XML), str(tmpdir)) == []
+        errors = validation.validate_article_xml(
+            tree_class(invalid), str(tmpdir))
+        assert len(errors) == 1
+        assert 'body' in errors[0]
+
+
+def test_validate_article_xml_com_dtd(tmpdir):
+    tmpdir.join('1.0.dtd').write_binary(VALIDATION_DTD)
+    xml = VALIDATION_XML.replace(b' specific-use="sps-test"', b'')
+    invalid = xml.replace(b'<p>a</p>', b'<sec/>')
+    for tree_class in (ArticleXMLTree, ArticleXMLStream):
+        assert validation.validate_article_xml(
+            tree_class(xml), str(tmpdir)) == []
+        assert validation.validate_article_xml(
+            tree_class(invalid), str(tmpdir)) != []
+
+
+def test_get_validator_compila_schema_uma_vez(tmpdir):
+    tmpdir.join('sps-test.xsd').write_binary(VALIDATION_XSD)
+    validator = validation.get_validator('sps-test', str(tmpdir))
+    assert validator is validation.get_validator('sps-test', str(tmpdir))
+
+
+def test_get_validator_nao_memoriza_schema_ausente(tmpdir):
+    assert validation.get_validator('sps-test', str(tmpdir)) is None
+    tmpdir.join('sps-test.xsd').write_binary(VALIDATION_XSD)
+    assert validation.get_validator('sps-test', str(tmpdir)) is not None
+
+
+def test_validate_article_xml_mal_formado(tmpdir):
+    for tree_class in (ArticleXMLTree, ArticleXMLStream):
+        errors = validation.validate_article_xml(
+            tree_class(b'<article><p></article>'), str(tmpdir))
+        assert len(errors) == 1
+
+
+def test_validate_article_xml_sem_schema_para_versao(tmpdir):
+    errors = validation.validate_article_xml(
+        ArticleXMLTree(VALIDATION_XML), str(tmpdir))
+    assert errors == ['No schema available for version sps-test']
+
+
+def test_get_validator_versao_nao_compoe_caminho(tmpdir):
+    tmpdir.join('sps-test.xsd').write_binary(VALIDATION_XSD)
+    version = '../{}/sps-test'.format(tmpdir.basename)
+    assert validation.get_validator(version, str(tmpdir)) is None
@@ -0,0 +1,322 @@
+# coding=utf-8
+
+import hashlib
+import re
+from io import BytesIO
+
+from lxml import etree
+
+from . import parsers
+from .article_xml_tree import (
+    ArticleXMLTree,
+    is_local_href,
+)
+from .validation import (
+    get_errors,
+    get_schema_version,
+)
+from .xml_tree import namespaces
+
+
+# tamanho, em bytes, do XML a partir do qual os ativos digitais são obtidos
+# e o XML é serializado por leitura em partes (ArticleXMLStream), sem manter
+# a árvore completa em memória
+STREAMING_THRESHOLD = 10 * 1024 * 1024
+
+XLINK_HREF = '{%s}href' % namespaces['xlink']
+XML_NAMESPACE = namespaces['xml']
+
+SPACES = re.compile('  +')
+# escapes do libxml2 para texto e para valores de atributos
+TEXT_ESCAPES = str.maketrans({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '\r': '&#13;',
+})
+ATTRIBUTE_ESCAPES = str.maketrans({
+    '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;',
+    '\n': '&#10;', '\r': '&#13;', '\t': '&#9;',
+})
+
+
+def _text(value):
+    return SPACES.sub(' ', value).translate(TEXT_ESCAPES)
+
+
+def _attribute(value):
+    return SPACES.sub(' ', value).translate(ATTRIBUTE_ESCAPES)
+
+
+def _qualified_name(name, nsmap):
+    qname = etree.QName(name)
+    if qname.namespace is None:
+        return qname.localname
+    if qname.namespace == XML_NAMESPACE:
+        return 'xml:' + qname.localname
+    for prefix, uri in nsmap.items():
+        if prefix is not None and uri == qname.namespace:
+            return prefix + ':' + qname.localname
+    return qname.localname
+
+
+def _start_tag(elem, parent_nsmap):
+    nsmap = elem.nsmap
+    localname = etree.QName(elem).localname
+    tag = elem.prefix + ':' + localname if elem.prefix else localname
+    parts = ['<', tag]
+    for prefix, uri in nsmap.items():
+        if parent_nsmap.get(prefix) != uri:
+            declaration = 'xmlns' if prefix is None else 'xmlns:' + prefix
+            parts.append(' {}="{}"'.format(
+                declaration, uri.translate(ATTRIBUTE_ESCAPES)))
+    for name, value in elem.attrib.items():
+        parts.append(' {}="{}"'.format(
+            _qualified_name(name, nsmap), _attribute(value)))
+    return tag, ''.join(parts)
+
+
+def stream_article_xml(source, output=None, hrefs=None):
+    """
+    Obtém os hrefs dos ativos digitais (hrefs locais) do XML lido de source
+    por iterparse, descartando cada elemento após processá-lo, de modo que a
+    árvore completa não é mantida em memória.
+
+    Caso output seja informado, escreve nele o XML otimizado (equivalente a
+    XMLTree.otimized: sem os espaços em branco entre elementos e com as
+    sequências de espaços reduzidas a um único espaço), com os hrefs dos
+    ativos digitais substituídos conforme hrefs. As declarações de
+    namespace redundantes (repetidas em elementos descendentes) não são
+    mantidas.
+
+    Params:
+    source: arquivo (file-like) com o XML
+    output: (Opcional) arquivo (file-like) para a escrita do XML
+    hrefs: (Opcional) dict com o novo href de cada href a ser substituído
+
+    Retorno:
+    Lista com os hrefs dos ativos digitais, na ordem do documento e sem
+    repetições
+
+    Erro:
+    lxml.etree.XMLSyntaxError: XML mal formado
+    """
+    hrefs = hrefs or {}
+    assets = {}
+    # elementos abertos: [elemento, nome qualificado, tag de abertura,
+    # tag de abertura já escrita]
+    stack = []
+
+    def write(value):
+        output.write(value.encode('utf-8'))
+
+    def open_element(entry):
+        if not entry[3]:
+            entry[3] = True
+            write(entry[2] + '>')
+            if entry[0].text:
+                write(_text(entry[0].text))
+
+    def write_siblings(siblings):
+        # os irmãos anteriores já foram escritos; falta escrever o texto
+        # após eles
+        for sibling in siblings:
+            if sibling.tail:
+                write(_text(sibling.tail))
+
+    def write_previous_siblings(node):
+        parent = node.getparent()
+        index = parent.index(node)
+        write_siblings(parent[:index])
+        del parent[:index]
+
+    events = parsers.iterparse(
+        source,
+        events=('start', 'end', 'comment', 'pi'),
+        remove_blank_text=True)
+    for event, node in events:
+        if event == 'start':
+            if stack:
+                href = node.get(XLINK_HREF)
+                if is_local_href(href):
+                    assets[href] = None
+                    if href in hrefs:
+                        node.set(XLINK_HREF, hrefs[href])
+            tag = start_tag = None
+            if output is not None:
+                parent_nsmap = {}
+                if stack:
+                    open_element(stack[-1])
+                    write_previous_siblings(node)
+                    parent_nsmap = stack[-1][0].nsmap
+                tag, start_tag = _start_tag(node, parent_nsmap)
+            stack.append([node, tag, start_tag, False])
+        elif event == 'end':
+            entry = stack.pop()
+            elem, tag, start_tag, opened = entry
+            if output is not None:
+                if opened or len(elem):
+                    open_element(entry)
+                    write_siblings(elem)
+                    write('</' + tag + '>')
+                elif elem.text:
+                    write('{}>{}</{}>'.format(
+                        start_tag, _text(elem.text), tag))
+                else:
+                    write(start_tag + '/>')
+            elem.clear(keep_tail=True)
+            if output is None:
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+        elif stack and output is not None:
+            # comentários e instruções de processamento fora do elemento
+            # raiz não fazem parte do XML otimizado
+            open_element(stack[-1])
+            write_previous_siblings(node)
+            if event == 'comment':
+                write('<!--' + SPACES.sub(' ', node.text or '') + '-->')
+            elif node.text:
+                write('<?{} {}?>'.format(
+                    node.target, SPACES.sub(' ', node.text)))
+            else:
+                write('<?{}?>'.format(node.target))
+    return list(assets)
+
+
+class StreamHRefNode:
+    """
+    href de ativo digital de um ArticleXMLStream, com a mesma interface de
+    HRefNode. A alteração do href é aplicada na próxima serialização do XML.
+    """
+
+    def __init__(self, href, xml_stream):
+        self.name = href
+        self._href = href
+        self.xml_stream = xml_stream
+
+    @property
+    def href(self):
+        return self._href
+
+    @href.setter
+    def href(self, value):
+        self._href = value
+        self.xml_stream.invalidate()
+
+    @property
+    def local_href(self):
+        if is_local_href(self.href):
+            return self.href
+
+
+class ArticleXMLStream:
+    """
+    Alternativa a ArticleXMLTree para XMLs grandes: os ativos digitais e o
+    conteúdo canônico são obtidos por leitura em partes do XML
+    (stream_article_xml), sem manter a árvore em memória. O XML é lido uma
+    vez na criação e a cada serialização após a alteração de hrefs.
+    """
+
+    def __init__(self, xml_content):
+        self.tree = None
+        self.xml_error = None
+        self._xml_content = xml_content
+        self._href_nodes = None
+        self._content = None
+        self._digest = None
+        output = BytesIO()
+        try:
+            hrefs = stream_article_xml(BytesIO(xml_content), output)
+        except etree.XMLSyntaxError:
+            self.xml_error = 'XML is not well formed\n'
+        else:
+            self._href_nodes = [StreamHRefNode(href, self) for href in hrefs]
+            self._content = output.getvalue()
+
+    @property
+    def content(self):
+        """
+        Conteúdo canônico do XML, com os hrefs alterados, memorizado até a
+        próxima alteração de href.
+        """
+        if self._content is None and self.xml_error is None:
+            output = BytesIO()
+            self.write(output)
+            self._content = output.getvalue()
+        return self._content
+
+    @property
+    def digest(self):
+        """
+        SHA-1 (hexadecimal) do conteúdo canônico do XML, ou None caso o XML
+        não seja bem formado.
+        """
+        if self._digest is None and self.content is not None:
+            self._digest = hashlib.sha1(self.content).hexdigest()
+        return self._digest
+
+    def invalidate(self):
+        self._content = None
+        self._digest = None
+
+    def write(self, output):
+        """
+        Escreve o conteúdo canônico do XML, com os hrefs alterados, em
+        output (file-like), sem obtê-lo inteiro em memória.
+        """
+        stream_article_xml(
+            BytesIO(self._xml_content),
+            output,
+            {
+                node.name: node.href
+                for node in self._href_nodes
+                if node.href != node.name
+            }
+        )
+
+    @property
+    def asset_nodes(self):
+        if self._href_nodes is not None:
+            return {node.href: node for node in self._href_nodes}
+
+    @property
+    def schema_version(self):
+        if self.xml_error is None:
+            events = parsers.iterparse(
+                BytesIO(self._xml_content), events=('start', ))
+            event, root = next(iter(events))
+            return get_schema_version(root)
+
+    def validate(self, validator):
+        """
+        Valida o XML com o validador. XML Schemas validam o XML durante a
+        leitura em partes, que é interrompida no primeiro erro; DTDs só
+        validam a árvore completa, que é obtida para isso.
+
+        Retorno:
+        Lista com as mensagens de erro, vazia caso o XML seja válido
+        """
+        source = BytesIO(self._xml_content)
+        if isinstance(validator, etree.XMLSchema):
+            events = parsers.iterparse(
+                source, events=('end', ), schema=validator)
+            try:
+                for event, elem in events:
+                    elem.clear(keep_tail=True)
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
+            except etree.XMLSyntaxError:
+                return get_errors(events.error_log)
+            return []
+        if validator.validate(parsers.parse(source)):
+            return []
+        return get_errors(validator.error_log)
+
+
+def get_article_xml_tree(xml_content, streaming_threshold=STREAMING_THRESHOLD):
+    """
+    Obtém ArticleXMLStream para XMLs maiores que streaming_threshold bytes
+    ou ArticleXMLTree para os demais. streaming_threshold None desativa a
+    leitura em partes.
+    """
+    if (streaming_threshold is not None and
+            len(xml_content) > streaming_threshold):
+        return ArticleXMLStream(xml_content)
+    return ArticleXMLTree(xml_content)
@@ -1,16 +1,37 @@
 # coding=utf-8
 
+from lxml import etree
+
+from .validation import (
+    get_errors,
+    get_schema_version,
+)
 from .xml_tree import (
     XMLTree,
+    namespaces,
 )
 
 
+# elementos com xlink:href abaixo da raiz do XML, compilado uma única vez
+HREF_NODES_XPATH = etree.XPath(
+    './/*[@xlink:href]', namespaces={'xlink': namespaces['xlink']})
+
+
+def is_local_href(href):
+    return href is not None and ('/' not in href or href.startswith('/'))
+
+
+def is_external_href(href):
+    return href is not None and '/' in href
+
+
 class HRefNode:
 
     _xpath = '{http://www.w3.org/1999/xlink}href'
 
-    def __init__(self, node):
+    def __init__(self, node, xml_tree=None):
         self.node = node
+        self.xml_tree = xml_tree
 
     @property
     def href(self):
@@ -19,33 +40,105 @@ class HRefNode:
     @href.setter
     def href(self, value):
         self.node.set(self._xpath, value)
+        # o conteúdo memorizado pela árvore e a classificação dos hrefs
+        # deixam de corresponder ao nó
+        if self.xml_tree is not None:
+            self.xml_tree.invalidate()
 
     @property
     def local_href(self):
-        if (self.href is not None and
-                ('/' not in self.href or self.href.startswith('/'))):
+        if is_local_href(self.href):
             return self.href
 
     @property
     def external_href(self):
-        if self.href is not None and '/' in self.href:
+        if is_external_href(self.href):
             return self.href
 
 
 class ArticleXMLTree(XMLTree):
 
+    def __init__(self, xml_content):
+        # nós com xlink:href (HRefNode), obtidos uma única vez por árvore
+        self._href_nodes = None
+        self._href_nodes_tree = None
+        # hrefs locais (ativos digitais) e externos, classificados em uma
+        # única passagem pelos nós e descartados a cada alteração de href
+        self._local_href_nodes = None
+        self._external_href_nodes = None
+        super().__init__(xml_content)
+
+    def invalidate(self):
+        super().invalidate()
+        self._local_href_nodes = None
+        self._external_href_nodes = None
+
+    @property
+    def href_nodes(self):
+        """
+        Nós com xlink:href (HRefNode), na ordem do documento. A lista é
+        obtida uma única vez para cada árvore analisada.
+        """
+        if self.tree is None:
+            return None
+        if self._href_nodes_tree is not self.tree:
+            self._href_nodes = [
+                HRefNode(node, self)
+                for node in HREF_NODES_XPATH(self.tree.getroot())
+            ]
+            self._href_nodes_tree = self.tree
+        return self._href_nodes
+
+    def _classify_href_nodes(self):
+        local = {}
+        external = []
+        for href_node in self.href_nodes:
+            href = href_node.href
+            if is_local_href(href):
+                local[href] = href_node
+            if is_external_href(href):
+                external.append(href_node)
+        self._local_href_nodes = local
+        self._external_href_nodes = external
+
     @property
     def asset_nodes(self):
+        """
+        Nós dos ativos digitais (href local), indexados pelo href. O índice
+        é mantido até que um href seja alterado e não deve ser modificado.
+        """
+        if self.tree is not None:
+            if self._local_href_nodes is None:
+                self._classify_href_nodes()
+            return self._local_href_nodes
+
+    @property
+    def external_href_nodes(self):
+        """
+        Nós com href externo, na ordem do documento.
+        """
         if self.tree is not None:
-            items = {}
-            for node in self.nodes_which_has_xlink_href:
-                href_node = HRefNode(node)
-                if href_node.local_href is not None:
-                    items[href_node.local_href] = href_node
-            return items
+            if self._external_href_nodes is None:
+                self._classify_href_nodes()
+            return self._external_href_nodes
 
     @property
     def nodes_which_has_xlink_href(self):
         if self.tree is not None:
-            return self.tree.findall(
-                './/*[@{http://www.w3.org/1999/xlink}href]')
+            return [href_node.node for href_node in self.href_nodes]
+
+    @property
+    def schema_version(self):
+        if self.tree is not None:
+            return get_schema_version(self.tree.getroot())
+
+    def validate(self, validator):
+        """
+        Valida a árvore com o validador (etree.XMLSchema ou etree.DTD).
+
+        Retorno:
+        Lista com as mensagens de erro, vazia caso o XML seja válido
+        """
+        if validator.validate(self.tree):
+            return []
+        return get_errors(validator.error_log)
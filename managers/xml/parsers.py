@@ -0,0 +1,81 @@
+# coding=utf-8
+
+import threading
+
+from lxml import etree
+
+
+# opções de todos os parsers de XML: sem acesso à rede, sem carregar DTDs
+# externos e substituindo pelo seu conteúdo apenas as entidades declaradas
+# no próprio XML (internal subset), que são limitadas pelo fator de
+# amplificação do libxml2; referências a entidades externas (SYSTEM) ou não
+# declaradas tornam o XML mal formado, o que evita a leitura de arquivos
+# locais. huge_tree remove os limites de profundidade e de tamanho de nós
+# de texto do libxml2, que rejeitam artigos grandes
+PARSER_OPTIONS = {
+    'no_network': True,
+    'load_dtd': False,
+    'resolve_entities': 'internal',
+    'huge_tree': True,
+}
+
+# resolve_entities='internal' existe a partir do lxml 5.0 (nas versões
+# anteriores, o valor é apenas verdadeiro e as entidades externas são
+# resolvidas), e o fator de amplificação, que também vale com huge_tree, a
+# partir do libxml2 2.11
+if etree.LXML_VERSION < (5, 0) or etree.LIBXML_VERSION < (2, 11):
+    raise ImportError(
+        'lxml >= 5.0 with libxml2 >= 2.11 is required to parse XML safely')
+
+_local = threading.local()
+
+
+def get_parser(remove_blank_text=False):
+    """
+    Obtém o XMLParser da thread corrente, criado na primeira chamada da
+    thread e reutilizado nas seguintes. Parsers do lxml não podem ser usados
+    por mais de uma thread ao mesmo tempo.
+
+    Params:
+    remove_blank_text: True para o parser que remove os espaços em branco
+        entre elementos
+
+    Retorno:
+    lxml.etree.XMLParser
+    """
+    parsers = getattr(_local, 'parsers', None)
+    if parsers is None:
+        parsers = _local.parsers = {}
+    parser = parsers.get(remove_blank_text)
+    if parser is None:
+        parser = parsers[remove_blank_text] = etree.XMLParser(
+            remove_blank_text=remove_blank_text, **PARSER_OPTIONS)
+    return parser
+
+
+def parse(source, remove_blank_text=False):
+    """
+    Analisa o XML lido de source (file-like) com o parser da thread
+    corrente.
+
+    Retorno:
+    lxml.etree._ElementTree
+
+    Erro:
+    lxml.etree.XMLSyntaxError: XML mal formado
+    """
+    return etree.parse(source, get_parser(remove_blank_text))
+
+
+def iterparse(source, events, remove_blank_text=False, schema=None):
+    """
+    etree.iterparse com as mesmas opções dos parsers de get_parser. O
+    iterparse cria o seu próprio parser, que não pode ser reutilizado.
+    schema (etree.XMLSchema) valida o XML durante a leitura.
+    """
+    return etree.iterparse(
+        source,
+        events=events,
+        remove_blank_text=remove_blank_text,
+        schema=schema,
+        **PARSER_OPTIONS)
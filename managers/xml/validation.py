@@ -0,0 +1,96 @@
+# coding=utf-8
+
+import os
+import re
+import threading
+
+from lxml import etree
+
+from . import parsers
+
+
+# diretório padrão dos schemas, nomeados pela versão: <versão>.xsd ou
+# <versão>.dtd (ex.: sps-1.2.xsd)
+SCHEMAS_DIR = os.path.join(os.path.dirname(__file__), 'schemas')
+
+# a versão vem do XML recebido e compõe o nome do arquivo do schema
+VERSION = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._-]*$')
+
+# validadores compilados, por (diretório, versão), com o lock que serializa
+# o seu uso: o log de erros do validador é compartilhado entre as chamadas
+_validators = {}
+_validators_lock = threading.Lock()
+
+
+def get_schema_version(root):
+    """
+    Obtém a versão do schema do XML a partir do elemento raiz: a versão do
+    SciELO PS (@specific-use) ou, na sua ausência, a do JATS
+    (@dtd-version).
+    """
+    return root.get('specific-use') or root.get('dtd-version')
+
+
+def _compile(schemas_dir, version):
+    xsd_path = os.path.join(schemas_dir, version + '.xsd')
+    if os.path.isfile(xsd_path):
+        return etree.XMLSchema(parsers.parse(xsd_path))
+    dtd_path = os.path.join(schemas_dir, version + '.dtd')
+    if os.path.isfile(dtd_path):
+        return etree.DTD(dtd_path)
+
+
+def get_validator(version, schemas_dir=SCHEMAS_DIR):
+    """
+    Obtém o validador (etree.XMLSchema ou etree.DTD) da versão informada,
+    compilado na primeira chamada do processo e reutilizado nas seguintes.
+
+    Params:
+    version: versão do schema (get_schema_version)
+    schemas_dir: diretório dos schemas
+
+    Retorno:
+    Tupla com o validador e o lock que deve ser obtido para usá-lo, ou None
+    caso não exista schema para a versão. A ausência não é memorizada, de
+    modo que um schema acrescentado depois ao diretório é encontrado.
+    """
+    if version is None or not VERSION.match(version):
+        return None
+    key = (schemas_dir, version)
+    with _validators_lock:
+        if key not in _validators:
+            validator = _compile(schemas_dir, version)
+            if validator is None:
+                return None
+            _validators[key] = (validator, threading.Lock())
+        return _validators[key]
+
+
+def get_errors(error_log):
+    return [
+        'line {}: {}'.format(error.line, error.message)
+        for error in error_log
+    ]
+
+
+def validate_article_xml(xml_tree, schemas_dir=SCHEMAS_DIR):
+    """
+    Valida o XML do Artigo (ArticleXMLTree ou ArticleXMLStream) com o schema
+    da sua versão.
+
+    Params:
+    xml_tree: ArticleXMLTree ou ArticleXMLStream
+    schemas_dir: diretório dos schemas
+
+    Retorno:
+    Lista com as mensagens de erro, vazia caso o XML seja válido
+    """
+    if xml_tree.xml_error is not None:
+        return [xml_tree.xml_error.strip()]
+    version = xml_tree.schema_version
+    cached = get_validator(version, schemas_dir)
+    if cached is None:
+        return ['No schema available for version {}'.format(version)]
+    validator, lock = cached
+    with lock:
+        return xml_tree.validate(validator)
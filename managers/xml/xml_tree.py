@@ -1,11 +1,16 @@
 # coding=utf-8
 
+import hashlib
+import re
+
 from lxml import etree
 from io import (
     BytesIO,
     StringIO,
 )
 
+from . import parsers
+
 
 namespaces = {}
 namespaces['mml'] = 'http://www.w3.org/1998/Math/MathML'
@@ -15,34 +20,66 @@ namespaces['xml'] = 'http://www.w3.org/XML/1998/namespace'
 for namespace_id, namespace_link in namespaces.items():
     etree.register_namespace(namespace_id, namespace_link)
 
+# sequências de dois ou mais espaços. O byte 0x20 não ocorre em caracteres
+# multibyte UTF-8, de modo que a substituição pode ser feita nos bytes
+SPACES = re.compile(b'  +')
+
 
 class XMLTree:
 
     def __init__(self, xml_content):
         self.tree = None
         self.xml_error = None
+        self._content = None
+        self._digest = None
         self.content = xml_content
 
     @property
     def content(self):
-        return self.otimized
+        """
+        Conteúdo canônico (otimized) do XML, calculado no primeiro acesso e
+        memorizado até que a árvore seja alterada (ver :meth:`invalidate`).
+        """
+        if self._content is None:
+            self._content = self.otimized
+        return self._content
 
     @content.setter
     def content(self, xml_content):
         bytes_io = BytesIO(xml_content)
         self.tree, self.xml_error = self.parse(bytes_io)
+        self.invalidate()
+
+    @property
+    def digest(self):
+        """
+        SHA-1 (hexadecimal) do conteúdo canônico do XML, ou None caso o XML
+        não seja bem formado.
+        """
+        if self._digest is None and self.content is not None:
+            self._digest = hashlib.sha1(self.content).hexdigest()
+        return self._digest
+
+    def invalidate(self):
+        """
+        Descarta o conteúdo canônico e o digest memorizados. Deve ser chamado
+        a cada alteração da árvore, como faz
+        :class:`managers.xml.article_xml_tree.HRefNode`.
+        """
+        self._content = None
+        self._digest = None
 
     def parse(self, bytes_io):
         message = None
         try:
-            r = etree.parse(bytes_io)
+            r = parsers.parse(bytes_io)
         except Exception as e:
             message = 'XML is not well formed\n'
             r = None
         return (r, message)
 
     def compare(self, xml_content):
-        return self.content == XMLTree(xml_content).content
+        return self.digest == XMLTree(xml_content).digest
 
     @property
     def tostring(self):
@@ -58,12 +95,19 @@ class XMLTree:
 
     @property
     def otimized(self):
-        parser = etree.XMLParser(remove_blank_text=True)
-        content = self.tostring
-        if content is not None:
-            root = etree.XML(content.decode('utf-8'), parser)
-            b = etree.tostring(root, encoding='utf-8')
-            s = b.decode('utf-8')
-            while ' '*2 in s:
-                s = s.replace(' '*2, ' ')
-            return s.encode('utf-8')
+        """
+        XML sem os espaços em branco entre elementos (remove_blank_text do
+        libxml2, que distingue os que não são parte do texto) e com as
+        sequências de espaços reduzidas a um único espaço.
+
+        A remoção é feita pelo parser, em uma única análise dos bytes do XML
+        serializado, e a redução dos espaços em uma única passagem pelos
+        bytes, sem conversões para str. As entidades declaradas no XML já
+        foram substituídas pelo seu conteúdo na análise, de modo que o
+        resultado, sem o DOCTYPE, é bem formado.
+        """
+        if self.tree is not None:
+            content = etree.tostring(self.tree.getroot(), encoding='utf-8')
+            root = parsers.parse(
+                BytesIO(content), remove_blank_text=True).getroot()
+            return SPACES.sub(b' ', etree.tostring(root, encoding='utf-8'))
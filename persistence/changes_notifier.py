@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+
+from prometheus_client import Gauge
+
+
+LOGGER = logging.getLogger(__name__)
+
+CHANGES_FEED_WAITING = Gauge(
+    'changes_feed_waiting',
+    'Number of changes feed consumers waiting for new change records')
+
+
+class ChangesNotifier:
+    """
+    ChangesNotifier avisa os consumidores do feed de mudanças, em espera no
+    processo, que novos registros de mudança foram persistidos.
+
+    O aviso é dado pelo ChangesService, ao registrar uma mudança, e, caso seja
+    informado o DBManager de mudanças, por uma thread que acompanha o feed
+    _changes do CouchDB, de modo que mudanças registradas por outros processos
+    também acordem os consumidores.
+
+    Cada aviso incrementa ``version``: o consumidor obtém ``version`` antes de
+    consultar as mudanças e aguarda com ``wait`` apenas se não houver novas
+    mudanças, sem risco de perder um aviso dado entre a consulta e a espera.
+
+    Cada consumidor em espera ocupa uma thread do servidor durante toda a
+    espera. ``max_waiters`` limita a quantidade de consumidores em espera
+    simultânea no processo (acquire_waiter), e deve ser menor que a
+    quantidade de threads do servidor por processo.
+
+    changes_db_manager:
+        (Opcional) Instância do CouchDBManager da base de mudanças
+    max_waiters:
+        (Opcional) Quantidade máxima de consumidores em espera simultânea;
+        None para não limitar
+    poll_timeout:
+        Tempo, em segundos, de cada espera no feed _changes do CouchDB, que
+        deve ser menor que o timeout das conexões HTTP com o servidor
+    retry_delay:
+        Tempo, em segundos, de espera após uma falha no feed _changes
+    """
+
+    def __init__(self, changes_db_manager=None, max_waiters=None,
+                 poll_timeout=25, retry_delay=5):
+        self.changes_db_manager = changes_db_manager
+        self.max_waiters = max_waiters
+        self._waiters = 0
+        self.poll_timeout = poll_timeout
+        self.retry_delay = retry_delay
+        self.version = 0
+        self._condition = threading.Condition()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def notify(self):
+        """
+        Avisa os consumidores em espera que há novos registros de mudança.
+        """
+        with self._condition:
+            self.version += 1
+            self._condition.notify_all()
+
+    def acquire_waiter(self):
+        """
+        Reserva a vaga de um consumidor em espera, que deve ser liberada
+        com release_waiter ao fim da espera.
+
+        Retorno:
+        True, caso haja vaga, ou False, caso ``max_waiters`` consumidores já
+        estejam em espera
+        """
+        with self._lock:
+            if self.max_waiters is not None and \
+                    self._waiters >= self.max_waiters:
+                return False
+            self._waiters += 1
+            return True
+
+    def release_waiter(self):
+        """
+        Libera a vaga reservada por acquire_waiter.
+        """
+        with self._lock:
+            self._waiters -= 1
+
+    def wait(self, version, timeout):
+        """
+        Aguarda um aviso posterior a ``version``.
+
+        Params:
+        version: valor de ``version`` obtido antes da consulta às mudanças
+        timeout: tempo máximo de espera, em segundos
+
+        Retorno:
+        True, caso tenha havido aviso, ou False, caso o tempo tenha esgotado
+        """
+        self._ensure_started()
+        CHANGES_FEED_WAITING.inc()
+        try:
+            with self._condition:
+                return self._condition.wait_for(
+                    lambda: self.version != version, timeout)
+        finally:
+            CHANGES_FEED_WAITING.dec()
+
+    def _ensure_started(self):
+        if self.changes_db_manager is None:
+            return
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(
+                    target=self._follow,
+                    name='ChangesNotifier',
+                    daemon=True
+                )
+                self._thread.start()
+
+    def _follow(self):
+        since = 'now'
+        while True:
+            try:
+                since, count = self.changes_db_manager.wait_changes(
+                    since, self.poll_timeout)
+            except Exception:
+                LOGGER.exception('Could not follow the changes feed')
+                time.sleep(self.retry_delay)
+                continue
+            if count:
+                self.notify()
@@ -0,0 +1,175 @@
+import atexit
+import logging
+import os
+import threading
+import time
+
+from prometheus_client import Gauge, Summary
+
+
+LOGGER = logging.getLogger(__name__)
+
+CHANGES_WRITER_QUEUE_DEPTH = Gauge(
+    'changes_writer_queue_depth',
+    'Number of change records waiting to be written')
+CHANGES_WRITER_FLUSH_TIME = Summary(
+    'changes_writer_flush_seconds',
+    'Time spent writing a batch of change records')
+
+# tempo máximo, em segundos, de espera pelo encerramento da thread de
+# escrita; os registros pendentes são persistidos em seguida
+CLOSE_TIMEOUT = 10
+
+
+class ChangesWriter:
+    """
+    ChangesWriter acumula registros de mudança em uma fila limitada, em
+    memória, e os persiste em lote (create_many) em uma thread própria,
+    quando a quantidade de registros acumulados atinge ``batch_size`` ou
+    quando ``flush_interval`` segundos se passam desde a última escrita.
+
+    Os registros são persistidos na ordem em que foram informados: caso a
+    fila esteja cheia, ou após o encerramento do ChangesWriter, a própria
+    thread que informou o registro persiste a fila e, em seguida, o
+    registro. Os registros pendentes são persistidos no encerramento do
+    processo.
+
+    changes_db_manager:
+        Instância do DBManager para persistir registro de mudanças
+    batch_size:
+        Quantidade máxima de registros de mudança persistidos por lote
+    flush_interval:
+        Tempo máximo, em segundos, que um registro aguarda na fila
+    queue_size:
+        Quantidade máxima de registros de mudança na fila
+    changes_notifier:
+        (Opcional) Instância do ChangesNotifier para avisar os consumidores
+        do feed de mudanças após a escrita de cada lote, quando os registros
+        já podem ser obtidos da base de dados
+    """
+
+    def __init__(self, changes_db_manager, batch_size=100, flush_interval=1.0,
+                 queue_size=1000, changes_notifier=None):
+        self.changes_db_manager = changes_db_manager
+        self.changes_notifier = changes_notifier
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue_size = queue_size
+        self._queue = []
+        # protege a fila; as escritas são serializadas por _write_lock, de
+        # modo que um lote retirado da fila é persistido antes do seguinte
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+
+    def write(self, change_record):
+        """
+        Enfileira o registro de mudança para ser persistido em lote.
+
+        Params:
+        change_record: registro de mudança
+        """
+        self._ensure_started()
+        with self._condition:
+            self._queue.append(change_record)
+            queue_depth = len(self._queue)
+            if queue_depth >= self.batch_size:
+                self._condition.notify()
+        CHANGES_WRITER_QUEUE_DEPTH.set(queue_depth)
+        if self._closed or queue_depth > self.queue_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Persiste todos os registros de mudança enfileirados.
+        """
+        with self._write_lock:
+            with self._condition:
+                batch, self._queue = self._queue, []
+            CHANGES_WRITER_QUEUE_DEPTH.set(0)
+            for start in range(0, len(batch), self.batch_size):
+                self._write_batch(batch[start:start + self.batch_size])
+        if batch and self.changes_notifier is not None:
+            self.changes_notifier.notify()
+
+    def close(self):
+        """
+        Encerra a thread de escrita e persiste os registros pendentes. Os
+        registros informados após o encerramento são persistidos
+        imediatamente.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        thread = self._thread
+        if thread is not None and self._pid == os.getpid():
+            thread.join(CLOSE_TIMEOUT)
+            if thread.is_alive():
+                LOGGER.warning('ChangesWriter thread did not stop in %s s',
+                               CLOSE_TIMEOUT)
+        self.flush()
+
+    def _ensure_started(self):
+        # a thread é iniciada na primeira escrita, e novamente em cada
+        # processo filho (ex.: workers do gunicorn com preload), que não
+        # persiste os registros enfileirados pelo processo pai
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    self._queue = []
+                    self._condition = threading.Condition()
+                    self._write_lock = threading.Lock()
+                self._pid = os.getpid()
+                self._closed = False
+                self._thread = threading.Thread(
+                    target=self._run,
+                    name='ChangesWriter',
+                    daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            deadline = time.monotonic() + self.flush_interval
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: (self._closed or
+                             len(self._queue) >= self.batch_size),
+                    max(deadline - time.monotonic(), 0))
+                closed = self._closed
+            self.flush()
+            if closed:
+                break
+
+    @CHANGES_WRITER_FLUSH_TIME.time()
+    def _write_batch(self, batch):
+        # registros não persistidos no lote são persistidos individualmente
+        try:
+            results = self.changes_db_manager.create_many(
+                [
+                    (change_record['record_id'], change_record)
+                    for change_record in batch
+                ]
+            )
+        except Exception:
+            LOGGER.exception('Could not write %d change records', len(batch))
+            failed = {change_record['record_id'] for change_record in batch}
+        else:
+            failed = {record_id for record_id, error in results if error}
+        for change_record in batch:
+            if change_record['record_id'] in failed:
+                self._write_one(change_record)
+
+    def _write_one(self, change_record):
+        try:
+            self.changes_db_manager.create(
+                change_record['record_id'], change_record)
+        except Exception:
+            LOGGER.exception('Could not write change record %s',
+                             change_record['record_id'])
@@ -1,5 +1,10 @@
 import io
 import abc
+import base64
+import bisect
+import functools
+import hashlib
+import heapq
 import operator
 from enum import Enum
 from itertools import islice
@@ -22,17 +27,148 @@ class DBFailed(Exception):
 
 
 class QueryOperator(Enum):
+    EQUAL = 'eq'
     GREATER_THAN = 'gt'
     GREATER_THAN_EQUAL = 'ge'
     LESS_THAN = 'lt'
     LESS_THAN_EQUAL = 'le'
     NOT_EQUAL = 'ne'
+    IN = 'in'
+    AND = 'and'
+    OR = 'or'
+
+
+_MANGO_OPERATORS = {
+    QueryOperator.EQUAL: '$eq',
+    QueryOperator.GREATER_THAN: '$gt',
+    QueryOperator.GREATER_THAN_EQUAL: '$gte',
+    QueryOperator.LESS_THAN: '$lt',
+    QueryOperator.LESS_THAN_EQUAL: '$lte',
+    QueryOperator.NOT_EQUAL: '$ne',
+    QueryOperator.IN: '$in',
+}
+
+
+def translate_filter(filter):
+    """
+    Traduz filtro de busca para selector Mango do CouchDB.
+
+    Params:
+    filter: dict cujas chaves são nomes de campo, com valor para igualdade ou
+        lista de tuplas (QueryOperator, valor), em que todos os critérios
+        devem ser atendidos, ou QueryOperator.AND/QueryOperator.OR, com lista
+        de filtros.
+        Ex.: {'type': 'ART',
+              'id': [(QueryOperator.GREATER_THAN, 10),
+                     (QueryOperator.LESS_THAN_EQUAL, 20)],
+              QueryOperator.OR: [
+                  {'lang': [(QueryOperator.IN, ['en', 'es'])]},
+                  {'lang': [(QueryOperator.EQUAL, None)]}]}
+
+    Retorno:
+    selector Mango
+    """
+    selector = {}
+    conditions = []
+    for key, criteria in filter.items():
+        if key in (QueryOperator.AND, QueryOperator.OR):
+            subselectors = [translate_filter(subfilter)
+                            for subfilter in criteria]
+            if key is QueryOperator.AND:
+                conditions.extend(subselectors)
+            else:
+                selector['$or'] = subselectors
+        elif isinstance(criteria, list):
+            field_selector = {}
+            for field_operator, filter_value in criteria:
+                mango_operator = _MANGO_OPERATORS[field_operator]
+                if mango_operator in field_selector:
+                    # o mesmo operador mais de uma vez no mesmo campo
+                    conditions.append({key: {mango_operator: filter_value}})
+                else:
+                    field_selector[mango_operator] = filter_value
+            selector[key] = field_selector
+        else:
+            selector[key] = criteria
+    if conditions:
+        selector['$and'] = conditions
+    return selector
+
+
+def match_filter(doc, filter):
+    """
+    Verifica se doc atende os critérios de seleção de filter, com a mesma
+    semântica do selector Mango obtido por translate_filter: os valores são
+    comparados segundo a ordem de tipos do CouchDB, na qual null é o menor
+    valor, e campos ausentes não atendem a nenhum critério.
+
+    Params:
+    doc: registro de documento da base de dados
+    filter: filtro de busca, no formato de translate_filter
+
+    Retorno:
+    True se documento atende a todos os critérios do filtro. Caso contrário,
+    False.
+    """
+    for key, criteria in filter.items():
+        if key is QueryOperator.AND:
+            if not all(match_filter(doc, subfilter) for subfilter in criteria):
+                return False
+        elif key is QueryOperator.OR:
+            if not any(match_filter(doc, subfilter) for subfilter in criteria):
+                return False
+        elif key not in doc:
+            return False
+        elif isinstance(criteria, list):
+            if not all(_match_criterion(doc[key], field_operator, filter_value)
+                       for field_operator, filter_value in criteria):
+                return False
+        elif _collation_key(doc[key]) != _collation_key(criteria):
+            return False
+    return True
+
+
+def _match_criterion(value, field_operator, filter_value):
+    value = _collation_key(value)
+    if field_operator is QueryOperator.IN:
+        return any(value == _collation_key(item) for item in filter_value)
+    return getattr(operator, field_operator.value)(
+        value, _collation_key(filter_value))
+
+
+# Índices declarados para cada base de dados, provisionados por
+# create_indexes na inicialização da aplicação. Cada índice é uma lista de
+# campos com sua ordenação, no formato de sort de find.
+DATABASE_INDEXES = {
+    'articles': [
+        [{'document_type': 'asc'}, {'created_date': 'asc'}],
+    ],
+    'changes': [
+        [{'change_id': 'asc'}],
+    ],
+}
+
+
+def _index_fields(fields):
+    return tuple(
+        field_name
+        for sorter in fields
+        for field_name in sorter.keys()
+    )
 
 
 class BaseDBManager(metaclass=abc.ABCMeta):
 
     _attachments_properties_key = 'attachments_properties'
 
+    @abc.abstractmethod
+    def create_database(self) -> None:
+        return NotImplemented
+
+    @abc.abstractmethod
+    def create_indexes(self) -> None:
+        return NotImplemented
+
     @abc.abstractmethod
     def drop_database(self) -> None:
         return NotImplemented
@@ -53,10 +189,35 @@ class BaseDBManager(metaclass=abc.ABCMeta):
     def delete(self, id) -> None:
         return NotImplemented
 
+    @abc.abstractmethod
+    def create_many(self, documents) -> list:
+        return NotImplemented
+
+    @abc.abstractmethod
+    def read_many(self, ids) -> list:
+        return NotImplemented
+
+    @abc.abstractmethod
+    def update_many(self, documents) -> list:
+        return NotImplemented
+
     @abc.abstractmethod
     def find(self, filter, fields, sort, limit=0) -> list:
         return NotImplemented
 
+    @abc.abstractmethod
+    def iter_find(self, filter, fields, sort, limit=0, page_size=1000):
+        return NotImplemented
+
+    @abc.abstractmethod
+    def create_with_attachments(self, id, document, attachments) -> None:
+        return NotImplemented
+
+    @abc.abstractmethod
+    def update_with_attachments(self, id, document, attachments,
+                                removed=()) -> None:
+        return NotImplemented
+
     @abc.abstractmethod
     def put_attachment(self, id, file_id, content, content_properties) -> None:
         return NotImplemented
@@ -65,6 +226,18 @@ class BaseDBManager(metaclass=abc.ABCMeta):
     def get_attachment(self, id, file_id) -> io.IOBase:
         return NotImplemented
 
+    @abc.abstractmethod
+    def head_attachment(self, id, file_id) -> dict:
+        return NotImplemented
+
+    @abc.abstractmethod
+    def read_version(self, id) -> dict:
+        return NotImplemented
+
+    @abc.abstractmethod
+    def open_attachment(self, id, file_id, byte_range=None) -> tuple:
+        return NotImplemented
+
     @abc.abstractmethod
     def list_attachments(self, id) -> list:
         return NotImplemented
@@ -98,6 +271,131 @@ class BaseDBManager(metaclass=abc.ABCMeta):
         return doc.get(self._attachments_properties_key, {}).get(file_id)
 
 
+class _HashIndex:
+    """
+    Índice de igualdade de um campo dos registros de documento: associa cada
+    valor do campo aos IDs dos documentos que o possuem.
+    """
+
+    operators = (QueryOperator.EQUAL, QueryOperator.IN)
+
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self._ids = {}
+
+    def _key(self, value):
+        key = _collation_key(value)
+        hash(key)
+        return key
+
+    def add(self, id, doc):
+        if self.field_name not in doc:
+            return
+        value = doc[self.field_name]
+        try:
+            self._ids.setdefault(self._key(value), {})[id] = None
+        except TypeError:
+            # valores não hashable (listas, dicts) não são indexados
+            pass
+
+    def remove(self, id, doc):
+        if self.field_name not in doc:
+            return
+        value = doc[self.field_name]
+        try:
+            key = self._key(value)
+        except TypeError:
+            return
+        ids = self._ids.get(key)
+        if ids is not None:
+            ids.pop(id, None)
+            if not ids:
+                del self._ids[key]
+
+    def clear(self):
+        self._ids = {}
+
+    def lookup(self, field_operator, value, reverse=False):
+        values = value if field_operator is QueryOperator.IN else [value]
+        ids = {}
+        for value in values:
+            ids.update(self._ids.get(self._key(value), {}))
+        return iter(list(ids))
+
+
+class _SortedIndex:
+    """
+    Índice ordenado de um campo dos registros de documento: mantém os pares
+    (valor, ID) ordenados segundo a ordem de tipos do CouchDB, de modo que a
+    seleção por operadores de comparação seja feita por busca binária.
+    Documentos sem o campo não são indexados.
+    """
+
+    operators = (
+        QueryOperator.EQUAL,
+        QueryOperator.IN,
+        QueryOperator.GREATER_THAN,
+        QueryOperator.GREATER_THAN_EQUAL,
+        QueryOperator.LESS_THAN,
+        QueryOperator.LESS_THAN_EQUAL,
+    )
+
+    def __init__(self, field_name):
+        self.field_name = field_name
+        self.clear()
+
+    def add(self, id, doc):
+        if self.field_name not in doc:
+            return
+        value = doc[self.field_name]
+        value = _collation_key(value)
+        position = bisect.bisect_left(self._entries, (value, id))
+        self._entries.insert(position, (value, id))
+        self._values.insert(position, value)
+
+    def remove(self, id, doc):
+        if self.field_name not in doc:
+            return
+        value = doc[self.field_name]
+        value = _collation_key(value)
+        position = bisect.bisect_left(self._entries, (value, id))
+        if position < len(self._entries) and \
+                self._entries[position] == (value, id):
+            del self._entries[position]
+            del self._values[position]
+
+    def clear(self):
+        self._entries = []
+        self._values = []
+
+    def lookup(self, field_operator, value, reverse=False):
+        if field_operator is QueryOperator.IN:
+            values = sorted({_collation_key(item): item
+                             for item in value}.items(),
+                            reverse=reverse)
+            return (
+                id
+                for __, item in values
+                for id in self.lookup(QueryOperator.EQUAL, item, reverse)
+            )
+        value = _collation_key(value)
+        start, stop = 0, len(self._values)
+        if field_operator in (QueryOperator.EQUAL,
+                              QueryOperator.GREATER_THAN_EQUAL):
+            start = bisect.bisect_left(self._values, value)
+        elif field_operator is QueryOperator.GREATER_THAN:
+            start = bisect.bisect_right(self._values, value)
+        if field_operator in (QueryOperator.EQUAL,
+                              QueryOperator.LESS_THAN_EQUAL):
+            stop = bisect.bisect_right(self._values, value)
+        elif field_operator is QueryOperator.LESS_THAN:
+            stop = bisect.bisect_left(self._values, value)
+        positions = range(start, stop)
+        if reverse:
+            positions = reversed(positions)
+        return (self._entries[position][1] for position in positions)
+
+
 class InMemoryDBManager(BaseDBManager):
 
     def __init__(self, **kwargs):
@@ -105,6 +403,7 @@ class InMemoryDBManager(BaseDBManager):
         self._attachments_key = 'attachments'
         self._attachments_properties_key = 'attachments_properties'
         self._database = {}
+        self._indexes = {}
 
     @property
     def database(self):
@@ -113,12 +412,54 @@ class InMemoryDBManager(BaseDBManager):
             self._database[self._database_name] = {}
         return self._database[self._database_name]
 
+    def create_database(self):
+        self.database
+
     def drop_database(self):
         self._database = {}
+        for index in self._indexes.values():
+            index.clear()
+
+    def create_indexes(self):
+        """
+        Cria os índices declarados em DATABASE_INDEXES para a base de dados,
+        como índices ordenados pelo primeiro campo de cada índice.
+        """
+        for fields in DATABASE_INDEXES.get(self._database_name, []):
+            self.create_index(_index_fields(fields)[0], ordered=True)
+
+    def create_index(self, field_name, ordered=False):
+        """
+        Cria índice de um campo dos registros de documento, usado por find
+        para selecionar os documentos sem percorrer toda a base de dados.
+        O índice é mantido atualizado por create, update e delete.
+
+        Params:
+        field_name: nome do campo a ser indexado
+        ordered: False para índice de igualdade (QueryOperator.EQUAL) ou True
+            para índice ordenado, que atende também aos operadores de
+            comparação e à ordenação pelo campo
+        """
+        index_class = _SortedIndex if ordered else _HashIndex
+        index = index_class(field_name)
+        for id, doc in self.database.items():
+            index.add(id, doc)
+        self._indexes[field_name] = index
+
+    def _add_to_indexes(self, id, doc):
+        for index in self._indexes.values():
+            index.add(id, doc)
+
+    def _remove_from_indexes(self, id, doc):
+        for index in self._indexes.values():
+            index.remove(id, doc)
 
     def create(self, id, document):
         document['revision'] = 1
+        if id in self.database:
+            self._remove_from_indexes(id, self.database[id])
         self.database.update({id: document})
+        self._add_to_indexes(id, document)
 
     def read(self, id):
         doc = self.database.get(id)
@@ -132,21 +473,87 @@ class InMemoryDBManager(BaseDBManager):
         if _document.get('revision') != document.get('document_rev'):
             raise UpdateFailure(
                 'You are trying to update a record which data is out of date')
+        self._remove_from_indexes(id, _document)
         _document.update(document)
         _document['revision'] += 1
         self.database.update({id: _document})
+        self._add_to_indexes(id, _document)
 
     def delete(self, id):
-        self.read(id)
+        doc = self.read(id)
+        self._remove_from_indexes(id, doc)
         del self.database[id]
 
+    def create_many(self, documents):
+        """
+        Persiste registros de documentos em lote.
+
+        Params:
+        documents: lista de tuplas (id, documento)
+
+        Retorno:
+        Lista de tuplas (id, erro), na ordem informada, onde erro é None
+        em caso de sucesso ou UpdateFailure caso o id já exista
+        """
+        results = []
+        for id, document in documents:
+            if id in self.database:
+                results.append(
+                    (id, UpdateFailure('Document {} already exists'.format(
+                        id)))
+                )
+                continue
+            self.create(id, document)
+            results.append((id, None))
+        return results
+
+    def read_many(self, ids):
+        """
+        Obtém registros de documentos em lote.
+
+        Params:
+        ids: lista de ids de documentos
+
+        Retorno:
+        Lista de registros de documentos, na ordem informada, com None para
+        os documentos não encontrados
+        """
+        results = []
+        for id in ids:
+            try:
+                results.append(self.read(id))
+            except DocumentNotFound:
+                results.append(None)
+        return results
+
+    def update_many(self, documents):
+        """
+        Atualiza registros de documentos em lote.
+
+        Params:
+        documents: lista de tuplas (id, documento)
+
+        Retorno:
+        Lista de tuplas (id, erro), na ordem informada, onde erro é None
+        em caso de sucesso, DocumentNotFound ou UpdateFailure
+        """
+        results = []
+        for id, document in documents:
+            try:
+                self.update(id, document)
+            except (DocumentNotFound, UpdateFailure) as e:
+                results.append((id, e))
+            else:
+                results.append((id, None))
+        return results
+
     def find(self, filter, fields, sort, limit=0):
         """
         Busca registros de documento por criterios de selecao na base de dados.
 
         Params:
         filter: criterio para selecionar campo com determinados valores ou
-            vazio para todos
+            vazio para todos, no formato de translate_filter
             Ex.: {'type': 'ART', 'id': [(QueryOperator.EQUAL, 1000)]}
         fields: lista de campos para retornar ou vazio para todos.
             Ex.: ['name']
@@ -157,56 +564,146 @@ class InMemoryDBManager(BaseDBManager):
         Retorno:
         Lista de registros de documento registrados na base de dados
         """
-        def match_doc(doc, filter):
-            """
-            Verifica se doc atende os critérios de seleção de filter.
-
-            :param doc: registro de documento da base de dados.
-            :type doc: dict.
-            :param filter: chaves/campos para aplicação do filtro com valor que
-                corresponde ao filtro a ser verificado no doc. Esse filtro pode
-                ser do tipo str ou list, onde o list contém uma tupla com
-                operação do filtro e valor do filtro a ser aplicado.
-                Ex.: {'type': 'ART', 'id': [(QueryOperator.EQUAL, 1000)]}
-            :type filter: dict.
-
-            :returns: True se documento atende a todos os critérios do filtro.
-                Caso contrário, False.
-            :rtype: bool.
-            """
-            result = []
-            for field_name, field_filter in filter.items():
-                if isinstance(filter, dict):
-                    filter_result = [
-                        getattr(operator, field_operator.value)(
-                            doc.get(field_name),
-                            filter_value if filter_value else ''
-                        )
-                        for field_operator, filter_value in field_filter
-                    ]
-                    result.extend(filter_result)
-                else:
-                    result.append(doc.get(field_name) == field_filter)
-
-            return all(result)
-
+        # sem ordenação ou com os IDs já ordenados, a busca é interrompida
+        # no limite; caso contrário, o limite é aplicado após a ordenação
         if len(filter) == 0:
             results = list(
                 islice(self.database.values(),
-                       limit if limit else None)
+                       limit if limit and not sort else None)
             )
         else:
+            ids, ordered = self._select_ids(filter, sort)
+            stop = limit if ordered or not sort else 0
             results = []
-            for doc in self.database.values():
-                if match_doc(doc, filter):
-                    if fields:
-                        d = {f: doc.get(f) for f in fields}
-                        results.append(d)
-                    else:
-                        results.append(doc)
-                    if limit and len(results) >= limit:
+            for id in ids:
+                doc = self.database[id]
+                if match_filter(doc, filter):
+                    results.append(doc)
+                    if stop and len(results) >= stop:
                         break
-        return sort_results(results, sort)
+            if not ordered:
+                # a ordenação considera os campos não selecionados em fields
+                results = sort_results(results, sort, limit)
+            if fields:
+                results = [{f: doc.get(f) for f in fields} for doc in results]
+            return results
+        return sort_results(results, sort, limit)
+
+    def iter_find(self, filter, fields, sort, limit=0, page_size=1000):
+        """
+        Itera sobre os registros de documento que atendem aos critérios de
+        seleção, à medida que são encontrados. Caso a ordenação não seja
+        atendida por um índice, os registros são obtidos por find.
+
+        Params:
+        filter, fields, sort: como em find
+        limit: (Opcional) Número máximo de registros ou 0 para todos.
+        page_size: ignorado, mantido para compatibilidade com CouchDBManager.
+
+        Retorno:
+        Iterador de registros de documento registrados na base de dados
+        """
+        ids, ordered = self._select_ids(filter, sort)
+        if sort and not ordered:
+            yield from self.find(filter, fields, sort, limit)
+            return
+        count = 0
+        for id in ids:
+            doc = self.database.get(id)
+            if doc is None or not match_filter(doc, filter):
+                continue
+            if fields:
+                doc = {f: doc.get(f) for f in fields}
+            yield doc
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def _select_ids(self, filter, sort):
+        """
+        Seleciona, por meio dos índices, os IDs dos documentos candidatos a
+        atender filter, que ainda devem ser verificados. Caso o índice usado
+        seja ordenado pelo único campo de sort, os IDs são retornados na ordem
+        de sort.
+
+        Retorno:
+        Tupla com iterador de IDs e indicação se estão na ordem de sort
+        """
+        sort_field, sort_order = None, None
+        if sort and len(sort) == 1:
+            sort_field, sort_order = list(sort[0].items())[0]
+
+        candidates = []
+        for field_name, field_filter in filter.items():
+            index = self._indexes.get(field_name)
+            if index is None:
+                continue
+            if not isinstance(field_filter, list):
+                field_filter = [(QueryOperator.EQUAL, field_filter)]
+            for field_operator, filter_value in field_filter:
+                if field_operator in index.operators:
+                    candidates.append(
+                        (index, field_operator, filter_value))
+        # o índice ordenado pelo campo de sort dispensa a ordenação
+        candidates.sort(
+            key=lambda candidate: not (
+                isinstance(candidate[0], _SortedIndex) and
+                candidate[0].field_name == sort_field
+            )
+        )
+        for index, field_operator, filter_value in candidates:
+            ordered = isinstance(index, _SortedIndex) and \
+                index.field_name == sort_field
+            try:
+                ids = index.lookup(field_operator,
+                                   filter_value,
+                                   reverse=ordered and sort_order != 'asc')
+            except TypeError:
+                # valores não hashable no índice de igualdade
+                continue
+            return ids, ordered
+        return iter(list(self.database.keys())), False
+
+    def create_with_attachments(self, id, document, attachments):
+        """
+        Persiste registro de documento junto com seus anexos.
+
+        Params:
+        id: ID do documento
+        document: registro do documento
+        attachments: lista de tuplas (file_id, content, content_properties)
+
+        Erro:
+        UpdateFailure: documento já existe na base de dados.
+        """
+        if id in self.database:
+            raise UpdateFailure('Document {} already exists'.format(id))
+        self.create(id, document)
+        for file_id, content, content_properties in attachments:
+            self.put_attachment(id, file_id, content, content_properties)
+
+    def update_with_attachments(self, id, document, attachments, removed=()):
+        """
+        Atualiza registro de documento, seus anexos e remove os anexos
+        informados.
+
+        Params:
+        id: ID do documento
+        document: registro do documento, com a revisão atual (document_rev)
+        attachments: lista de tuplas (file_id, content, content_properties)
+            dos anexos novos ou alterados
+        removed: IDs dos anexos a serem removidos
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        UpdateFailure: dados do document estão desatualizados.
+        """
+        self.update(id, document)
+        for file_id, content, content_properties in attachments:
+            self.put_attachment(id, file_id, content, content_properties)
+        doc = self.read(id)
+        for file_id in removed:
+            doc.get(self._attachments_key, {}).pop(file_id, None)
 
     def put_attachment(self, id, file_id, content, content_properties):
         doc = self.read(id)
@@ -233,11 +730,120 @@ class InMemoryDBManager(BaseDBManager):
             return doc[self._attachments_key][file_id]['content']
         return io.BytesIO()
 
+    def _get_stored_attachment(self, id, file_id):
+        doc = self.read(id)
+        attachment = doc.get(self._attachments_key, {}).get(file_id)
+        if attachment is None:
+            raise DocumentNotFound
+        return attachment
+
+    def head_attachment(self, id, file_id):
+        """
+        Obtém as propriedades do arquivo anexo ao registro de um documento,
+        sem o seu conteúdo.
+
+        Retorno:
+        dict com content_type, content_size e digest do anexo
+
+        Erro:
+        DocumentNotFound: documento ou anexo não encontrado na base de dados.
+        """
+        attachment = self._get_stored_attachment(id, file_id)
+        return _attachment_properties(attachment)
+
+    def read_version(self, id):
+        """
+        Obtém a revisão e as datas do registro de um documento, e as
+        propriedades dos seus anexos, sem o conteúdo dos anexos.
+
+        Retorno:
+        dict com document_rev, created_date, updated_date e attachments
+        (dict com content_type, content_size e digest de cada anexo)
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        """
+        doc = self.read(id)
+        return {
+            'document_rev': doc['document_rev'],
+            'created_date': doc.get('created_date'),
+            'updated_date': doc.get('updated_date'),
+            'attachments': {
+                file_id: _attachment_properties(attachment)
+                for file_id, attachment in doc.get(
+                    self._attachments_key, {}).items()
+            },
+        }
+
+    def open_attachment(self, id, file_id, byte_range=None):
+        """
+        Abre arquivo anexo ao registro de um documento para leitura em
+        partes.
+
+        Params:
+        byte_range: (Opcional) tupla (início, fim), com fim exclusivo, do
+            intervalo de bytes a ser lido
+
+        Retorno:
+        Tupla com arquivo (file-like), com o conteúdo ou somente o intervalo
+        informado, e propriedades do anexo (content_type, content_size e
+        digest)
+
+        Erro:
+        DocumentNotFound: documento ou anexo não encontrado na base de dados.
+        """
+        attachment = self._get_stored_attachment(id, file_id)
+        content = attachment['content']
+        properties = _attachment_properties(attachment)
+        if byte_range is not None:
+            content = content[byte_range[0]:byte_range[1]]
+        return io.BytesIO(content), properties
+
     def list_attachments(self, id):
         doc = self.read(id)
         return list(doc.get(self._attachments_key, {}).keys())
 
 
+def _attachment_properties(attachment):
+    # digest no mesmo formato do calculado pelo CouchDB
+    content = attachment['content']
+    return {
+        'content_type': attachment['content_type'],
+        'content_size': len(content),
+        'digest': 'md5-' + base64.b64encode(
+            hashlib.md5(content).digest()).decode('ascii'),
+    }
+
+
+def _is_missing_database(error):
+    """
+    Verifica se o erro ResourceNotFound do CouchDB se refere à base de dados
+    inexistente, e não a um documento ou anexo inexistente.
+    """
+    return bool(error.args) and error.args[0] == (
+        'not_found', 'Database does not exist.')
+
+
+def _retry_on_missing_database(method):
+    """
+    Caso a base de dados tenha sido removida após a obtenção da sua
+    referência, obtém novamente a referência e repete a operação uma única
+    vez. A base de dados não é recriada: caso ainda não exista, a operação
+    falha com DBFailed.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        except couchdb.http.ResourceNotFound as e:
+            if not _is_missing_database(e):
+                raise
+            self._database = None
+            self._indexes = None
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class CouchDBManager(BaseDBManager):
 
     def __init__(self, **kwargs):
@@ -245,40 +851,108 @@ class CouchDBManager(BaseDBManager):
         self._attachments_key = '_attachments'
         self._attachments_properties_key = 'attachments_properties'
         self._database = None
-        self._db_server = couchdb.Server(kwargs['database_uri'])
-        self._db_server.resource.credentials = (
-            kwargs['database_username'],
-            kwargs['database_password']
-        )
+        self._indexes = None
+        self._db_server = kwargs.get('database_server')
+        if self._db_server is None:
+            # database_timeout: timeout, em segundos, das conexões HTTP
+            self._db_server = couchdb.Server(
+                kwargs['database_uri'],
+                session=couchdb.http.Session(
+                    timeout=kwargs.get('database_timeout'))
+            )
+            self._db_server.resource.credentials = (
+                kwargs['database_username'],
+                kwargs['database_password']
+            )
 
     @property
     def database(self):
+        """
+        Referência à base de dados, obtida uma única vez e reutilizada nos
+        acessos seguintes. A base de dados não é criada aqui, mas no
+        provisionamento (create_database), na inicialização da aplicação.
+
+        Erro:
+        DBFailed: base de dados inexistente ou servidor indisponível
+        """
+        if self._database is None:
+            try:
+                self._database = self._db_server[self._database_name]
+            except couchdb.http.ResourceNotFound:
+                raise DBFailed(
+                    'Database {} does not exist'.format(self._database_name))
+            except:
+                raise DBFailed
+        return self._database
+
+    def create_database(self):
         try:
             self._database = self._db_server[self._database_name]
         except couchdb.http.ResourceNotFound:
             self._database = self._db_server.create(self._database_name)
         except:
             raise DBFailed
-        return self._database
+
+    def create_indexes(self):
+        """
+        Cria, caso não existam, os índices Mango declarados em
+        DATABASE_INDEXES para a base de dados. Deve ser executado na
+        inicialização da aplicação, e não durante as requisições.
+        """
+        indexes = self._get_indexes()
+        for fields in DATABASE_INDEXES.get(self._database_name, []):
+            index_fields = _index_fields(fields)
+            if index_fields not in indexes:
+                name = '_'.join(index_fields)
+                self.database.index()[name, name] = fields
+                indexes[index_fields] = ('_design/' + name, name)
+
+    def _get_indexes(self):
+        """
+        Obtém, uma única vez, os índices Mango existentes na base de dados,
+        identificados pelos nomes de seus campos.
+
+        Retorno:
+        dict com tuplas de nomes de campos e o par (design doc, nome) do
+        índice correspondente
+        """
+        if self._indexes is None:
+            self._indexes = {
+                _index_fields(index['def']['fields']): (index['ddoc'],
+                                                        index['name'])
+                for index in self.database.index()
+                if index.get('type') == 'json'
+            }
+        return self._indexes
 
     def drop_database(self):
+        self._database = None
+        self._indexes = None
         if self._database_name:
             try:
                 self._db_server.delete(self._database_name)
             except couchdb.http.ResourceNotFound:
                 pass
 
+    @_retry_on_missing_database
     def create(self, id, document):
-        self.database[id] = document
+        try:
+            self.database[id] = document
+        except couchdb.http.ResourceConflict:
+            raise UpdateFailure('Document {} already exists'.format(id))
 
+    @_retry_on_missing_database
     def read(self, id):
         try:
             doc = dict(self.database[id])
             doc['document_rev'] = doc['_rev']
-        except couchdb.http.ResourceNotFound:
+        except couchdb.http.ResourceNotFound as e:
+            if _is_missing_database(e):
+                raise
             raise DocumentNotFound
         return doc
 
+    @_retry_on_missing_database
     def update(self, id, document):
         """
         Para atualizar documento no CouchDB, é necessário informar a
@@ -291,22 +965,115 @@ class CouchDBManager(BaseDBManager):
                 'You are trying to update a record which data is out of date')
 
         doc.update(document)
-        self.database[id] = doc
+        try:
+            self.database[id] = doc
+        except couchdb.http.ResourceConflict:
+            raise UpdateFailure(
+                'You are trying to update a record which data is out of date')
 
+    @_retry_on_missing_database
     def delete(self, id):
         doc = self.read(id)
         self.database.delete(doc)
 
+    @_retry_on_missing_database
+    def create_many(self, documents):
+        """
+        Persiste registros de documentos em lote, em uma única requisição
+        (_bulk_docs).
+
+        Params:
+        documents: lista de tuplas (id, documento)
+
+        Retorno:
+        Lista de tuplas (id, erro), na ordem informada, onde erro é None
+        em caso de sucesso ou UpdateFailure caso o id já exista
+        """
+        docs = []
+        for id, document in documents:
+            document['_id'] = id
+            docs.append(document)
+        return self._bulk_docs(docs)
+
+    @_retry_on_missing_database
+    def read_many(self, ids):
+        """
+        Obtém registros de documentos em lote, em uma única requisição
+        (_all_docs?keys=).
+
+        Params:
+        ids: lista de ids de documentos
+
+        Retorno:
+        Lista de registros de documentos, na ordem informada, com None para
+        os documentos não encontrados
+        """
+        rows = self.database.view('_all_docs', keys=list(ids),
+                                  include_docs=True)
+        results = []
+        for row in rows:
+            if row.doc is None:
+                results.append(None)
+            else:
+                doc = dict(row.doc)
+                doc['document_rev'] = doc['_rev']
+                results.append(doc)
+        return results
+
+    @_retry_on_missing_database
+    def update_many(self, documents):
+        """
+        Atualiza registros de documentos em lote. Os documentos atuais são
+        obtidos em uma única requisição e atualizados em outra (_bulk_docs).
+
+        Params:
+        documents: lista de tuplas (id, documento)
+
+        Retorno:
+        Lista de tuplas (id, erro), na ordem informada, onde erro é None
+        em caso de sucesso, DocumentNotFound ou UpdateFailure
+        """
+        documents = list(documents)
+        current_docs = self.read_many([id for id, __ in documents])
+        errors = {}
+        docs = []
+        for (id, document), doc in zip(documents, current_docs):
+            if doc is None:
+                errors[id] = DocumentNotFound()
+            elif doc.get('_rev') != document.get('document_rev'):
+                errors[id] = UpdateFailure(
+                    'You are trying to update a record which data is out of '
+                    'date')
+            else:
+                doc.update(document)
+                docs.append(doc)
+        if docs:
+            for id, error in self._bulk_docs(docs):
+                errors[id] = error
+        return [(id, errors.get(id)) for id, __ in documents]
+
+    def _bulk_docs(self, docs):
+        results = []
+        for success, id, rev_or_exc in self.database.update(docs):
+            if success:
+                results.append((id, None))
+            elif isinstance(rev_or_exc, couchdb.http.ResourceConflict):
+                results.append((id, UpdateFailure(
+                    'Document {} update conflict'.format(id))))
+            else:
+                results.append((id, DBFailed(rev_or_exc)))
+        return results
+
+    @_retry_on_missing_database
     def find(self, filter, fields, sort, limit=0):
         """
         Busca registros de documento por criterios de selecao na base de dados.
-        # XXX: A biblioteca couchdb-python permite somente um critério de sele-
-        ção para cada campo de filter, o que não possibilita a criação de fil-
-        tro para selecionar campo com valor entre dois valores, por exemplo.
+        O filtro é traduzido para selector Mango por translate_filter, de modo
+        que toda a seleção é feita pelo CouchDB.
 
         Params:
         filter: criterio para selecionar campo com determinados valores ou
-            vazio para todos
+            vazio para todos, no formato de translate_filter
             Ex.: {'type': 'ART', 'id': [(QueryOperator.EQUAL, 1000)]}
         fields: lista de campos para retornar ou vazio para todos.
             Ex.: ['name']
@@ -314,52 +1081,13 @@ class CouchDBManager(BaseDBManager):
             Ex.: [{'name': 'asc'}]
         limit: (Opcional) Número máximo de registros da lista.
 
+        A ordenação usa o índice declarado em DATABASE_INDEXES com os mesmos
+        campos de sort, informado à consulta por use_index.
+
         Retorno:
         Lista de registros de documento registrados na base de dados
         """
-        def create_selector(filter, sort):
-            if not filter and sort:
-                filter = {
-                    sorter_name: {
-                        '$' + QueryOperator.GREATER_THAN.value: None
-                    }
-                    for sorter in sort
-                    for sorter_name, __ in sorter.items()
-                }
-            else:
-                for field_name, field_filter in filter.items():
-                    if isinstance(field_filter, list):
-                        filter[field_name] = {
-                            '$' + field_criteria[0].value: field_criteria[1]
-                            for field_criteria in field_filter
-                        }
-            return filter
-
-        def check_sort_index(sort):
-            indexes = self.database.index()
-            found_index = [
-                index['def']['fields']
-                for index in iter(indexes)
-                if index['def']['fields'] == sort
-            ]
-            if not found_index:
-                index_key = '_'.join(
-                    [
-                        sorter_key
-                        for sorter in sort
-                        for sorter_key in sorter.keys()
-                    ]
-                )
-                indexes[index_key, index_key] = sort
-
-        selector = create_selector(filter, sort)
-        if sort and sort[0]:
-            check_sort_index(sort)
-        selection_criteria = {
-            'selector': selector,
-            'fields': fields,
-            'sort': sort,
-        }
+        selection_criteria = self._find_query(filter, fields, sort)
         if limit > 0:
             selection_criteria.update({'limit': limit})
 
@@ -368,6 +1096,131 @@ class CouchDBManager(BaseDBManager):
             for document in self.database.find(selection_criteria)
         ]
 
+    def iter_find(self, filter, fields, sort, limit=0, page_size=1000):
+        """
+        Itera sobre os registros de documento que atendem aos critérios de
+        seleção, obtendo-os do CouchDB em páginas de page_size registros, por
+        meio do bookmark de cada página, de modo que somente uma página é
+        mantida em memória.
+
+        Params:
+        filter, fields, sort: como em find
+        limit: (Opcional) Número máximo de registros ou 0 para todos.
+        page_size: (Opcional) Número de registros obtidos por requisição.
+
+        Retorno:
+        Iterador de registros de documento registrados na base de dados
+        """
+        selection_criteria = self._find_query(filter, fields, sort)
+        remaining = limit
+        while True:
+            page_limit = min(page_size, remaining) if limit else page_size
+            selection_criteria['limit'] = page_limit
+            __, __, data = self.database.resource.post_json(
+                '_find', body=selection_criteria)
+            documents = data.get('docs', [])
+            yield from documents
+            if len(documents) < page_limit:
+                return
+            if limit:
+                remaining -= len(documents)
+                if remaining <= 0:
+                    return
+            selection_criteria['bookmark'] = data['bookmark']
+
+    def _find_query(self, filter, fields, sort):
+        """
+        Monta a consulta Mango de find e iter_find, com o selector traduzido
+        de filter e o índice correspondente a sort.
+        """
+        if not filter and sort:
+            filter = {
+                sorter_name: [(QueryOperator.GREATER_THAN, None)]
+                for sorter in sort
+                for sorter_name, __ in sorter.items()
+            }
+        selection_criteria = {
+            'selector': translate_filter(filter),
+            'fields': fields,
+            'sort': sort,
+        }
+        if sort and sort[0]:
+            index = self._get_indexes().get(_index_fields(sort))
+            if index is not None:
+                selection_criteria['use_index'] = list(index)
+        return selection_criteria
+
+    @_retry_on_missing_database
+    def create_with_attachments(self, id, document, attachments):
+        """
+        Persiste registro de documento junto com seus anexos em uma única
+        requisição, informando os anexos inline (codificados em base64) no
+        próprio documento.
+
+        Params:
+        id: ID do documento
+        document: registro do documento
+        attachments: lista de tuplas (file_id, content, content_properties)
+
+        Erro:
+        UpdateFailure: documento já existe na base de dados.
+        """
+        doc = dict(document)
+        doc[self._attachments_key] = {
+            file_id: {
+                'content_type': content_properties.get('content_type') or
+                'application/octet-stream',
+                'data': base64.b64encode(content).decode('ascii'),
+            }
+            for file_id, content, content_properties in attachments
+        }
+        try:
+            self.database[id] = doc
+        except couchdb.http.ResourceConflict:
+            raise UpdateFailure('Document {} already exists'.format(id))
+
+    @_retry_on_missing_database
+    def update_with_attachments(self, id, document, attachments, removed=()):
+        """
+        Atualiza registro de documento, inclui ou substitui os anexos
+        informados (inline, codificados em base64) e remove os anexos
+        indicados em uma única requisição. Os demais anexos são mantidos
+        como stubs, sem serem transferidos novamente.
+
+        Params:
+        id: ID do documento
+        document: registro do documento, com a revisão atual (document_rev)
+        attachments: lista de tuplas (file_id, content, content_properties)
+            dos anexos novos ou alterados
+        removed: IDs dos anexos a serem removidos
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        UpdateFailure: dados do document estão desatualizados.
+        """
+        doc = self.read(id)
+        if doc.get('_rev') != document.get('document_rev'):
+            raise UpdateFailure(
+                'You are trying to update a record which data is out of date')
+
+        doc.update(document)
+        doc_attachments = dict(doc.get(self._attachments_key) or {})
+        for file_id in removed:
+            doc_attachments.pop(file_id, None)
+        for file_id, content, content_properties in attachments:
+            doc_attachments[file_id] = {
+                'content_type': content_properties.get('content_type') or
+                'application/octet-stream',
+                'data': base64.b64encode(content).decode('ascii'),
+            }
+        doc[self._attachments_key] = doc_attachments
+        try:
+            self.database[id] = doc
+        except couchdb.http.ResourceConflict:
+            raise UpdateFailure(
+                'You are trying to update a record which data is out of date')
+
+    @_retry_on_missing_database
     def put_attachment(self, id, file_id, content, content_properties):
         """
         Para criar anexos no CouchDB, é necessário informar o documento com
@@ -382,6 +1235,7 @@ class CouchDBManager(BaseDBManager):
             content_type=content_properties.get('content_type')
         )
 
+    @_retry_on_missing_database
     def get_attachment(self, id, file_id):
         doc = self.read(id)
         attachment = self.database.get_attachment(doc, file_id)
@@ -389,22 +1243,254 @@ class CouchDBManager(BaseDBManager):
             return attachment.read()
         return io.BytesIO()
 
+    @_retry_on_missing_database
+    def head_attachment(self, id, file_id):
+        """
+        Obtém as propriedades do arquivo anexo ao registro de um documento,
+        sem o seu conteúdo, por meio de uma requisição HEAD ao CouchDB.
+
+        Retorno:
+        dict com content_type, content_size e digest do anexo
+
+        Erro:
+        DocumentNotFound: documento ou anexo não encontrado na base de dados.
+        """
+        try:
+            __, headers, __ = self.database.resource(id, file_id).head()
+        except couchdb.http.ResourceNotFound as e:
+            if _is_missing_database(e):
+                raise
+            raise DocumentNotFound
+        return {
+            'content_type': headers.get('Content-Type', ''),
+            'content_size': int(headers['Content-Length']),
+            'digest': _etag_digest(headers.get('ETag')),
+        }
+
+    @_retry_on_missing_database
+    def read_version(self, id):
+        """
+        Obtém a revisão e as datas do registro de um documento, e as
+        propriedades dos seus anexos, em uma única leitura do documento, na
+        qual o CouchDB informa somente os metadados (stubs) dos anexos.
+
+        Retorno:
+        dict com document_rev, created_date, updated_date e attachments
+        (dict com content_type, content_size e digest de cada anexo)
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        """
+        doc = self.read(id)
+        return {
+            'document_rev': doc['_rev'],
+            'created_date': doc.get('created_date'),
+            'updated_date': doc.get('updated_date'),
+            'attachments': {
+                file_id: {
+                    'content_type': attachment.get('content_type', ''),
+                    'content_size': attachment.get('length'),
+                    'digest': attachment.get('digest', ''),
+                }
+                for file_id, attachment in doc.get(
+                    self._attachments_key, {}).items()
+            },
+        }
+
+    @_retry_on_missing_database
+    def open_attachment(self, id, file_id, byte_range=None):
+        """
+        Abre arquivo anexo ao registro de um documento para leitura em
+        partes, em uma única requisição ao CouchDB e sem ler o conteúdo, que
+        é lido da resposta HTTP à medida que é consumido.
+
+        O intervalo de bytes é solicitado ao CouchDB (cabeçalho Range). Caso
+        o CouchDB responda com o anexo completo, como para anexos armazenados
+        comprimidos, os bytes fora do intervalo são descartados na leitura.
+
+        Params:
+        byte_range: (Opcional) tupla (início, fim), com fim exclusivo, do
+            intervalo de bytes a ser lido
+
+        Retorno:
+        Tupla com arquivo (file-like), com o conteúdo ou somente o intervalo
+        informado, e propriedades do anexo (content_type, content_size e
+        digest)
+
+        Erro:
+        DocumentNotFound: documento ou anexo não encontrado na base de dados.
+        """
+        headers = {}
+        if byte_range is not None:
+            headers['Range'] = 'bytes={}-{}'.format(byte_range[0],
+                                                    byte_range[1] - 1)
+        try:
+            status, response_headers, content = self.database.resource(
+                id, file_id).get(headers=headers)
+        except couchdb.http.ResourceNotFound as e:
+            if _is_missing_database(e):
+                raise
+            raise DocumentNotFound
+        if content is None:
+            # couchdb-python não devolve o corpo de respostas vazias
+            content = io.BytesIO(b'')
+        content_size = int(response_headers['Content-Length'])
+        if status == 206:
+            content_size = int(
+                response_headers['Content-Range'].rpartition('/')[2])
+        elif byte_range is not None:
+            content = _ByteRangeFile(content, *byte_range)
+        return content, {
+            'content_type': response_headers.get('Content-Type', ''),
+            'content_size': content_size,
+            'digest': _etag_digest(response_headers.get('ETag')),
+        }
+
+    @_retry_on_missing_database
     def list_attachments(self, id):
         doc = self.read(id)
         return list(doc.get(self._attachments_key, {}).keys())
 
+    @_retry_on_missing_database
+    def wait_changes(self, since='now', timeout=25):
+        """
+        Aguarda, por meio do feed _changes do CouchDB (longpoll), alterações
+        na base de dados posteriores a ``since``.
+
+        Params:
+        since: sequencial do feed _changes a partir do qual aguardar
+        timeout: tempo máximo de espera, em segundos
+
+        Retorno:
+        Tupla com o último sequencial do feed e a quantidade de alterações
+        """
+        result = self.database.changes(feed='longpoll',
+                                       since=since,
+                                       timeout=int(timeout * 1000))
+        return result['last_seq'], len(result['results'])
+
+
+def _etag_digest(etag):
+    """
+    Obtém, do ETag do anexo informado pelo CouchDB (MD5 em base64, entre
+    aspas), o digest no formato dos metadados (stubs) dos anexos do
+    documento (md5-<base64>), usado em read_version.
+    """
+    digest = (etag or '').strip('"')
+    if digest and not digest.startswith('md5-'):
+        digest = 'md5-' + digest
+    return digest
+
+
+def _collation_key(value):
+    """
+    Chave de ordenação de um valor de campo, seguindo a ordem de tipos do
+    CouchDB (null, booleanos, números, textos, listas e objetos), de modo que
+    valores ausentes (None) e de tipos diferentes possam ser comparados.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    if isinstance(value, (list, tuple)):
+        return (4, [_collation_key(item) for item in value])
+    return (5, 0)
+
+
+class _SortKey:
+    """
+    Chave composta de ordenação para critérios com ordenações diferentes
+    (ascendente e descendente) entre os campos.
+    """
+
+    __slots__ = ('values', 'descending')
+
+    def __init__(self, values, descending):
+        self.values = values
+        self.descending = descending
+
+    def __lt__(self, other):
+        for value, other_value, descending in zip(self.values,
+                                                  other.values,
+                                                  self.descending):
+            if value != other_value:
+                if descending:
+                    return value > other_value
+                return value < other_value
+        return False
+
+
+class _ByteRangeFile:
+    """
+    Arquivo somente leitura com o intervalo [start, stop) dos bytes de outro
+    arquivo, cujos bytes anteriores a start são descartados na primeira
+    leitura.
+    """
+
+    def __init__(self, file, start, stop):
+        self._file = file
+        self._skip = start
+        self._remaining = stop - start
+
+    def read(self, size=-1):
+        while self._skip:
+            skipped = self._file.read(min(self._skip, 64 * 1024))
+            if not skipped:
+                break
+            self._skip -= len(skipped)
+        if size is None or size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size) if size else b''
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        close = getattr(self._file, 'close', None)
+        if close is not None:
+            close()
+
+
+def sort_results(results, sort, limit=0):
+    """
+    Ordena registros de documento pelos critérios de ordenação informados,
+    mantendo a ordem original entre registros equivalentes. Caso limit seja
+    informado, seleciona somente os limit primeiros registros por meio de
+    heap, sem ordenar todos os registros.
+
+    Params:
+    results: lista de registros de documento
+    sort: lista de dict com nome de campo e sua ordenacao.
+        Ex.: [{'name': 'asc'}]
+    limit: (Opcional) Número máximo de registros a retornar.
+
+    Retorno:
+    Lista de registros de documento ordenada
+    """
+    if not sort:
+        return list(results[:limit] if limit else results)
+
+    fields = [list(sorter.items())[0] for sorter in sort]
+    descending = tuple(order != 'asc' for __, order in fields)
+    field_names = tuple(field for field, __ in fields)
+    reverse = False
+    if len(set(descending)) == 1:
+        reverse = descending[0]
+
+        def key(doc):
+            return tuple(
+                _collation_key(doc.get(field)) for field in field_names)
+    else:
+        def key(doc):
+            return _SortKey(
+                tuple(_collation_key(doc.get(field)) for field in field_names),
+                descending
+            )
 
-def sort_results(results, sort):
-    scores = [list() for i in results]
-    for _ord in sort:
-        field, order = list(_ord.items())[0]
-
-        values = sorted(
-            list(
-                {doc.get(field) for doc in results}), reverse=(order != 'asc'))
-        values = {value: i for i, value in enumerate(values)}
-        for i, doc in enumerate(results):
-            scores[i].append(values.get(doc.get(field)))
-    items = sorted([(tuple(score), i) for i, score in enumerate(scores)])
-    r = [results[item[1]] for item in items]
-    return r
+    if limit and limit < len(results):
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(limit, results, key=key)
+    return sorted(results, key=key, reverse=reverse)
@@ -0,0 +1,157 @@
+import threading
+import time
+from collections import OrderedDict
+
+import couchdb
+from prometheus_client import Counter, Summary
+
+from .databases import CouchDBManager
+from .seqnum_generator import SeqNumGenerator
+
+
+DB_POOL_HITS = Counter(
+    'db_pool_hits_total',
+    'Number of DBManager instances reused from the pool')
+DB_POOL_MISSES = Counter(
+    'db_pool_misses_total',
+    'Number of DBManager instances created by the pool')
+DB_POOL_WAIT = Summary(
+    'db_pool_wait_seconds',
+    'Time spent waiting to acquire the DBManager pool')
+
+
+class DBManagerPool:
+    """
+    DBManagerPool mantém instâncias de CouchDBManager compartilhadas entre as
+    requisições do processo, identificadas por URI, credenciais e nome da base
+    de dados. As instâncias de um mesmo servidor compartilham a mesma sessão
+    HTTP, reutilizando as conexões abertas (keep-alive) com o CouchDB.
+
+    max_size:
+        Número máximo de instâncias de DBManager mantidas no pool
+    idle_timeout:
+        Tempo, em segundos, após o qual uma instância sem uso é descartada
+    timeout:
+        Timeout, em segundos, das conexões HTTP com o servidor
+    """
+
+    def __init__(self, max_size=10, idle_timeout=300, timeout=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._managers = OrderedDict()
+        self._servers = {}
+        self._seqnum_generators = {}
+
+    def __len__(self):
+        return len(self._managers)
+
+    def get(self, **db_settings):
+        """
+        Obtém a instância de CouchDBManager correspondente às configurações
+        informadas, criando-a caso não exista no pool.
+
+        Params:
+        db_settings: configurações do banco de dados. Deve conter:
+            - database_uri: URI do banco de dados (host:porta)
+            - database_username: usuário do banco de dados
+            - database_password: senha do banco de dados
+            - database_name: nome da base de dados
+        """
+        server_key = (
+            db_settings['database_uri'],
+            db_settings.get('database_username'),
+            db_settings.get('database_password'),
+        )
+        manager_key = server_key + (db_settings['database_name'], )
+
+        started = time.monotonic()
+        with self._lock:
+            now = time.monotonic()
+            DB_POOL_WAIT.observe(now - started)
+            self._discard_idle(now)
+
+            entry = self._managers.pop(manager_key, None)
+            if entry is None:
+                DB_POOL_MISSES.inc()
+                manager = CouchDBManager(
+                    database_server=self._get_server(server_key),
+                    **db_settings
+                )
+            else:
+                DB_POOL_HITS.inc()
+                manager = entry[0]
+            self._managers[manager_key] = (manager, now)
+
+            while len(self._managers) > self.max_size:
+                self._managers.popitem(last=False)
+            self._discard_unused_servers()
+        return manager
+
+    def get_seqnum_generator(self, seqnum_label, block_size=1,
+                             **db_settings):
+        """
+        Obtém o SeqNumGenerator do registro ``seqnum_label`` associado à
+        instância de CouchDBManager do pool, de modo que os blocos de números
+        sequenciais reservados sejam compartilhados por todo o processo.
+        """
+        db_manager = self.get(**db_settings)
+        key = (
+            db_settings['database_uri'],
+            db_settings.get('database_username'),
+            db_settings.get('database_password'),
+            db_settings['database_name'],
+            seqnum_label,
+        )
+        with self._lock:
+            seqnum_generator = self._seqnum_generators.get(key)
+            if (seqnum_generator is None or
+                    seqnum_generator.db_manager is not db_manager or
+                    seqnum_generator.block_size != block_size):
+                if seqnum_generator is not None:
+                    seqnum_generator.release()
+                seqnum_generator = SeqNumGenerator(
+                    db_manager, seqnum_label, block_size=block_size)
+                self._seqnum_generators[key] = seqnum_generator
+        return seqnum_generator
+
+    def clear(self):
+        """
+        Descarta todas as instâncias mantidas no pool.
+        """
+        with self._lock:
+            for seqnum_generator in self._seqnum_generators.values():
+                seqnum_generator.release()
+            self._managers.clear()
+            self._servers.clear()
+            self._seqnum_generators.clear()
+
+    def _get_server(self, server_key):
+        server = self._servers.get(server_key)
+        if server is None:
+            database_uri, username, password = server_key
+            server = couchdb.Server(
+                database_uri,
+                session=couchdb.http.Session(timeout=self.timeout)
+            )
+            server.resource.credentials = (username, password)
+            self._servers[server_key] = server
+        return server
+
+    def _discard_idle(self, now):
+        if not self.idle_timeout:
+            return
+        idle = [
+            key
+            for key, (manager, last_used) in self._managers.items()
+            if now - last_used > self.idle_timeout
+        ]
+        for key in idle:
+            del self._managers[key]
+
+    def _discard_unused_servers(self):
+        in_use = {key[:3] for key in self._managers.keys()}
+        for server_key in list(self._servers.keys()):
+            if server_key not in in_use:
+                del self._servers[server_key]
@@ -1,5 +1,24 @@
+import atexit
+import random
+import threading
+import time
+import weakref
 
-from persistence.databases import DocumentNotFound
+from prometheus_client import Counter, Summary
+
+from persistence.databases import DocumentNotFound, UpdateFailure
+
+
+SEQNUM_RESERVATION_CONFLICTS = Counter(
+    'seqnum_reservation_conflicts_total',
+    'Number of sequential number block reservations which conflicted')
+SEQNUM_BLOCK_USAGE = Summary(
+    'seqnum_block_usage_ratio',
+    'Fraction of a sequential number block used before it was exhausted or '
+    'abandoned')
+
+# geradores do processo, cujos blocos são abandonados no seu encerramento
+_generators = weakref.WeakSet()
 
 
 class SeqNumGenerator:
@@ -7,19 +26,91 @@ class SeqNumGenerator:
     Database SeqNumGenerator é responsável por persistir números sequenciais
     em um DBManager.
 
+    Os números são reservados em blocos de ``block_size`` números, com uma
+    única atualização do registro por bloco, e entregues a partir da memória.
+    Como cada processo reserva seu próprio bloco, com ``block_size`` maior que
+    1 os números são únicos, mas podem não ser entregues em ordem crescente
+    entre processos diferentes; por isso, sequências que devem seguir a
+    ordem de registro, como a dos registros de mudança (ChangesService),
+    usam ``block_size`` 1.
+
     db_manager:
         Instância do DBManager para persistir registros de número sequencial
+    seqnum_label:
+        ID do registro de número sequencial
+    block_size:
+        Quantidade de números reservados a cada atualização do registro
+    max_retries:
+        Número máximo de tentativas de reserva de um bloco em caso de conflito
+    retry_delay:
+        Tempo, em segundos, de espera inicial entre tentativas de reserva,
+        dobrado a cada nova tentativa
     """
 
-    def __init__(self, db_manager, seqnum_label):
+    def __init__(self, db_manager, seqnum_label, block_size=1, max_retries=5,
+                 retry_delay=0.01):
         self.db_manager = db_manager
         self.seqnum_label = seqnum_label
+        self.block_size = block_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._next = None
+        self._last = None
+        _generators.add(self)
 
     def new(self):
-        record = self.get()
-        record['SEQ'] += 1
-        self._update(record)
-        return record['SEQ']
+        with self._lock:
+            if self._next is not None and self._next > self._last:
+                # bloco esgotado
+                SEQNUM_BLOCK_USAGE.observe(1.0)
+                self._next = self._last = None
+            if self._next is None:
+                self._reserve()
+            sequential = self._next
+            self._next += 1
+        return sequential
+
+    def release(self):
+        """
+        Abandona o bloco de números reservado, cujos números não usados não
+        serão entregues por nenhum processo, e registra a fração do bloco
+        que foi usada. Deve ser chamado quando o gerador é descartado; é
+        chamado para todos os geradores no encerramento do processo. Um novo
+        bloco é reservado na próxima chamada de new.
+        """
+        with self._lock:
+            if self._next is not None:
+                used = self.block_size - (self._last - self._next + 1)
+                SEQNUM_BLOCK_USAGE.observe(used / self.block_size)
+                self._next = self._last = None
+
+    def _reserve(self):
+        """
+        Reserva um novo bloco de números sequenciais. Em caso de conflito na
+        atualização do registro, tenta novamente após um tempo de espera
+        crescente.
+
+        Erro:
+        UpdateFailure: não foi possível reservar o bloco após max_retries
+            tentativas.
+        """
+        for attempt in range(self.max_retries):
+            record = dict(self.get())
+            first = record['SEQ'] + 1
+            record['SEQ'] += self.block_size
+            try:
+                self._update(record)
+            except UpdateFailure:
+                SEQNUM_RESERVATION_CONFLICTS.inc()
+                time.sleep(
+                    self.retry_delay * (2 ** attempt) * random.uniform(1, 2))
+            else:
+                self._next, self._last = first, record['SEQ']
+                return
+        raise UpdateFailure(
+            'Could not reserve a block of sequential numbers for {}'.format(
+                self.seqnum_label))
 
     def get(self):
         """
@@ -32,7 +123,11 @@ class SeqNumGenerator:
         try:
             record = self._read()
         except DocumentNotFound:
-            self._create({'SEQ': 0})
+            try:
+                self._create({'SEQ': 0})
+            except UpdateFailure:
+                # outro processo criou o registro
+                pass
             record = self._read()
         return record
 
@@ -66,5 +161,12 @@ class SeqNumGenerator:
 
         Erro:
         DocumentNotFound: registro não encontrado na base de dados.
+        UpdateFailure: registro atualizado concorrentemente.
         """
         self.db_manager.update(self.seqnum_label, record)
+
+
+@atexit.register
+def _release_all():
+    for generator in list(_generators):
+        generator.release()
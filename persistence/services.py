@@ -49,18 +49,38 @@ class ChangesService:
     changes_db_manager:
         Instância do DBManager para persistir registro de mudanças
     seqnum_generator:
-        Instância do DBManager para persistir número sequencial
+        Instância do SeqNumGenerator dos números sequenciais dos registros de
+        mudança, com ``block_size`` 1: o feed de mudanças é paginado pelo
+        número sequencial (change_id), que deve seguir a ordem de registro
+    changes_writer:
+        (Opcional) Instância do ChangesWriter para persistir os registros
+        de mudança em lote, fora da requisição
+    changes_notifier:
+        (Opcional) Instância do ChangesNotifier para avisar os consumidores
+        do feed de mudanças sobre novos registros de mudança; com
+        changes_writer, quem avisa é o changes_writer, após a escrita
     """
 
-    def __init__(self, changes_db_manager, seqnum_generator):
+    def __init__(self, changes_db_manager, seqnum_generator,
+                 changes_writer=None, changes_notifier=None):
+        if getattr(seqnum_generator, 'block_size', 1) != 1:
+            # com blocos, os números não seguem a ordem de registro entre
+            # processos e os consumidores do feed perderiam registros
+            raise ValueError(
+                'The changes sequence must not be reserved in blocks')
         self.changes_db_manager = changes_db_manager
         self.seqnum_generator = seqnum_generator
+        self.changes_writer = changes_writer
+        self.changes_notifier = changes_notifier
 
-    @REQUEST_TIME_CHANGES_UPD.time()
-    def register_change(self,
-                        document_record,
-                        change_type,
-                        attachment_id=None):
+    def _notify(self):
+        if self.changes_notifier is not None:
+            self.changes_notifier.notify()
+
+    def _get_change_record(self,
+                           document_record,
+                           change_type,
+                           attachment_id=None):
         sequencial = self.seqnum_generator.new()
         change_record = {
             'change_id': sequencial,
@@ -72,12 +92,83 @@ class ChangesService:
         }
         if attachment_id:
             change_record.update({'attachment_id': attachment_id})
-        self.changes_db_manager.create(
-            change_record['record_id'],
-            change_record
-        )
+        return change_record
+
+    @REQUEST_TIME_CHANGES_UPD.time()
+    def register_change(self,
+                        document_record,
+                        change_type,
+                        attachment_id=None):
+        change_record = self._get_change_record(
+            document_record, change_type, attachment_id)
+        if self.changes_writer is not None:
+            # os consumidores são avisados pelo changes_writer, após a escrita
+            self.changes_writer.write(change_record)
+        else:
+            self.changes_db_manager.create(
+                change_record['record_id'],
+                change_record
+            )
+            self._notify()
         return change_record['record_id']
 
+    @REQUEST_TIME_CHANGES_UPD.time()
+    def register_changes(self, document_records, change_type):
+        """
+        Persiste, em lote, um registro de mudança para cada registro de
+        documento informado.
+
+        Params:
+        document_records: lista de registros de documento
+        change_type: tipo da mudança (ChangeType)
+
+        Retorno:
+        Lista de IDs dos registros de mudança
+        """
+        change_records = [
+            self._get_change_record(document_record, change_type)
+            for document_record in document_records
+        ]
+        if self.changes_writer is not None:
+            for change_record in change_records:
+                self.changes_writer.write(change_record)
+        elif change_records:
+            self.changes_db_manager.create_many(
+                [
+                    (change_record['record_id'], change_record)
+                    for change_record in change_records
+                ]
+            )
+            self._notify()
+        return [
+            change_record['record_id']
+            for change_record in change_records
+        ]
+
+
+def _changes_query(last_sequence):
+    return {
+        'fields': [
+            'change_id',
+            'document_id',
+            'document_type',
+            'type',
+            'created_date'
+        ],
+        'filter': {
+            'change_id': [
+                (QueryOperator.GREATER_THAN,
+                 last_sequence if last_sequence else None)
+            ]
+        },
+        'sort': [{'change_id': SortOrder.ASC.value}],
+    }
+
+
+def _convert_change_type(change):
+    change.update({'type': ChangeType(change['type']).name})
+    return change
+
 
 class DatabaseService:
     """
@@ -111,6 +202,71 @@ class DatabaseService:
         self.changes_service.register_change(
             document_record, ChangeType.CREATE)
 
+    @REQUEST_TIME_DOC_UPD.time()
+    def register_with_attachments(self, document_id, document_record,
+                                  attachments):
+        """
+        Persiste registro de um documento, seus anexos e as propriedades dos
+        anexos em uma única escrita, e registra uma única mudança para o
+        conjunto.
+
+        Params:
+        document_id: ID do documento
+        document_record: registro do documento
+        attachments: lista de tuplas (file_id, content, file_properties)
+
+        Erro:
+        UpdateFailure: documento já existe na base de dados.
+        """
+        document_record.update({
+            'created_date': str(datetime.utcnow().timestamp())
+        })
+        for file_id, content, file_properties in attachments:
+            self.db_manager.add_attachment_properties_to_document_record(
+                document_record,
+                file_id,
+                file_properties
+            )
+        self.db_manager.create_with_attachments(
+            document_id, document_record, attachments)
+        self.changes_service.register_change(
+            document_record, ChangeType.CREATE)
+
+    @REQUEST_TIME_DOC_UPD.time()
+    def register_many(self, documents):
+        """
+        Persiste registros de documentos em lote e as mudanças dos registros
+        persistidos com sucesso, também em lote.
+
+        Params:
+        documents: lista de tuplas (ID do documento, registro do documento)
+
+        Retorno:
+        Lista de tuplas (ID do documento, erro), onde erro é None em caso de
+        sucesso ou a exceção que impediu a persistência do registro
+        """
+        documents = list(documents)
+        created_date = str(datetime.utcnow().timestamp())
+        for document_id, document_record in documents:
+            document_record.update({'created_date': created_date})
+        results = self.db_manager.create_many(documents)
+        self._register_changes(documents, results, ChangeType.CREATE)
+        return results
+
+    @REQUEST_TIME_DOC_READ.time()
+    def read_many(self, document_ids):
+        """
+        Obtém registros de documentos em lote pelos IDs dos documentos.
+
+        Params:
+        document_ids: lista de IDs de documentos
+
+        Retorno:
+        Lista de registros de documento, na ordem informada, com None para os
+        documentos não encontrados
+        """
+        return self.db_manager.read_many(document_ids)
+
     @REQUEST_TIME_DOC_READ.time()
     def read(self, document_id):
         """
@@ -126,6 +282,32 @@ class DatabaseService:
         DocumentNotFound: documento não encontrado na base de dados.
         """
         document = self.db_manager.read(document_id)
+        return self._get_document_record(document_id, document)
+
+    @REQUEST_TIME_DOC_READ.time()
+    def read_for_update(self, document_id):
+        """
+        Obtém registro de um documento como read, acrescido das propriedades
+        dos anexos (attachments_properties), de uso interno na atualização
+        dos anexos por update_with_attachments e não exposto pela API.
+
+        Params:
+        document_id: ID do documento
+
+        Retorno:
+        registro de documento registrado na base de dados, com
+        attachments_properties
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        """
+        document = self.db_manager.read(document_id)
+        document_record = self._get_document_record(document_id, document)
+        document_record['attachments_properties'] = \
+            document.get('attachments_properties', {})
+        return document_record
+
+    def _get_document_record(self, document_id, document):
         document_record = {
             'document_id': document['document_id'],
             'document_type': document['document_type'],
@@ -161,6 +343,79 @@ class DatabaseService:
         self.changes_service.register_change(
             document_record, ChangeType.UPDATE)
 
+    @REQUEST_TIME_DOC_UPD.time()
+    def update_with_attachments(self, document_id, document_record,
+                                attachments, removed_file_ids=()):
+        """
+        Atualiza o registro de um documento, os anexos informados e as
+        propriedades dos anexos em uma única escrita, remove os anexos
+        indicados e registra uma única mudança para o conjunto. Os anexos
+        não informados são mantidos como estão.
+
+        Params:
+        document_id: ID do documento a ser atualizado
+        document_record: registro de documento a ser atualizado
+        attachments: lista de tuplas (file_id, content, file_properties) dos
+            anexos novos ou alterados
+        removed_file_ids: IDs dos anexos a serem removidos
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        UpdateFailure: dados do document_record estão desatualizados.
+        """
+        document_record.update({
+            'updated_date': str(datetime.utcnow().timestamp())
+        })
+        properties = document_record.get('attachments_properties', {})
+        for file_id in removed_file_ids:
+            properties.pop(file_id, None)
+        for file_id, content, file_properties in attachments:
+            self.db_manager.add_attachment_properties_to_document_record(
+                document_record,
+                file_id,
+                file_properties
+            )
+        self.db_manager.update_with_attachments(
+            document_id, document_record, attachments, removed_file_ids)
+        self.changes_service.register_change(
+            document_record, ChangeType.UPDATE)
+
+    @REQUEST_TIME_DOC_UPD.time()
+    def update_many(self, documents):
+        """
+        Atualiza registros de documentos em lote e persiste as mudanças dos
+        registros atualizados com sucesso, também em lote.
+
+        Params:
+        documents: lista de tuplas (ID do documento, registro do documento)
+
+        Retorno:
+        Lista de tuplas (ID do documento, erro), onde erro é None em caso de
+        sucesso, DocumentNotFound ou UpdateFailure
+        """
+        documents = list(documents)
+        updated_date = str(datetime.utcnow().timestamp())
+        for document_id, document_record in documents:
+            document_record.update({'updated_date': updated_date})
+        results = self.db_manager.update_many(documents)
+        self._register_changes(documents, results, ChangeType.UPDATE)
+        return results
+
+    def _register_changes(self, documents, results, change_type):
+        failed = {
+            document_id
+            for document_id, error in results
+            if error is not None
+        }
+        self.changes_service.register_changes(
+            [
+                document_record
+                for document_id, document_record in documents
+                if document_id not in failed
+            ],
+            change_type
+        )
+
     def delete(self, document_id, document_record):
         """
         Remove registro de um documento e a mudança na base de dados.
@@ -176,6 +431,25 @@ class DatabaseService:
         self.changes_service.register_change(
             document_record, ChangeType.DELETE)
 
+    def iter_find(self, selector, fields, sort, page_size=1000):
+        """
+        Itera sobre os registros de documento que atendem aos critérios de
+        seleção, obtendo-os da base de dados em páginas de page_size
+        registros.
+
+        Params:
+        selector: criterio para selecionar campo com determinados valores
+            Ex.: {'type': 'ART'}
+        fields: lista de campos para retornar. Ex.: ['name']
+        sort: lista de dict com nome de campo e sua ordenacao.[{'name': 'asc'}]
+        page_size: número de registros obtidos por consulta à base de dados
+
+        Retorno:
+        Iterador de registros de documento registrados na base de dados
+        """
+        return self.db_manager.iter_find(selector, fields, sort,
+                                         page_size=page_size)
+
     @REQUEST_TIME_DOC_FIND.time()
     def find(self, selector, fields, sort):
         """
@@ -237,6 +511,60 @@ class DatabaseService:
         """
         return self.db_manager.get_attachment(document_id, file_id)
 
+    @REQUEST_TIME_ATT_READ.time()
+    def open_attachment(self, document_id, file_id, byte_range=None):
+        """
+        Abre arquivo anexo ao registro de um documento pelo ID do documento e
+        ID do anexo, para leitura em partes.
+        Params:
+        document_id: ID do documento ao qual o arquivo está anexado
+        file_id: identificação do arquivo anexado a ser recuperado
+        byte_range: (Opcional) tupla (início, fim), com fim exclusivo, do
+            intervalo de bytes a ser lido
+
+        Retorno:
+        Tupla com arquivo (file-like) e propriedades do anexo (content_type,
+        content_size e digest)
+
+        Erro:
+        DocumentNotFound: documento ou anexo não encontrado na base de dados.
+        """
+        return self.db_manager.open_attachment(document_id, file_id,
+                                               byte_range)
+
+    def head_attachment(self, document_id, file_id):
+        """
+        Obtém as propriedades do arquivo anexo ao registro de um documento,
+        sem o seu conteúdo.
+        Params:
+        document_id: ID do documento ao qual o arquivo está anexado
+        file_id: identificação do arquivo anexado
+
+        Retorno:
+        dict com content_type, content_size e digest do anexo
+
+        Erro:
+        DocumentNotFound: documento ou anexo não encontrado na base de dados.
+        """
+        return self.db_manager.head_attachment(document_id, file_id)
+
+    def read_version(self, document_id):
+        """
+        Obtém a revisão e as datas do registro de um documento, e as
+        propriedades dos seus anexos, sem o conteúdo dos anexos. Usado para
+        validar caches (ETag e Last-Modified) sem ler o documento completo.
+        Params:
+        document_id: ID do documento
+
+        Retorno:
+        dict com document_rev, created_date, updated_date e attachments
+        (dict com content_type, content_size e digest de cada anexo)
+
+        Erro:
+        DocumentNotFound: documento não encontrado na base de dados.
+        """
+        return self.db_manager.read_version(document_id)
+
     def get_attachment_properties(self, document_id, file_id):
         """
         Recupera arquivo anexos ao registro de um documento pelo ID do
@@ -268,30 +596,37 @@ class DatabaseService:
         Retorno:
         Lista de registros de mudança
         """
-        def convert_change_type(change):
-            change.update({'type': ChangeType(change['type']).name})
-            return change
-
-        fields = [
-            'change_id',
-            'document_id',
-            'document_type',
-            'type',
-            'created_date'
-        ]
-        filter = {
-            'change_id': [
-                (QueryOperator.GREATER_THAN,
-                 last_sequence if last_sequence else None)
-            ]
-        }
-        sort = [{'change_id': SortOrder.ASC.value}]
         changes = self.changes_service.changes_db_manager.find(
-                                               fields=fields,
-                                               limit=limit,
-                                               filter=filter,
-                                               sort=sort)
+            limit=limit,
+            **_changes_query(last_sequence)
+        )
         return [
-            convert_change_type(change)
+            _convert_change_type(change)
             for change in changes
         ]
+
+    def iter_changes(self, last_sequence, limit=0, page_size=1000):
+        """
+        Itera sobre os registros de mudança a partir do sequencial informado,
+        obtendo-os da base de dados em páginas de, no máximo, page_size
+        registros (iter_find), de modo que a memória usada não depende da
+        quantidade de registros.
+
+        Params:
+        :param last_sequence: sequencial de mudança, que deve ser a referência
+            para a busca dos sequenciais a serem listados.
+        :param limit: limite máximo de registros de mudança que devem ser
+            listados ou 0 para todos.
+        :param page_size: quantidade de registros de mudança obtidos por
+            consulta à base de dados.
+
+        Retorno:
+        Iterador de registros de mudança
+        """
+        changes = self.changes_service.changes_db_manager.iter_find(
+            limit=limit,
+            page_size=page_size,
+            **_changes_query(last_sequence)
+        )
+        for change in changes:
+            yield _convert_change_type(change)
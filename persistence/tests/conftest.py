@@ -64,10 +64,9 @@ def seqnum_db_settings():
     InMemoryDBManager
 ])
 def seqnumber_generator(request, seqnum_db_settings):
-    s = SeqNumGenerator(
-        request.param(**seqnum_db_settings),
-        'CHANGE'
-    )
+    db_manager = request.param(**seqnum_db_settings)
+    db_manager.create_database()
+    s = SeqNumGenerator(db_manager, 'CHANGE')
 
     def fin():
         s.db_manager.drop_database()
@@ -90,6 +89,8 @@ def database_service(request, article_db_settings, change_db_settings,
             seqnumber_generator
         )
     )
+    db_service.db_manager.create_database()
+    db_service.changes_service.changes_db_manager.create_database()
 
     def fin():
         db_service.db_manager.drop_database()
@@ -1,7 +1,11 @@
 from datetime import datetime
 from uuid import uuid4
 
-from persistence.services import ChangeType
+import pytest
+
+from persistence.databases import InMemoryDBManager
+from persistence.seqnum_generator import SeqNumGenerator
+from persistence.services import ChangesService, ChangeType
 from persistence.models import get_record, RecordType
 
 
@@ -123,3 +127,33 @@ def test_update_attachment_create_change(database_service, xml_test):
     assert check_change['document_type'] == article_record['document_type']
     assert check_change['type'] == ChangeType.UPDATE.value
     assert check_change['created_date'] is not None
+
+
+def test_register_changes(database_service):
+    article_records = [
+        get_article_record({'Test': 'ChangeRecord{}'.format(i)})
+        for i in range(6, 9)
+    ]
+    change_ids = database_service.changes_service.register_changes(
+        article_records,
+        ChangeType.UPDATE
+    )
+
+    assert len(change_ids) == len(article_records)
+    for change_id, article_record in zip(change_ids, article_records):
+        check_change = dict(
+            database_service.changes_service.changes_db_manager.database[
+                change_id])
+        assert check_change['document_id'] == article_record['document_id']
+        assert check_change['type'] == ChangeType.UPDATE.value
+
+
+def test_changes_sequence_is_not_reserved_in_blocks():
+    # com blocos, os change_ids não seguem a ordem de registro entre
+    # processos e o feed de mudanças perderia registros
+    with pytest.raises(ValueError):
+        ChangesService(
+            InMemoryDBManager(database_name='changes'),
+            SeqNumGenerator(InMemoryDBManager(database_name='seqnum'),
+                            'CHANGE', block_size=100)
+        )
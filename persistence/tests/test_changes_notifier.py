@@ -0,0 +1,91 @@
+import threading
+from unittest.mock import Mock
+
+from persistence.changes_notifier import ChangesNotifier
+from persistence.changes_writer import ChangesWriter
+from persistence.databases import InMemoryDBManager
+from persistence.seqnum_generator import SeqNumGenerator
+from persistence.services import ChangesService, ChangeType
+
+
+def test_changes_notifier_wait_returns_when_notified():
+    changes_notifier = ChangesNotifier()
+    version = changes_notifier.version
+    threading.Timer(0.05, changes_notifier.notify).start()
+    assert changes_notifier.wait(version, 5) is True
+
+
+def test_changes_notifier_wait_does_not_miss_previous_notification():
+    changes_notifier = ChangesNotifier()
+    version = changes_notifier.version
+    changes_notifier.notify()
+    assert changes_notifier.wait(version, 0) is True
+
+
+def test_changes_notifier_wait_times_out():
+    changes_notifier = ChangesNotifier()
+    assert changes_notifier.wait(changes_notifier.version, 0.01) is False
+
+
+def test_changes_notifier_follows_database_changes():
+    changes_db_manager = Mock()
+    followed = threading.Event()
+
+    def wait_changes(since, timeout):
+        if followed.is_set():
+            threading.Event().wait()
+        followed.set()
+        return '1-abc', 1
+
+    changes_db_manager.wait_changes.side_effect = wait_changes
+    changes_notifier = ChangesNotifier(changes_db_manager)
+    assert changes_notifier.wait(0, 5) is True
+    changes_db_manager.wait_changes.assert_any_call('now', 25)
+
+
+def test_changes_service_notifies_registered_change():
+    changes_notifier = ChangesNotifier()
+    changes_service = ChangesService(
+        InMemoryDBManager(database_name='changes'),
+        SeqNumGenerator(InMemoryDBManager(database_name='seqnum'), 'CHANGE'),
+        changes_notifier=changes_notifier
+    )
+    changes_service.register_change(
+        {'document_id': 'ID', 'document_type': 'ART'},
+        ChangeType.CREATE
+    )
+    assert changes_notifier.version == 1
+
+
+def test_changes_service_buffered_notifies_after_write():
+    changes_notifier = ChangesNotifier()
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_writer = ChangesWriter(changes_db_manager, batch_size=10,
+                                   flush_interval=60,
+                                   changes_notifier=changes_notifier)
+    changes_service = ChangesService(
+        changes_db_manager,
+        SeqNumGenerator(InMemoryDBManager(database_name='seqnum'), 'CHANGE'),
+        changes_writer=changes_writer,
+        changes_notifier=changes_notifier
+    )
+    notified = []
+    changes_notifier.notify = Mock(side_effect=lambda: notified.append(
+        len(changes_db_manager.find({}, [], []))))
+    changes_service.register_change(
+        {'document_id': 'ID', 'document_type': 'ART'},
+        ChangeType.CREATE
+    )
+    assert notified == []
+    changes_writer.close()
+    # os consumidores são avisados quando o registro já está na base
+    assert notified == [1]
+
+
+def test_changes_notifier_limits_waiters():
+    changes_notifier = ChangesNotifier(max_waiters=2)
+    assert changes_notifier.acquire_waiter()
+    assert changes_notifier.acquire_waiter()
+    assert not changes_notifier.acquire_waiter()
+    changes_notifier.release_waiter()
+    assert changes_notifier.acquire_waiter()
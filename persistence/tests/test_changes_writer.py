@@ -0,0 +1,104 @@
+import os
+from unittest.mock import Mock, patch
+
+from persistence.changes_writer import ChangesWriter
+from persistence.databases import InMemoryDBManager, UpdateFailure
+from persistence.seqnum_generator import SeqNumGenerator
+from persistence.services import ChangesService, ChangeType
+
+
+def get_change_record(sequential):
+    return {
+        'change_id': sequential,
+        'document_id': 'DOC-ID-{}'.format(sequential),
+        'record_id': str(sequential),
+    }
+
+
+def test_changes_writer_flush_writes_batches():
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_db_manager.create_many = Mock(
+        wraps=changes_db_manager.create_many)
+    changes_writer = ChangesWriter(changes_db_manager,
+                                   batch_size=2,
+                                   flush_interval=60)
+    for sequential in range(1, 6):
+        changes_writer.write(get_change_record(sequential))
+    changes_writer.close()
+
+    assert changes_db_manager.create_many.call_count == 3
+    assert sorted(changes_db_manager.database.keys()) == \
+        ['1', '2', '3', '4', '5']
+
+
+def test_changes_writer_writes_queue_first_when_queue_is_full():
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_db_manager.create_many = Mock(
+        wraps=changes_db_manager.create_many)
+    changes_writer = ChangesWriter(changes_db_manager,
+                                   flush_interval=60,
+                                   queue_size=1)
+    changes_writer._ensure_started = Mock()
+    changes_writer.write(get_change_record(1))
+    assert len(changes_db_manager.database) == 0
+    changes_writer.write(get_change_record(2))
+
+    # o registro mais antigo, já enfileirado, é persistido antes
+    changes_db_manager.create_many.assert_called_once()
+    documents = changes_db_manager.create_many.call_args[0][0]
+    assert [record_id for record_id, record in documents] == ['1', '2']
+
+
+def test_changes_writer_writes_synchronously_after_close():
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_writer = ChangesWriter(changes_db_manager, flush_interval=60)
+    changes_writer.write(get_change_record(1))
+    changes_writer.close()
+    assert not changes_writer._thread.is_alive()
+    changes_writer.write(get_change_record(2))
+
+    assert sorted(changes_db_manager.database.keys()) == ['1', '2']
+
+
+@patch('persistence.changes_writer.CLOSE_TIMEOUT', 0.01)
+def test_changes_writer_close_does_not_wait_forever():
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_writer = ChangesWriter(changes_db_manager, flush_interval=60)
+    changes_writer._thread = Mock()
+    changes_writer._pid = os.getpid()
+    changes_writer.write(get_change_record(1))
+    changes_writer.close()
+
+    changes_writer._thread.join.assert_called_once_with(0.01)
+    assert list(changes_db_manager.database.keys()) == ['1']
+
+
+def test_changes_writer_retries_failed_records_one_by_one():
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_db_manager.create_many = Mock(
+        return_value=[('1', None), ('2', UpdateFailure('conflict'))])
+    changes_db_manager.create = Mock()
+    changes_writer = ChangesWriter(changes_db_manager)
+    changes_writer._write_batch([get_change_record(1), get_change_record(2)])
+
+    changes_db_manager.create.assert_called_once_with(
+        '2', get_change_record(2))
+
+
+def test_changes_service_uses_changes_writer():
+    changes_db_manager = InMemoryDBManager(database_name='changes')
+    changes_writer = Mock()
+    changes_service = ChangesService(
+        changes_db_manager,
+        SeqNumGenerator(InMemoryDBManager(database_name='seqnum'), 'CHANGE'),
+        changes_writer
+    )
+    record_id = changes_service.register_change(
+        {'document_id': 'ID', 'document_type': 'ART'},
+        ChangeType.CREATE
+    )
+
+    change_record = changes_writer.write.call_args[0][0]
+    assert change_record['record_id'] == record_id
+    assert change_record['document_id'] == 'ID'
+    assert len(changes_db_manager.database) == 0
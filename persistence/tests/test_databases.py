@@ -1,14 +1,20 @@
-from unittest.mock import patch
+import io
+from unittest.mock import patch, MagicMock
 
+import couchdb
 import pytest
 from datetime import datetime
 from uuid import uuid4
 
 from persistence.databases import (
     DocumentNotFound,
+    UpdateFailure,
     sort_results,
     DBFailed,
     CouchDBManager,
+    InMemoryDBManager,
+    QueryOperator,
+    translate_filter,
 )
 from persistence.services import (
     ChangesService,
@@ -53,6 +59,94 @@ def test_register_document_register_change(mocked_register_change,
                                               ChangeType.CREATE)
 
 
+def test_register_many_documents(database_service):
+    article_records = [
+        get_article_record({'Test': 'TestMany{}'.format(i)})
+        for i in range(3)
+    ]
+    results = database_service.register_many(
+        [
+            (article_record['document_id'], article_record)
+            for article_record in article_records
+        ]
+    )
+    assert results == [
+        (article_record['document_id'], None)
+        for article_record in article_records
+    ]
+    records_check = database_service.read_many(
+        [article_record['document_id'] for article_record in article_records]
+    )
+    for record_check, article_record in zip(records_check, article_records):
+        assert record_check['document_id'] == article_record['document_id']
+        assert record_check['content'] == article_record['content']
+        assert record_check['created_date'] is not None
+
+
+@patch.object(ChangesService, 'register_changes')
+def test_register_many_documents_register_changes(mocked_register_changes,
+                                                  database_service):
+    article_record = get_article_record({'Test': 'TestMany'})
+    database_service.register(
+        article_record['document_id'],
+        article_record
+    )
+    new_article_record = get_article_record({'Test': 'TestMany'})
+    results = database_service.register_many(
+        [
+            (article_record['document_id'], dict(article_record)),
+            (new_article_record['document_id'], new_article_record),
+        ]
+    )
+    assert results[0][0] == article_record['document_id']
+    assert isinstance(results[0][1], UpdateFailure)
+    assert results[1] == (new_article_record['document_id'], None)
+    mocked_register_changes.assert_called_once_with([new_article_record],
+                                                    ChangeType.CREATE)
+
+
+def test_read_many_documents_not_found(database_service):
+    article_record = get_article_record({'Test': 'TestMany'})
+    database_service.register(
+        article_record['document_id'],
+        article_record
+    )
+    records_check = database_service.read_many(
+        ['336abebdd31894idnaoexistente', article_record['document_id']]
+    )
+    assert records_check[0] is None
+    assert records_check[1]['document_id'] == article_record['document_id']
+
+
+def test_update_many_documents(database_service):
+    article_records = [
+        get_article_record({'Test': 'TestMany{}'.format(i)})
+        for i in range(2)
+    ]
+    for article_record in article_records:
+        database_service.register(
+            article_record['document_id'],
+            article_record
+        )
+    updated = database_service.read(article_records[0]['document_id'])
+    updated['content'] = {'Test': 'TestMany-updated'}
+    outdated = database_service.read(article_records[1]['document_id'])
+    outdated['document_rev'] = 'outdated'
+    results = database_service.update_many(
+        [
+            (updated['document_id'], updated),
+            (outdated['document_id'], outdated),
+            ('336abebdd31894idnaoexistente', dict(updated)),
+        ]
+    )
+    assert results[0] == (updated['document_id'], None)
+    assert isinstance(results[1][1], UpdateFailure)
+    assert isinstance(results[2][1], DocumentNotFound)
+    record_check = database_service.read(updated['document_id'])
+    assert record_check['content'] == {'Test': 'TestMany-updated'}
+    assert record_check['updated_date'] is not None
+
+
 def test_read_document(database_service):
     article_record = get_article_record({'Test': 'Test2'})
     database_service.register(
@@ -77,6 +171,411 @@ def test_db_failed(article_db_settings):
         db_manager.database
 
 
+def test_couchdb_database_timeout(article_db_settings):
+    db_manager = CouchDBManager(database_timeout=5.0, **article_db_settings)
+    session = db_manager._db_server.resource.session
+    assert session.connection_pool.timeout == 5.0
+
+
+def test_couchdb_database_is_resolved_once(article_db_settings):
+    db_server = MagicMock()
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    db_manager.database
+    db_manager.database
+    db_server.__getitem__.assert_called_once_with(
+        article_db_settings['database_name'])
+
+
+def test_couchdb_database_is_resolved_again_if_database_is_missing(
+        article_db_settings):
+    database = MagicMock()
+    database.__getitem__.side_effect = [
+        couchdb.http.ResourceNotFound(
+            ('not_found', 'Database does not exist.')),
+        {'_id': 'ID', '_rev': '1-a'},
+    ]
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    doc = db_manager.read('ID')
+    assert doc['document_rev'] == '1-a'
+    assert db_server.__getitem__.call_count == 2
+
+
+def test_couchdb_database_missing_is_not_created(article_db_settings):
+    db_server = MagicMock()
+    db_server.__getitem__.side_effect = couchdb.http.ResourceNotFound(
+        ('not_found', 'Database does not exist.'))
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    with pytest.raises(DBFailed):
+        db_manager.database
+    db_server.create.assert_not_called()
+
+
+def test_couchdb_dropped_database_is_not_created_again(article_db_settings):
+    missing = couchdb.http.ResourceNotFound(
+        ('not_found', 'Database does not exist.'))
+    database = MagicMock()
+    database.__getitem__.side_effect = missing
+    db_server = MagicMock()
+    db_server.__getitem__.side_effect = [database, missing]
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    with pytest.raises(DBFailed):
+        db_manager.read('ID')
+    db_server.create.assert_not_called()
+
+
+def test_couchdb_create_database_creates_missing_database(
+        article_db_settings):
+    db_server = MagicMock()
+    db_server.__getitem__.side_effect = couchdb.http.ResourceNotFound(
+        ('not_found', 'Database does not exist.'))
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    db_manager.create_database()
+    db_server.create.assert_called_once_with(
+        article_db_settings['database_name'])
+    assert db_manager.database is db_server.create.return_value
+
+
+def test_couchdb_read_document_not_found_keeps_database(article_db_settings):
+    database = MagicMock()
+    database.__getitem__.side_effect = couchdb.http.ResourceNotFound(
+        ('not_found', 'missing'))
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    with pytest.raises(DocumentNotFound):
+        db_manager.read('ID')
+    db_server.__getitem__.assert_called_once_with(
+        article_db_settings['database_name'])
+
+
+def test_couchdb_wait_changes_uses_longpoll_feed(article_db_settings):
+    database = MagicMock()
+    database.changes.return_value = {
+        'results': [{'seq': '2-b', 'id': 'ID'}],
+        'last_seq': '2-b',
+    }
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    assert db_manager.wait_changes('1-a', 10) == ('2-b', 1)
+    database.changes.assert_called_once_with(feed='longpoll',
+                                             since='1-a',
+                                             timeout=10000)
+
+
+def test_couchdb_find_uses_declared_index(change_db_settings):
+    database = MagicMock()
+    database.index.return_value = [
+        {
+            'ddoc': None,
+            'name': '_all_docs',
+            'type': 'special',
+            'def': {'fields': [{'_id': 'asc'}]},
+        },
+        {
+            'ddoc': '_design/change_id',
+            'name': 'change_id',
+            'type': 'json',
+            'def': {'fields': [{'change_id': 'asc'}]},
+        },
+    ]
+    database.find.return_value = []
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **change_db_settings)
+    for __ in range(2):
+        db_manager.find(
+            filter={'change_id': [(QueryOperator.GREATER_THAN, 1)]},
+            fields=['change_id'],
+            sort=[{'change_id': 'asc'}],
+            limit=10
+        )
+    database.index.assert_called_once_with()
+    assert database.find.call_args[0][0]['use_index'] == [
+        '_design/change_id', 'change_id']
+
+
+def test_couchdb_create_indexes_creates_missing_indexes(article_db_settings):
+    database = MagicMock()
+    database.index.return_value.__iter__.return_value = iter([])
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    db_manager.create_indexes()
+    database.index.return_value.__setitem__.assert_called_once_with(
+        ('document_type_created_date', 'document_type_created_date'),
+        [{'document_type': 'asc'}, {'created_date': 'asc'}]
+    )
+    assert db_manager._get_indexes() == {
+        ('document_type', 'created_date'): (
+            '_design/document_type_created_date',
+            'document_type_created_date'
+        )
+    }
+
+
+def test_couchdb_open_attachment_streams_content(article_db_settings):
+    content = MagicMock()
+    database = MagicMock()
+    database.resource.return_value.get.return_value = (
+        200,
+        {
+            'Content-Type': 'image/jpeg',
+            'Content-Length': '123456',
+            'ETag': '"q83vEjRWeJA="',
+        },
+        content
+    )
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    assert db_manager.open_attachment('ID', 'a.jpg') == (
+        content, {
+            'content_type': 'image/jpeg',
+            'content_size': 123456,
+            'digest': 'md5-q83vEjRWeJA=',
+        })
+    database.resource.assert_called_once_with('ID', 'a.jpg')
+    content.read.assert_not_called()
+
+
+def test_couchdb_open_attachment_range(article_db_settings):
+    database = MagicMock()
+    database.resource.return_value.get.return_value = (
+        206,
+        {
+            'Content-Type': 'image/jpeg',
+            'Content-Length': '10',
+            'Content-Range': 'bytes 10-19/100',
+        },
+        io.BytesIO(bytes(range(10, 20)))
+    )
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    content, properties = db_manager.open_attachment('ID', 'a.jpg', (10, 20))
+    assert content.read() == bytes(range(10, 20))
+    assert properties['content_size'] == 100
+    database.resource.return_value.get.assert_called_once_with(
+        headers={'Range': 'bytes=10-19'})
+
+
+def test_couchdb_open_attachment_range_ignored_by_server(
+        article_db_settings):
+    database = MagicMock()
+    database.resource.return_value.get.return_value = (
+        200,
+        {'Content-Type': 'text/xml', 'Content-Length': '100'},
+        io.BytesIO(bytes(range(100)))
+    )
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    content, properties = db_manager.open_attachment('ID', 'a.xml', (10, 20))
+    assert content.read(4) == bytes(range(10, 14))
+    assert content.read() == bytes(range(14, 20))
+    assert content.read() == b''
+    assert properties['content_size'] == 100
+
+
+def test_couchdb_open_attachment_empty(article_db_settings):
+    database = MagicMock()
+    database.resource.return_value.get.return_value = (
+        200,
+        {'Content-Type': 'text/plain', 'Content-Length': '0'},
+        None
+    )
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    content, properties = db_manager.open_attachment('ID', 'a.txt')
+    assert content.read() == b''
+    assert properties['content_size'] == 0
+
+
+def test_couchdb_read_version(article_db_settings):
+    database = MagicMock()
+    database.__getitem__.return_value = {
+        '_id': 'ID',
+        '_rev': '2-abc',
+        'created_date': '1500000000.0',
+        '_attachments': {
+            'a.jpg': {
+                'content_type': 'image/jpeg',
+                'revpos': 2,
+                'digest': 'md5-abc',
+                'length': 100,
+                'stub': True,
+            },
+        },
+    }
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    assert db_manager.read_version('ID') == {
+        'document_rev': '2-abc',
+        'created_date': '1500000000.0',
+        'updated_date': None,
+        'attachments': {
+            'a.jpg': {
+                'content_type': 'image/jpeg',
+                'content_size': 100,
+                'digest': 'md5-abc',
+            },
+        },
+    }
+
+
+def test_create_with_attachments_existing_document(database_service):
+    document_id = 'ID'
+    database_service.db_manager.create_with_attachments(
+        document_id, {'document_id': document_id}, [])
+    with pytest.raises(UpdateFailure):
+        database_service.db_manager.create_with_attachments(
+            document_id, {'document_id': document_id}, [])
+
+
+def test_couchdb_create_with_attachments_conflict(article_db_settings):
+    database = MagicMock()
+    database.__setitem__.side_effect = couchdb.http.ResourceConflict(
+        ('conflict', 'Document update conflict.'))
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    with pytest.raises(UpdateFailure):
+        db_manager.create_with_attachments(
+            'ID', {'content': 'x'},
+            [('a.jpg', b'a', {'content_type': 'image/jpeg'})])
+
+
+def test_couchdb_update_with_attachments(article_db_settings):
+    database = MagicMock()
+    database.__getitem__.return_value = {
+        '_id': 'ID',
+        '_rev': '2-abc',
+        '_attachments': {
+            'a.jpg': {'content_type': 'image/jpeg', 'stub': True},
+            'b.jpg': {'content_type': 'image/jpeg', 'stub': True},
+        },
+    }
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    db_manager.update_with_attachments(
+        'ID',
+        {'document_rev': '2-abc', 'content': 'x'},
+        [('c.jpg', b'c', {'content_type': 'image/jpeg'})],
+        removed=['b.jpg']
+    )
+    database.__setitem__.assert_called_once()
+    id, doc = database.__setitem__.call_args[0]
+    assert id == 'ID'
+    assert doc['content'] == 'x'
+    assert doc['_attachments'] == {
+        'a.jpg': {'content_type': 'image/jpeg', 'stub': True},
+        'c.jpg': {'content_type': 'image/jpeg', 'data': 'Yw=='},
+    }
+
+
+def test_couchdb_update_with_attachments_out_of_date(article_db_settings):
+    database = MagicMock()
+    database.__getitem__.return_value = {'_id': 'ID', '_rev': '3-def'}
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    with pytest.raises(UpdateFailure):
+        db_manager.update_with_attachments(
+            'ID', {'document_rev': '2-abc'}, [])
+    database.__setitem__.assert_not_called()
+
+
+def test_couchdb_head_attachment(article_db_settings):
+    database = MagicMock()
+    database.resource.return_value.head.return_value = (
+        200,
+        {
+            'Content-Type': 'image/jpeg',
+            'Content-Length': '100',
+            'ETag': '"q83vEjRWeJA="',
+        },
+        None
+    )
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    assert db_manager.head_attachment('ID', 'a.jpg') == {
+        'content_type': 'image/jpeg',
+        'content_size': 100,
+        'digest': 'md5-q83vEjRWeJA=',
+    }
+
+
+def test_couchdb_attachment_digest_matches_read_version(
+        article_db_settings):
+    # o CouchDB informa o MD5 sem prefixo no ETag do anexo e com o prefixo
+    # md5- nos metadados (stubs) dos anexos do documento
+    database = MagicMock()
+    database.__getitem__.return_value = {
+        '_id': 'ID',
+        '_rev': '2-abc',
+        '_attachments': {
+            'a.jpg': {
+                'content_type': 'image/jpeg',
+                'digest': 'md5-q83vEjRWeJA=',
+                'length': 3,
+                'stub': True,
+            },
+        },
+    }
+    headers = {
+        'Content-Type': 'image/jpeg',
+        'Content-Length': '3',
+        'ETag': '"q83vEjRWeJA="',
+    }
+    database.resource.return_value.head.return_value = (200, headers, None)
+    database.resource.return_value.get.return_value = (
+        200, headers, io.BytesIO(b'abc'))
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    digest = db_manager.read_version('ID')['attachments']['a.jpg']['digest']
+    assert db_manager.head_attachment('ID', 'a.jpg')['digest'] == digest
+    assert db_manager.open_attachment('ID', 'a.jpg')[1]['digest'] == digest
+
+
+def test_couchdb_open_attachment_not_found(article_db_settings):
+    database = MagicMock()
+    database.resource.return_value.get.side_effect = \
+        couchdb.http.ResourceNotFound(('not_found', 'Document is missing'))
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **article_db_settings)
+    with pytest.raises(DocumentNotFound):
+        db_manager.open_attachment('ID', 'a.jpg')
+
+
 def test_read_document_not_found(database_service):
     pytest.raises(
         DocumentNotFound,
@@ -210,6 +709,48 @@ def test_put_attachment_to_document(database_service, xml_test):
     )
 
 
+def test_register_document_with_attachments(database_service, xml_test):
+    article_record = get_article_record({'Test': 'Test14'})
+    file_properties = {
+        'content_type': "text/xml",
+        'content_size': len(xml_test)
+    }
+    database_service.register_with_attachments(
+        article_record['document_id'],
+        article_record,
+        [
+            ('file1', xml_test.encode('utf-8'), file_properties),
+            ('file2', b'file2', {'content_type': None, 'content_size': 5}),
+        ]
+    )
+
+    record_check = database_service.read(article_record['document_id'])
+    assert sorted(record_check['attachments']) == ['file1', 'file2']
+    assert database_service.get_attachment(
+        article_record['document_id'], 'file1') == xml_test.encode('utf-8')
+    assert database_service.get_attachment_properties(
+        article_record['document_id'], 'file1') == file_properties
+
+
+@patch.object(ChangesService, 'register_change')
+def test_register_document_with_attachments_register_change(
+        mocked_register_change, database_service, xml_test):
+    article_record = get_article_record({'Test': 'Test15'})
+    database_service.register_with_attachments(
+        article_record['document_id'],
+        article_record,
+        [
+            ('file1', xml_test.encode('utf-8'), {
+                'content_type': "text/xml",
+                'content_size': len(xml_test)
+            })
+        ]
+    )
+
+    mocked_register_change.assert_called_once_with(article_record,
+                                                   ChangeType.CREATE)
+
+
 def test_put_attachment_to_document_update_dates(database_service,
                                                  xml_test):
     article_record = get_article_record({'Test': 'Test9'})
@@ -418,6 +959,54 @@ def test_sort_result():
     assert expected == got
 
 
+def test_sort_result_with_limit_and_missing_values():
+    results = [
+        {'name': 'F', 'num': 200},
+        {'name': 'Ana'},
+        {'name': 'B', 'num': None},
+        {'name': 'C', 'num': 500},
+        {'name': 'D', 'num': 200},
+    ]
+    got = sort_results(results, [{'num': 'asc'}, {'name': 'desc'}], 3)
+    assert [doc['name'] for doc in got] == ['B', 'Ana', 'F']
+
+    got = sort_results(results, [{'num': 'desc'}], 2)
+    assert [doc['name'] for doc in got] == ['C', 'F']
+
+    got = sort_results(results, [], 2)
+    assert got == results[:2]
+
+
+def test_inmemory_find_applies_limit_after_sort(test_documents_records):
+    db_manager = InMemoryDBManager(database_name='articles')
+    for document_record in test_documents_records:
+        db_manager.create(document_record['document_id'],
+                          dict(document_record))
+
+    check_list = db_manager.find(
+        filter={
+            'document_id': [
+                (QueryOperator.GREATER_THAN,
+                 test_documents_records[1]['document_id'])
+            ]
+        },
+        fields=['document_id'],
+        sort=[{'document_id': 'desc'}],
+        limit=3
+    )
+    assert check_list == [
+        {'document_id': document_record['document_id']}
+        for document_record in test_documents_records[:-4:-1]
+    ]
+
+    check_list = db_manager.find(filter={},
+                                 fields=[],
+                                 sort=[{'document_id': 'desc'}],
+                                 limit=1)
+    assert check_list[0]['document_id'] == \
+        test_documents_records[-1]['document_id']
+
+
 def test_add_attachment_properties(database_service, xml_test):
     file_properties1 = {
             'content_type': "text/xml",
@@ -444,6 +1033,84 @@ def test_add_attachment_properties(database_service, xml_test):
     assert expected[key] == article_record[key]
 
 
+def test_open_attachment(database_service, xml_test):
+    article_record = get_article_record({'Test': 'Test14'})
+    database_service.register(
+        article_record['document_id'],
+        article_record
+    )
+    database_service.put_attachment(
+        document_id=article_record['document_id'],
+        file_id='href_file',
+        content=xml_test.encode('utf-8'),
+        file_properties={
+            'content_type': 'text/xml',
+            'content_size': len(xml_test.encode('utf-8'))
+        }
+    )
+    content, properties = database_service.open_attachment(
+        article_record['document_id'], 'href_file')
+    assert content.read() == xml_test.encode('utf-8')
+    content, __ = database_service.open_attachment(
+        article_record['document_id'], 'href_file', (1, 5))
+    assert content.read() == xml_test.encode('utf-8')[1:5]
+    assert database_service.head_attachment(
+        article_record['document_id'], 'href_file')['content_size'] == \
+        len(xml_test.encode('utf-8'))
+    version = database_service.read_version(article_record['document_id'])
+    assert version['document_rev'] == \
+        database_service.read(article_record['document_id'])['document_rev']
+    assert version['attachments']['href_file'] == \
+        database_service.head_attachment(
+            article_record['document_id'], 'href_file')
+    assert properties['content_type'] == 'text/xml'
+    assert properties['content_size'] == len(xml_test.encode('utf-8'))
+    with pytest.raises(DocumentNotFound):
+        database_service.open_attachment(
+            article_record['document_id'], 'missing')
+
+
+def _text_properties(sha1):
+    return {'content_type': 'text/plain', 'content_size': 1, 'sha1': sha1}
+
+
+def test_update_with_attachments(database_service):
+    article_record = get_article_record({'Test': 'Test15'})
+    document_id = article_record['document_id']
+    database_service.register_with_attachments(
+        document_id,
+        article_record,
+        [
+            ('a.txt', b'a', _text_properties('A')),
+            ('b.txt', b'b', _text_properties('B')),
+        ]
+    )
+    registered = database_service.read_for_update(document_id)
+    assert registered['attachments_properties']['a.txt']['sha1'] == 'A'
+    assert 'attachments_properties' not in database_service.read(document_id)
+
+    article_record.update({
+        'content': {'Test': 'Test15-updated'},
+        'document_rev': registered['document_rev'],
+        'attachments_properties': registered['attachments_properties'],
+    })
+    database_service.update_with_attachments(
+        document_id,
+        article_record,
+        [('c.txt', b'c', _text_properties('C'))],
+        ['b.txt']
+    )
+    updated = database_service.read_for_update(document_id)
+    assert updated['content'] == {'Test': 'Test15-updated'}
+    assert sorted(updated['attachments']) == ['a.txt', 'c.txt']
+    assert sorted(updated['attachments_properties']) == ['a.txt', 'c.txt']
+    assert updated['attachments_properties']['c.txt']['sha1'] == 'C'
+    content, __ = database_service.open_attachment(document_id, 'a.txt')
+    assert content.read() == b'a'
+    content, __ = database_service.open_attachment(document_id, 'c.txt')
+    assert content.read() == b'c'
+
+
 def test_get_attachment_properties(database_service, xml_test):
 
     article_record = get_article_record({'Test': 'Test11'})
@@ -503,3 +1170,265 @@ def compare_documents(document, expected):
             assert document[k] == expected[k]
     else:
         assert document == expected
+
+
+@pytest.mark.parametrize('ordered', [False, True])
+def test_inmemory_find_uses_index(test_documents_records, find_criteria_result,
+                                  ordered):
+    find_args, expected = find_criteria_result
+    db_manager = InMemoryDBManager(database_name='articles')
+    db_manager.create_index('document_id', ordered=ordered)
+    for document_record in test_documents_records:
+        db_manager.create(document_record['document_id'],
+                          dict(document_record))
+
+    check_list = db_manager.find(**find_args)
+    assert len(check_list) == len(expected)
+    for check_document, expected_document in zip(check_list, expected):
+        compare_documents(check_document, expected_document)
+
+
+def test_inmemory_find_by_sorted_index_reads_only_selected_documents(
+        test_changes_records):
+    db_manager = InMemoryDBManager(database_name='changes')
+    db_manager.create_index('change_id', ordered=True)
+    for change_record in test_changes_records:
+        db_manager.create(change_record['change_id'], change_record)
+    read_ids = []
+
+    class Database(dict):
+        def __getitem__(self, id):
+            read_ids.append(id)
+            return super().__getitem__(id)
+
+    db_manager._database[db_manager._database_name] = Database(
+        db_manager.database)
+
+    check_list = db_manager.find(
+        filter={
+            'change_id': [
+                (QueryOperator.GREATER_THAN,
+                 test_changes_records[2]['change_id'])
+            ]
+        },
+        fields=['change_id'],
+        sort=[{'change_id': 'desc'}],
+        limit=3
+    )
+    assert check_list == [
+        {'change_id': change_record['change_id']}
+        for change_record in test_changes_records[:-4:-1]
+    ]
+    assert len(read_ids) == 3
+
+
+def test_inmemory_index_is_kept_up_to_date():
+    db_manager = InMemoryDBManager(database_name='articles')
+    db_manager.create('ID-1', {'document_type': 'ART'})
+    db_manager.create('ID-2', {'document_type': 'ART'})
+    db_manager.create_index('document_type')
+    db_manager.create_index('revision', ordered=True)
+
+    doc = db_manager.read('ID-1')
+    db_manager.update('ID-1', {'document_type': 'ISS',
+                               'document_rev': doc['document_rev']})
+    db_manager.delete('ID-2')
+    db_manager.create('ID-3', {'document_type': 'ART'})
+
+    def find_ids(field_name, field_operator, value):
+        return [
+            doc['document_id']
+            for doc in db_manager.find(
+                filter={field_name: [(field_operator, value)]},
+                fields=['document_id'],
+                sort=[]
+            )
+        ]
+
+    for id in ('ID-1', 'ID-3'):
+        db_manager.database[id]['document_id'] = id
+    assert find_ids('document_type', QueryOperator.EQUAL, 'ART') == ['ID-3']
+    assert find_ids('document_type', QueryOperator.EQUAL, 'ISS') == ['ID-1']
+    assert find_ids('revision', QueryOperator.GREATER_THAN, 1) == ['ID-1']
+
+
+def test_translate_filter():
+    selector = translate_filter({
+        'document_type': 'ART',
+        'created_date': [
+            (QueryOperator.GREATER_THAN_EQUAL, '100'),
+            (QueryOperator.LESS_THAN, '200'),
+            (QueryOperator.NOT_EQUAL, '150'),
+            (QueryOperator.NOT_EQUAL, '160'),
+        ],
+        QueryOperator.OR: [
+            {'lang': [(QueryOperator.IN, ['en', 'es'])]},
+            {'lang': [(QueryOperator.EQUAL, None)]},
+        ],
+        QueryOperator.AND: [
+            {'size': [(QueryOperator.GREATER_THAN, 0)]},
+        ],
+    })
+    assert selector == {
+        'document_type': 'ART',
+        'created_date': {'$gte': '100', '$lt': '200', '$ne': '150'},
+        '$or': [
+            {'lang': {'$in': ['en', 'es']}},
+            {'lang': {'$eq': None}},
+        ],
+        '$and': [
+            {'created_date': {'$ne': '160'}},
+            {'size': {'$gt': 0}},
+        ],
+    }
+
+
+def test_couchdb_find_translates_filter(change_db_settings):
+    database = MagicMock()
+    database.index.return_value = []
+    database.find.return_value = []
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **change_db_settings)
+    filter = {
+        'change_id': [
+            (QueryOperator.GREATER_THAN, 10),
+            (QueryOperator.LESS_THAN_EQUAL, 20),
+        ]
+    }
+    db_manager.find(filter=filter, fields=[], sort=[])
+    assert database.find.call_args[0][0]['selector'] == {
+        'change_id': {'$gt': 10, '$lte': 20}
+    }
+    assert filter['change_id'][0] == (QueryOperator.GREATER_THAN, 10)
+
+
+@pytest.mark.parametrize('index', [None, False, True])
+def test_inmemory_find_multi_criteria(index):
+    db_manager = InMemoryDBManager(database_name='changes')
+    if index is not None:
+        db_manager.create_index('change_id', ordered=index)
+    for change_id in range(1, 11):
+        db_manager.create(str(change_id), {
+            'change_id': change_id,
+            'type': 'C' if change_id % 2 else 'U',
+        })
+
+    def find_ids(filter):
+        return [
+            doc['change_id']
+            for doc in db_manager.find(filter=filter,
+                                       fields=['change_id'],
+                                       sort=[{'change_id': 'asc'}])
+        ]
+
+    assert find_ids({
+        'change_id': [(QueryOperator.GREATER_THAN, None)]
+    }) == list(range(1, 11))
+    assert find_ids({
+        'change_id': [
+            (QueryOperator.GREATER_THAN, 3),
+            (QueryOperator.LESS_THAN_EQUAL, 6),
+        ]
+    }) == [4, 5, 6]
+    assert find_ids({
+        'change_id': [(QueryOperator.IN, [9, 2, 7])],
+        'type': 'C',
+    }) == [7, 9]
+    assert find_ids({
+        QueryOperator.OR: [
+            {'change_id': [(QueryOperator.LESS_THAN, 2)]},
+            {'change_id': [(QueryOperator.EQUAL, 10)]},
+        ]
+    }) == [1, 10]
+    assert find_ids({
+        QueryOperator.AND: [
+            {'change_id': [(QueryOperator.NOT_EQUAL, 1)]},
+            {'change_id': [(QueryOperator.NOT_EQUAL, 2)]},
+        ],
+        'change_id': [(QueryOperator.LESS_THAN, 5)],
+    }) == [3, 4]
+
+
+@pytest.mark.parametrize('index', [None, False, True])
+def test_inmemory_find_null_values(index):
+    db_manager = InMemoryDBManager(database_name='articles')
+    if index is not None:
+        db_manager.create_index('lang', ordered=index)
+    db_manager.create('ID-1', {'document_id': 'ID-1', 'lang': 'en'})
+    db_manager.create('ID-2', {'document_id': 'ID-2', 'lang': None})
+    db_manager.create('ID-3', {'document_id': 'ID-3'})
+
+    def find_ids(filter):
+        return [
+            doc['document_id']
+            for doc in db_manager.find(filter=filter,
+                                       fields=['document_id'],
+                                       sort=[{'document_id': 'asc'}])
+        ]
+
+    assert find_ids({'lang': [(QueryOperator.EQUAL, None)]}) == ['ID-2']
+    assert find_ids({'lang': None}) == ['ID-2']
+    assert find_ids({'lang': [(QueryOperator.IN, [None, 'en'])]}) == [
+        'ID-1', 'ID-2']
+    assert find_ids({'lang': [(QueryOperator.GREATER_THAN, None)]}) == [
+        'ID-1']
+    assert find_ids({'lang': [(QueryOperator.NOT_EQUAL, 'en')]}) == ['ID-2']
+
+
+def test_couchdb_iter_find_pages_with_bookmarks(change_db_settings):
+    database = MagicMock()
+    database.index.return_value = []
+    pages = [
+        {'docs': [{'change_id': 1}, {'change_id': 2}], 'bookmark': 'B1'},
+        {'docs': [{'change_id': 3}, {'change_id': 4}], 'bookmark': 'B2'},
+        {'docs': [{'change_id': 5}], 'bookmark': 'B3'},
+    ]
+    queries = []
+
+    def post_json(path, body):
+        queries.append(dict(body))
+        return 200, {}, pages[len(queries) - 1]
+
+    database.resource.post_json.side_effect = post_json
+    db_server = MagicMock()
+    db_server.__getitem__.return_value = database
+    db_manager = CouchDBManager(database_server=db_server,
+                                **change_db_settings)
+    documents = db_manager.iter_find(
+        filter={'change_id': [(QueryOperator.GREATER_THAN, None)]},
+        fields=['change_id'],
+        sort=[{'change_id': 'asc'}],
+        page_size=2
+    )
+    assert next(documents) == {'change_id': 1}
+    assert len(queries) == 1
+    assert [doc['change_id'] for doc in documents] == [2, 3, 4, 5]
+    assert [query.get('bookmark') for query in queries] == [None, 'B1', 'B2']
+    assert queries[0]['limit'] == 2
+
+
+@pytest.mark.parametrize('index', [False, True])
+def test_inmemory_iter_find(test_documents_records, index):
+    db_manager = InMemoryDBManager(database_name='articles')
+    if index:
+        db_manager.create_index('document_id', ordered=True)
+    for document_record in test_documents_records:
+        db_manager.create(document_record['document_id'],
+                          dict(document_record))
+    documents = db_manager.iter_find(
+        filter={
+            'document_id': [
+                (QueryOperator.GREATER_THAN,
+                 test_documents_records[4]['document_id'])
+            ]
+        },
+        fields=['field'],
+        sort=[{'document_id': 'desc'}],
+        limit=2
+    )
+    assert list(documents) == [
+        {'field': document_record['field']}
+        for document_record in test_documents_records[:-3:-1]
+    ]
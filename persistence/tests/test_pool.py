@@ -0,0 +1,85 @@
+from unittest.mock import patch
+
+from persistence.databases import CouchDBManager
+from persistence.pool import DBManagerPool
+
+
+def test_pool_returns_same_manager_for_same_settings(article_db_settings):
+    pool = DBManagerPool()
+    db_manager = pool.get(**article_db_settings)
+    assert isinstance(db_manager, CouchDBManager)
+    assert pool.get(**article_db_settings) is db_manager
+    assert len(pool) == 1
+
+
+def test_pool_shares_server_between_databases(article_db_settings,
+                                              change_db_settings):
+    pool = DBManagerPool()
+    articles_db_manager = pool.get(**article_db_settings)
+    changes_db_manager = pool.get(**change_db_settings)
+    assert articles_db_manager is not changes_db_manager
+    assert articles_db_manager._db_server is changes_db_manager._db_server
+    assert articles_db_manager._db_server.resource.credentials == (
+        article_db_settings['database_username'],
+        article_db_settings['database_password'],
+    )
+
+
+def test_pool_does_not_share_server_between_credentials(article_db_settings):
+    pool = DBManagerPool()
+    db_manager = pool.get(**article_db_settings)
+    article_db_settings['database_password'] = 'other'
+    other_db_manager = pool.get(**article_db_settings)
+    assert db_manager is not other_db_manager
+    assert db_manager._db_server is not other_db_manager._db_server
+
+
+def test_pool_discards_least_recently_used(article_db_settings,
+                                           change_db_settings,
+                                           seqnum_db_settings):
+    pool = DBManagerPool(max_size=2)
+    articles_db_manager = pool.get(**article_db_settings)
+    pool.get(**change_db_settings)
+    pool.get(**article_db_settings)
+    pool.get(**seqnum_db_settings)
+    assert len(pool) == 2
+    assert pool.get(**article_db_settings) is articles_db_manager
+
+
+@patch('persistence.pool.time.monotonic')
+def test_pool_discards_idle_managers(mocked_monotonic, article_db_settings):
+    pool = DBManagerPool(idle_timeout=10)
+    mocked_monotonic.return_value = 100
+    db_manager = pool.get(**article_db_settings)
+    mocked_monotonic.return_value = 105
+    assert pool.get(**article_db_settings) is db_manager
+    mocked_monotonic.return_value = 200
+    assert pool.get(**article_db_settings) is not db_manager
+
+
+def test_pool_shares_seqnum_generator(seqnum_db_settings):
+    pool = DBManagerPool()
+    seqnum_generator = pool.get_seqnum_generator('CHANGE', 10,
+                                                 **seqnum_db_settings)
+    assert seqnum_generator.block_size == 10
+    assert seqnum_generator.db_manager is pool.get(**seqnum_db_settings)
+    assert pool.get_seqnum_generator('CHANGE', 10,
+                                     **seqnum_db_settings) is seqnum_generator
+    assert pool.get_seqnum_generator('OTHER', 10,
+                                     **seqnum_db_settings) is not \
+        seqnum_generator
+
+
+def test_pool_releases_discarded_seqnum_generator(seqnum_db_settings):
+    pool = DBManagerPool()
+    seqnum_generator = pool.get_seqnum_generator('CHANGE', 10,
+                                                 **seqnum_db_settings)
+    with patch.object(seqnum_generator, 'release') as mocked_release:
+        pool.get_seqnum_generator('CHANGE', 20, **seqnum_db_settings)
+    mocked_release.assert_called_once_with()
+
+    seqnum_generator = pool.get_seqnum_generator('CHANGE', 20,
+                                                 **seqnum_db_settings)
+    with patch.object(seqnum_generator, 'release') as mocked_release:
+        pool.clear()
+    mocked_release.assert_called_once_with()
@@ -1,3 +1,11 @@
+from unittest.mock import Mock, patch
+
+import pytest
+from prometheus_client import REGISTRY
+
+from persistence.databases import InMemoryDBManager, UpdateFailure
+from persistence.seqnum_generator import SeqNumGenerator
+
 
 def test_sequential_number_zero(seqnumber_generator):
     assert seqnumber_generator.get()['SEQ'] == 0
@@ -17,3 +25,92 @@ def test_sequential_number_new_3(seqnumber_generator):
     assert seqnumber_generator.get()['SEQ'] == 2
     assert seqnumber_generator.new() == 3
     assert seqnumber_generator.get()['SEQ'] == 3
+
+
+@pytest.fixture
+def block_seqnumber_generator():
+    return SeqNumGenerator(
+        InMemoryDBManager(database_name='seqnum'),
+        'CHANGE',
+        block_size=10
+    )
+
+
+def test_sequential_number_block_reserves_once(block_seqnumber_generator):
+    assert [block_seqnumber_generator.new() for i in range(10)] == \
+        list(range(1, 11))
+    assert block_seqnumber_generator.get()['SEQ'] == 10
+    assert block_seqnumber_generator.new() == 11
+    assert block_seqnumber_generator.get()['SEQ'] == 20
+
+
+def test_sequential_number_blocks_do_not_overlap(block_seqnumber_generator):
+    other_seqnumber_generator = SeqNumGenerator(
+        block_seqnumber_generator.db_manager,
+        'CHANGE',
+        block_size=10
+    )
+    assert block_seqnumber_generator.new() == 1
+    assert other_seqnumber_generator.new() == 11
+    assert block_seqnumber_generator.new() == 2
+
+
+@patch('persistence.seqnum_generator.time.sleep')
+def test_sequential_number_block_retries_on_conflict(
+        mocked_sleep, block_seqnumber_generator):
+    db_manager = block_seqnumber_generator.db_manager
+    db_manager.update = Mock(side_effect=[UpdateFailure('conflict'), None])
+    assert block_seqnumber_generator.new() == 1
+    assert db_manager.update.call_count == 2
+    mocked_sleep.assert_called_once()
+
+
+@patch('persistence.seqnum_generator.time.sleep')
+def test_sequential_number_block_gives_up_after_max_retries(
+        mocked_sleep, block_seqnumber_generator):
+    db_manager = block_seqnumber_generator.db_manager
+    db_manager.update = Mock(side_effect=UpdateFailure('conflict'))
+    with pytest.raises(UpdateFailure):
+        block_seqnumber_generator.new()
+    assert db_manager.update.call_count == \
+        block_seqnumber_generator.max_retries
+
+
+def block_usage():
+    return (
+        REGISTRY.get_sample_value('seqnum_block_usage_ratio_count'),
+        REGISTRY.get_sample_value('seqnum_block_usage_ratio_sum'),
+    )
+
+
+def test_sequential_number_block_release_observes_usage(
+        block_seqnumber_generator):
+    count, total = block_usage()
+    for i in range(3):
+        block_seqnumber_generator.new()
+    block_seqnumber_generator.release()
+    assert block_usage() == (count + 1, pytest.approx(total + 0.3))
+    block_seqnumber_generator.release()
+    assert block_usage() == (count + 1, pytest.approx(total + 0.3))
+    assert block_seqnumber_generator.new() == 11
+
+
+def test_sequential_number_block_exhausted_is_observed(
+        block_seqnumber_generator):
+    count, total = block_usage()
+    for i in range(11):
+        block_seqnumber_generator.new()
+    assert block_usage() == (count + 1, pytest.approx(total + 1.0))
+    block_seqnumber_generator.release()
+    assert block_usage() == (count + 2, pytest.approx(total + 1.1))
+
+
+def test_sequential_number_block_exhausted_and_released_is_observed_once(
+        block_seqnumber_generator):
+    count, total = block_usage()
+    for i in range(10):
+        block_seqnumber_generator.new()
+    block_seqnumber_generator.release()
+    assert block_usage() == (count + 1, pytest.approx(total + 1.0))
+    block_seqnumber_generator.new()
+    assert block_usage() == (count + 1, pytest.approx(total + 1.0))
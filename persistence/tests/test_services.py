@@ -1,4 +1,4 @@
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 
 from persistence.databases import QueryOperator
 from persistence.services import ChangeType, SortOrder
@@ -100,6 +100,31 @@ def test_list_changes_returns_db_manager_find_limit(inmemory_db_setup,
         assert check_item['created_date'] is not None
 
 
+def test_iter_changes_iterates_db_manager_find(inmemory_db_setup,
+                                               test_changes_records):
+    _changes_db_manager = inmemory_db_setup.changes_service.changes_db_manager
+    for change_record in test_changes_records:
+        _changes_db_manager.create(
+            change_record['change_id'],
+            change_record)
+    with patch.object(_changes_db_manager, 'iter_find',
+                      wraps=_changes_db_manager.iter_find) as iter_find:
+        check_list = list(
+            inmemory_db_setup.iter_changes(last_sequence=None, page_size=3))
+    assert [check_item['change_id'] for check_item in check_list] == [
+        change_record['change_id'] for change_record in test_changes_records
+    ]
+    assert iter_find.call_args[1]['page_size'] == 3
+    assert check_list[0]['type'] == \
+        ChangeType(test_changes_records[0]['type']).name
+
+    check_list = list(
+        inmemory_db_setup.iter_changes(last_sequence=None,
+                                       limit=5,
+                                       page_size=3))
+    assert len(check_list) == 5
+
+
 def test_list_changes_returns_db_manager_find_no_changes(inmemory_db_setup,
                                                          test_changes_records,
                                                          xml_test):
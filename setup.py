@@ -8,7 +8,7 @@ requires = [
     'pyramid-mako>=1.0.2',
     'pyramid_debugtoolbar>=4.4',
     'waitress',
-    'lxml',
+    'lxml>=5.0',
     'cornice>=3.4.0',
     'prometheus_client>=0.2.0',
 ]
@@ -26,6 +26,9 @@ setup(
     url="https://github.com/scieloorg/catalogmanager",
     keywords='scielo catalogmanager',
     packages=find_packages(),
+    package_data={
+        'managers.xml': ['schemas/*'],
+    },
     classifiers=[
         "Development Status :: 1 - Planning",
         "Intended Audience :: Developers",
@@ -46,5 +49,9 @@ setup(
         'paste.app_factory': [
             'main = api:main',
         ],
+        'console_scripts': [
+            'provision_databases = api:provision_databases',
+            'ingest_packages = api:ingest_packages',
+        ],
     },
 )
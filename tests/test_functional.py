@@ -25,16 +25,6 @@ def test_add_article_register_change(testapp, test_package_A):
             assets_field.append(('asset_field',
                                  article_filename,
                                  file_content))
-            latest = int(changes_expected['latest']) + 1
-            changes_expected['results'].append(
-                {
-                    'change_id': latest,
-                    'document_id': article_id,
-                    'document_type': 'ART',
-                    'type': 'UPDATE'
-                }
-            )
-            changes_expected['latest'] = latest
     params = OrderedDict([
         ("id", article_id),
         ("xml_file", webtest.forms.Upload(xml_file_path))
@@ -92,7 +82,7 @@ def test_add_article_register_change(testapp, test_package_A):
                                                              limit))
     assert result.status_code == 200
     assert result.json is not None
-    assert len(result.json) > len(changes_expected['results'])
+    assert len(result.json) == len(changes_expected['results'])
     for resp_result, expected in zip(result.json, changes_expected['results']):
         assert resp_result['document_id'] == expected['document_id']
         assert resp_result['document_type'] == expected['document_type']